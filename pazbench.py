@@ -0,0 +1,503 @@
+"""
+PAZSAGE benchmark - runs the whole pipeline offline against a local stand-in for the OpenRouter
+chat completions API, so performance can be measured without paying for requests or waiting on the network.
+
+Run it with:   python pazbench.py --library demo --library 1000 --label my-change
+    --library demo      the bundled Agrivoltaics_RIS_open.ris and files/ folder
+    --library 1000      a synthetic library of 1000 items (made once, kept in the work folder)
+
+The stand-in server answers after --latency seconds (plus --jitter), fails --error-rate of the requests
+with a 429 or 500, and reports --completion-tokens tokens per answer. Audio is made by a stub Kokoro
+pipeline (--tts stub, default) that returns silence after --stub-rtf seconds of work per second of audio,
+or by the real model (--tts real, add --tts-fast for the CPU fast mode).
+
+python pazbench.py --tts-compare runs no library: it voices demo abstracts with Kokoro's default pipeline and
+with the CPU fast mode (TTS_FAST_CPU), then prints the real-time factor of each and how different the audio is.
+
+Each library runs in a fresh work folder with empty caches ("cold"), then --passes - 1 more times in the
+same folder ("warm", where everything should come from the caches and the manifest).
+Results are saved in --results-dir as JSON; pass --compare old_result.json to see what changed.
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pazsage
+
+REPO_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEMO_RIS = os.path.join(REPO_FOLDER, "Agrivoltaics_RIS_open.ris")
+# the stage columns shown in the results table
+TABLE_FIELDS = ("count", "total_seconds", "p50_seconds", "p90_seconds", "per_minute")
+# synthetic documents are made of these section headings filled with words from the demo abstracts
+SYNTHETIC_SECTIONS = ["Abstract", "Introduction", "Methods", "Results", "Discussion", "Conclusions", "References"]
+# share of the mock latency before a streamed answer starts
+STREAM_FIRST_TOKEN_SHARE = 0.3
+# roughly how many words Kokoro speaks per second, for sizing the stub pipeline's silence
+STUB_WORDS_PER_SECOND = 2.5
+# --tts-compare: the seed both pipelines start each sentence from, and the STFT used for the audio difference
+TTS_COMPARE_SEED = 1234
+STFT_SIZE = 1024
+STFT_HOP = 256
+STFT_FLOOR_DB = 60
+
+
+# ---------------------------------------------------------------
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    """A stand-in for the OpenAI style chat completions endpoint, settings live on the server object."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": {"code": 400, "message": "Body must be JSON."}})
+            return
+        server = self.server
+        latency = max(0.0, random.gauss(server.latency, server.jitter))
+        streaming = bool(request.get("stream"))
+        # a streamed answer starts after a share of the latency and spreads the rest over its pieces
+        time.sleep(latency * STREAM_FIRST_TOKEN_SHARE if streaming else latency)
+
+        if random.random() < server.error_rate:
+            code = random.choice((429, 500))
+            server.count("errors")
+            self.send_json(code, {"error": {"code": code, "message": "Injected error"}}, {"Retry-After": "1"} if code == 429 else None)
+            return
+
+        prompt = " ".join(str(message.get("content", "")) for message in request.get("messages", []))
+        prompt_tokens = pazsage.estimate_tokens(prompt)
+        words = max(1, int(server.completion_tokens * 0.75))
+        answer = " ".join(random.choice(server.vocabulary) for _ in range(words))
+        # end every dozen words with a full stop so the audio is split into sentences like a real answer
+        answer = re.sub(r"((?:\S+ ){11}\S+) ", r"\1. ", answer) + "."
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps({key: answer for key in pazsage.SUMMARY_SECTIONS})
+        else:
+            content = answer
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": server.completion_tokens,
+                 "total_tokens": prompt_tokens + server.completion_tokens,
+                 "cost": (prompt_tokens + server.completion_tokens) * server.cost_per_mtok / 1e6}
+        server.count("requests")
+        server.count("prompt_tokens", prompt_tokens)
+        if streaming:
+            self.send_event_stream(content, usage, latency * (1 - STREAM_FIRST_TOKEN_SHARE))
+            return
+        self.send_json(200, {"id": "bench", "model": request.get("model"),
+                             "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                             "usage": usage})
+
+    def send_json(self, code:int, body:dict, headers:dict = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_event_stream(self, content:str, usage:dict, seconds:float):
+        """Sends content as server-sent events a few words at a time over seconds, then the usage and [DONE]."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        pieces = re.findall(r"\S+\s*", content)
+        pieces = ["".join(pieces[i:i + 4]) for i in range(0, len(pieces), 4)] or [""]
+        self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+        for piece in pieces:
+            time.sleep(seconds / len(pieces))
+            chunk = {"id": "bench", "choices": [{"index": 0, "delta": {"content": piece}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(f"data: {json.dumps({'id': 'bench', 'choices': [], 'usage': usage})}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockChatServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency:float, jitter:float, error_rate:float, completion_tokens:int, cost_per_mtok:float, vocabulary:list):
+        super().__init__(("127.0.0.1", 0), MockChatHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.completion_tokens = completion_tokens
+        self.cost_per_mtok = cost_per_mtok
+        self.vocabulary = vocabulary
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def count(self, name:str, value:int = 1):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + value
+
+    def drain_stats(self)->dict:
+        with self.lock:
+            stats, self.stats = self.stats, {}
+            return stats
+
+    @property
+    def url(self)->str:
+        return f"http://127.0.0.1:{self.server_port}/api/v1/chat/completions"
+
+
+class StubPipeline:
+    """
+    Stands in for kokoro.KPipeline: returns silence the length Kokoro would speak the text for,
+    after rtf seconds of work per second of audio.
+    """
+    def __init__(self, rtf:float):
+        self.rtf = rtf
+
+    def __call__(self, text:str, voice:str = None):
+        import numpy as np
+        for sentence in pazsage.split_speech_segments(text):
+            seconds = len(sentence.split()) / STUB_WORDS_PER_SECOND
+            time.sleep(seconds * self.rtf)
+            yield sentence, None, np.zeros(int(seconds * 24000), dtype=np.float32)
+
+
+def init_stub_tts_worker(rtf:float, settings:dict, torch_threads:int):
+    """Stands in for pazsage.init_tts_worker: takes the settings and uses the stub pipeline instead of loading Kokoro."""
+    pazsage.init_worker(settings)
+    pazsage._pipeline = StubPipeline(rtf)
+
+
+# ---------------------------------------------------------------
+
+def demo_vocabulary()->list:
+    """Words from the abstracts of the demo library, used for synthetic documents and mock answers."""
+    words = []
+    for record in pazsage.read_ris_records(DEMO_RIS):
+        for line in record.lines:
+            if line.startswith("AB  - "):
+                words.extend(re.findall(r"[A-Za-z]{3,}", line[6:]))
+    return words or ["pollinator", "solar", "park", "habitat", "biodiversity"]
+
+def make_synthetic_library(folder:str, items:int, doc_words:int, vocabulary:list)->str:
+    """
+    Writes an RIS file of items synthetic papers, each with its own HTML document of about doc_words words.
+    The library is only made once per folder, later runs reuse it.
+
+    Returns: the path of the RIS file.
+    """
+    ris_path = os.path.join(folder, f"synthetic_{items}.ris")
+    if os.path.isfile(ris_path):
+        return ris_path
+    rng = random.Random(items)
+    per_section = max(1, doc_words // len(SYNTHETIC_SECTIONS))
+    with open(ris_path + ".tmp", "w", encoding="utf-8") as ris:
+        for n in range(1, items + 1):
+            doc = os.path.join("docs", str(n // 1000), f"{n}.html")
+            os.makedirs(os.path.join(folder, os.path.dirname(doc)), exist_ok=True)
+            with open(os.path.join(folder, doc), "w", encoding="utf-8") as f:
+                f.write(f"<html><head><title>Synthetic paper {n}</title><style>p {{}}</style></head><body>\n")
+                for section in SYNTHETIC_SECTIONS:
+                    words = [rng.choice(vocabulary) for _ in range(per_section)]
+                    sentences = [" ".join(words[i:i + 15]) + "." for i in range(0, len(words), 15)]
+                    f.write(f"<h2>{section}</h2>\n<p>{' '.join(sentences)}</p>\n")
+                f.write("</body></html>\n")
+            title = " ".join(rng.choice(vocabulary) for _ in range(8))
+            ris.write(f"TY  - JOUR\nID  - bench{n}\nTI  - Synthetic {n} {title}\n"
+                      f"AU  - {rng.choice(vocabulary)}, A.\nAU  - {rng.choice(vocabulary)}, B.\n"
+                      f"PY  - {rng.randint(1990, 2025)}\nDO  - 10.5555/bench.{n}\nL1  - {doc}\nER  - \n\n")
+    os.replace(ris_path + ".tmp", ris_path)
+    return ris_path
+
+def use_work_folder(work:str):
+    """Points pazsage's caches at a work folder, so every benchmarked library starts cold."""
+    os.makedirs(work, exist_ok=True)
+    # worker processes that are spawned rather than forked build their caches from the current folder
+    os.chdir(work)
+    pazsage.summary_cache = pazsage.SummaryCache(os.path.join(work, "cache", "summaries"), pazsage.SUMMARY_CACHE_MAX_BYTES)
+    pazsage.audio_cache = pazsage.AudioCache(os.path.join(work, "cache", "audio"), pazsage.AUDIO_CACHE_MAX_BYTES)
+    pazsage.text_cache = pazsage.TextCache(os.path.join(work, "cache", "text"), pazsage.TEXT_CACHE_MAX_BYTES)
+
+def run_library(name:str, ris_file:str, doc_folder:str, work:str, server:MockChatServer, args)->list:
+    """
+    Runs one library --passes times and returns a result per pass.
+    """
+    use_work_folder(work)
+    results = []
+    for number in range(args.passes):
+        label = "cold" if number == 0 else "warm"
+        print(f"\n=== {name}: {label} pass ===")
+        messages = []
+        runner = pazsage.LibraryProcessor(ris_file = ris_file,
+                                          doc_folder = doc_folder,
+                                          out_folder = os.path.join(work, "output"),
+                                          api_key = "bench",
+                                          model = args.model,
+                                          voice = "female",
+                                          structured = args.structured,
+                                          audio_format = args.audio_format,
+                                          work_folder = work,
+                                          status = lambda text: None,
+                                          done = lambda output_zip1, output_zip2, status: messages.append(status))
+        t0 = time.perf_counter()
+        runner.run()
+        wall = time.perf_counter() - t0
+        with open(runner.report_file, encoding="utf-8") as f:
+            report = json.load(f)
+        results.append({"library": name, "pass": label, "wall_seconds": round(wall, 3),
+                        "items_per_minute": round(report["items"] / wall * 60, 2),
+                        "outcome": messages[-1] if messages else "",
+                        "mock_server": server.drain_stats(),
+                        "report": report})
+    return results
+
+# ---------------------------------------------------------------
+
+def tts_sample_texts(count:int)->list:
+    """Abstracts from the demo library, cleaned the way a summary is before it is voiced."""
+    texts = []
+    for record in pazsage.read_ris_records(DEMO_RIS):
+        for line in record.lines:
+            if line.startswith("AB  - ") and len(texts) < count:
+                texts.append(pazsage.clean_text_for_speech(line[6:]))
+    return texts
+
+def voice_segments(pipeline, segments:list, voice:str, fast_cpu:bool)->tuple[list, float]:
+    """
+    Voices each segment with the same random seed (Kokoro's decoder adds noise), so two pipelines can be compared.
+    Returns: (one array of samples per segment, seconds of work)
+    """
+    import numpy as np
+    import torch
+    clips, seconds = [], 0.0
+    for segment in segments:
+        torch.manual_seed(TTS_COMPARE_SEED)
+        t0 = time.perf_counter()
+        parts = list(pazsage.iter_speech(segment, voice, pipeline, fast_cpu))
+        seconds += time.perf_counter() - t0
+        clips.append(np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32))
+    return clips, seconds
+
+def magnitude_spectrogram(samples):
+    """Magnitude spectrogram, STFT_SIZE sample Hann windows every STFT_HOP samples."""
+    import numpy as np
+    if len(samples) < STFT_SIZE:
+        samples = np.pad(samples, (0, STFT_SIZE - len(samples)))
+    frames = 1 + (len(samples) - STFT_SIZE) // STFT_HOP
+    index = np.arange(STFT_SIZE)[None, :] + STFT_HOP * np.arange(frames)[:, None]
+    return np.abs(np.fft.rfft(samples[index] * np.hanning(STFT_SIZE), axis=1))
+
+def quality_delta(reference, candidate)->dict:
+    """
+    How far one clip is from the reference clip of the same text.
+    Returns: {"length_delta": share of the reference length, "lsd_db": log-spectral distance over the
+    common length (0 is identical), "snr_db": signal to difference ratio, only when the lengths match}
+    """
+    import numpy as np
+    length = min(len(reference), len(candidate))
+    reference_spectrum = magnitude_spectrogram(reference[:length])
+    candidate_spectrum = magnitude_spectrogram(candidate[:length])
+    # bins more than STFT_FLOOR_DB below the loudest one count as silence, so near-silent bins don't dominate
+    floor = max(float(reference_spectrum.max()), 1e-9) * 10 ** (-STFT_FLOOR_DB / 20)
+    difference = 20 * np.log10(np.maximum(reference_spectrum, floor)) - 20 * np.log10(np.maximum(candidate_spectrum, floor))
+    delta = {"length_delta": abs(len(candidate) - len(reference)) / max(1, len(reference)),
+             "lsd_db": float(np.mean(np.sqrt(np.mean(difference ** 2, axis=1))))}
+    if len(reference) == len(candidate):
+        noise = float(np.sum((reference - candidate) ** 2))
+        delta["snr_db"] = 10 * np.log10(float(np.sum(reference ** 2)) / noise) if noise > 0 else float("inf")
+    return delta
+
+def compare_tts(args)->dict:
+    """
+    Voices the same sentences with the default fp32 pipeline and the CPU fast mode pipeline (TTS_FAST_CPU),
+    both with --tts-threads torch threads, and with the fast mode's joining of short sentences.
+    Returns: the real-time factor of each and the audio difference of the fast mode against the default.
+    """
+    import numpy as np
+    import torch
+    torch.set_num_threads(args.tts_threads)
+    voice = pazsage.pick_voice("female")
+    segments = [segment for text in tts_sample_texts(args.tts_texts) for segment in pazsage.split_speech_segments(text)]
+    grouped = pazsage.group_short_segments(segments)
+    default = pazsage.load_pipeline(False)
+    fast = pazsage.load_pipeline(True)
+    for pipeline, fast_cpu in ((default, False), (fast, True)):
+        # the first call loads the voice and warms up torch
+        list(pazsage.iter_speech("Warming up.", voice, pipeline, fast_cpu))
+
+    runs = {"default": voice_segments(default, segments, voice, False),
+            "fast": voice_segments(fast, segments, voice, True),
+            "fast_joined": voice_segments(fast, grouped, voice, True)}
+    modes = {}
+    for name, (clips, seconds) in runs.items():
+        audio_seconds = sum(len(clip) for clip in clips) / 24000
+        modes[name] = {"forward_passes": len(clips), "work_seconds": round(seconds, 3), "audio_seconds": round(audio_seconds, 3),
+                       "real_time_factor": round(seconds / audio_seconds, 4) if audio_seconds else None}
+
+    deltas = [quality_delta(ref, clip) for ref, clip in zip(runs["default"][0], runs["fast"][0])]
+    snrs = [d["snr_db"] for d in deltas if "snr_db" in d and np.isfinite(d["snr_db"])]
+    quality = {"segments": len(deltas),
+               "mean_lsd_db": round(float(np.mean([d["lsd_db"] for d in deltas])), 3),
+               "max_lsd_db": round(float(np.max([d["lsd_db"] for d in deltas])), 3),
+               "mean_length_delta": round(float(np.mean([d["length_delta"] for d in deltas])), 4),
+               "same_length_share": round(sum("snr_db" in d for d in deltas) / len(deltas), 3),
+               "mean_snr_db": round(float(np.mean(snrs)), 2) if snrs else None}
+    return {"threads": args.tts_threads, "voice": voice, "modes": modes, "quality": quality,
+            "speedup": {name: round(modes["default"]["work_seconds"] / modes[name]["work_seconds"], 2)
+                        for name in ("fast", "fast_joined") if modes[name]["work_seconds"]}}
+
+def print_tts_comparison(comparison:dict):
+    """Prints the real-time factors and the audio difference from compare_tts."""
+    print(f"\nKokoro default vs CPU fast mode ({comparison['threads']} threads, voice {comparison['voice']}):")
+    print(f"{'mode':<16}{'passes':>10}{'work_s':>12}{'audio_s':>12}{'rtf':>10}{'speedup':>10}")
+    for name, mode in comparison["modes"].items():
+        speedup = comparison["speedup"].get(name, 1.0)
+        print(f"{name:<16}{mode['forward_passes']:>10}{mode['work_seconds']:>12}{mode['audio_seconds']:>12}"
+              f"{mode['real_time_factor']:>10}{speedup:>10}")
+    quality = comparison["quality"]
+    print(f"fast vs default over {quality['segments']} sentences: log-spectral distance {quality['mean_lsd_db']} dB "
+          f"(max {quality['max_lsd_db']}), length change {quality['mean_length_delta'] * 100:.2f}%, "
+          f"same length {quality['same_length_share'] * 100:.0f}%, SNR {quality['mean_snr_db']} dB")
+
+def git_commit()->str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_FOLDER, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+# ---------------------------------------------------------------
+
+def print_result(result:dict):
+    """Prints one pass as a table of stages."""
+    report = result["report"]
+    print(f"\n{result['library']} ({result['pass']}): {report['items']} items in {result['wall_seconds']}s, "
+          f"{result['items_per_minute']} items/min, {report['usage']['total_tokens']} tokens, outcome: {result['outcome']}")
+    print(f"{'stage':<16}" + "".join(f"{field:>15}" for field in TABLE_FIELDS))
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<16}" + "".join(f"{stats[field]:>15}" for field in TABLE_FIELDS))
+    if report["counters"]:
+        print("counters: " + ", ".join(f"{name}={value:g}" for name, value in report["counters"].items()))
+
+def compare_results(old:dict, new:dict):
+    """Prints how each pass's wall time and stage latencies changed against an earlier results file."""
+    print(f"\nCompared with {old.get('label')} ({old.get('git_commit')}, {old.get('created')}):")
+    old_runs = {(run["library"], run["pass"]): run for run in old.get("runs", [])}
+    for run in new["runs"]:
+        before = old_runs.get((run["library"], run["pass"]))
+        if before is None:
+            print(f"  {run['library']} ({run['pass']}): not in the earlier results")
+            continue
+        print(f"  {run['library']} ({run['pass']}): wall {before['wall_seconds']}s -> {run['wall_seconds']}s {change(before['wall_seconds'], run['wall_seconds'])}")
+        for stage, stats in run["report"]["stages"].items():
+            old_stats = before["report"]["stages"].get(stage)
+            if old_stats:
+                print(f"    {stage:<16} p50 {old_stats['p50_seconds']}s -> {stats['p50_seconds']}s {change(old_stats['p50_seconds'], stats['p50_seconds'])}, "
+                      f"total {old_stats['total_seconds']}s -> {stats['total_seconds']}s {change(old_stats['total_seconds'], stats['total_seconds'])}")
+
+def save_result(result:dict, results_dir:str, stamp:str)->str:
+    """Writes a result as JSON in results_dir, returns the file path."""
+    os.makedirs(results_dir, exist_ok=True)
+    results_file = os.path.join(results_dir, f"{stamp}-{re.sub(r'[^A-Za-z0-9_.-]', '_', result['label'])}.json")
+    with open(results_file, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    return results_file
+
+def change(before:float, after:float)->str:
+    if not before:
+        return ""
+    return f"({(after - before) / before * 100:+.1f}%)"
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline PAZSAGE benchmark against a local mock of the chat completions API.")
+    parser.add_argument("--library", action="append", help="'demo' or a number of synthetic items (repeatable, default: demo)")
+    parser.add_argument("--passes", type=int, default=2, help="runs per library, the first cold and the rest warm (default 2)")
+    parser.add_argument("--latency", type=float, default=1.0, help="mean seconds per mock answer (default 1.0)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="standard deviation of the mock latency (default 0.3)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock requests answered with 429/500 (default 0)")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="tokens in each mock answer (default 200)")
+    parser.add_argument("--cost-per-mtok", type=float, default=0.5, help="mock cost per million tokens (default 0.5)")
+    parser.add_argument("--doc-words", type=int, default=4000, help="words per synthetic document (default 4000)")
+    parser.add_argument("--tts", choices=("stub", "real"), default="stub", help="stub Kokoro pipeline or the real model (default stub)")
+    parser.add_argument("--stub-rtf", type=float, default=0.05, help="stub seconds of work per second of audio (default 0.05)")
+    parser.add_argument("--tts-fast", action="store_true", help="with --tts real, use the CPU fast mode (TTS_FAST_CPU)")
+    parser.add_argument("--tts-compare", action="store_true",
+                        help="instead of running libraries, compare the real-time factor and audio of Kokoro's default and CPU fast mode")
+    parser.add_argument("--tts-texts", type=int, default=5, help="demo abstracts voiced by --tts-compare (default 5)")
+    parser.add_argument("--tts-threads", type=int, default=pazsage.TTS_TORCH_THREADS, help="torch threads for --tts-compare")
+    parser.add_argument("--audio-format", choices=list(pazsage.AUDIO_FORMATS), default="wav")
+    parser.add_argument("--structured", action="store_true", help="single request summary mode")
+    parser.add_argument("--model", default="meta-llama/llama-4-maverick")
+    parser.add_argument("--work-dir", help="where libraries and run folders go (default: a new temporary folder)")
+    parser.add_argument("--results-dir", default=os.path.join(REPO_FOLDER, "bench_results"))
+    parser.add_argument("--label", default="bench", help="name for this result, e.g. the change being measured")
+    parser.add_argument("--compare", help="an earlier results file to compare against")
+    args = parser.parse_args()
+
+    # each library runs with the work folder as the current folder, so fix relative paths first
+    results_dir = os.path.abspath(args.results_dir)
+    compare_file = os.path.abspath(args.compare) if args.compare else None
+    started = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    result = {"label": args.label, "created": started, "git_commit": git_commit(),
+              "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+              "settings": {name: value for name, value in vars(args).items() if name not in ("compare", "results_dir", "work_dir")}}
+    if args.tts_compare:
+        result["tts_compare"] = compare_tts(args)
+        print_tts_comparison(result["tts_compare"])
+        print(f"\nResults saved to {save_result(result, results_dir, stamp)}")
+        return
+
+    work_root = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="pazbench-"))
+    os.makedirs(work_root, exist_ok=True)
+    vocabulary = demo_vocabulary()
+    server = MockChatServer(args.latency, args.jitter, args.error_rate, args.completion_tokens, args.cost_per_mtok, vocabulary)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pazsage.OPENROUTER_CHAT_URL = server.url
+    if args.tts == "stub":
+        # audio worker processes import pazsage afresh, so they are set up with the stub as well
+        pazsage._pipeline = StubPipeline(args.stub_rtf)
+        pazsage.init_tts_worker = functools.partial(init_stub_tts_worker, args.stub_rtf)
+    elif args.tts_fast:
+        pazsage.TTS_FAST_CPU = True
+    print(f"Mock chat completions at {server.url}, work folder {work_root}")
+
+    runs = []
+    for library in args.library or ["demo"]:
+        if library == "demo":
+            runs += run_library("demo", DEMO_RIS, REPO_FOLDER, os.path.join(work_root, f"demo-{stamp}"), server, args)
+        elif library.isdigit():
+            items = int(library)
+            corpus = os.path.join(work_root, f"corpus-{items}-{args.doc_words}")
+            os.makedirs(corpus, exist_ok=True)
+            print(f"Making a synthetic library of {items} items in {corpus}")
+            ris_file = make_synthetic_library(corpus, items, args.doc_words, vocabulary)
+            runs += run_library(f"synthetic-{items}", ris_file, corpus, os.path.join(work_root, f"synthetic-{items}-{stamp}"), server, args)
+        else:
+            parser.error(f"--library must be 'demo' or a number of items, not {library!r}")
+
+    result["runs"] = runs
+    results_file = save_result(result, results_dir, stamp)
+
+    for run in runs:
+        print_result(run)
+    if compare_file:
+        with open(compare_file, encoding="utf-8") as f:
+            compare_results(json.load(f), result)
+    print(f"\nResults saved to {results_file}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
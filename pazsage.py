@@ -1,24 +1,827 @@
+import time
+STARTUP_T0 = time.perf_counter()
 import tkinter as tk
 import threading
-import numpy as np
-import fitz
-import pymupdf # PyMuPDF
-import docx
-from bs4 import BeautifulSoup
 import zipfile
 import warnings
 import requests
 import os
-import wget
 import re
+import json
+import hashlib
+import math
+import unicodedata
+import random
+import email.utils
 import shutil
-from kokoro import KPipeline
-import soundfile as sf
-import torch
-pipeline = KPipeline(lang_code='a')
+import platform
+import contextlib
+import queue
+import zlib
+import base64
+import sqlite3
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from requests.adapters import HTTPAdapter
+from html.parser import HTMLParser
+# heavy libraries (torch, kokoro, numpy, soundfile, fitz, docx) are imported where they are first used
+# so the GUI opens fast and the extract/summarize code can be imported without loading torch
 warnings.filterwarnings('ignore')
 
-def openroute(question:str,context:str,model:str,api_key2:str,url2:str)->dict:
+# start loading the Kokoro model in the background while the user fills in the form
+WARM_TTS_ON_STARTUP = True
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    """Returns the Kokoro KPipeline, loading the model on first use."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            t0 = time.perf_counter()
+            if TTS_FAST_CPU:
+                # also where audio is made in this process (one audio worker, the GUI, pazserver)
+                configure_torch_threads(TTS_TORCH_THREADS)
+            _pipeline = load_pipeline(TTS_FAST_CPU)
+            print(f"Kokoro model loaded in {time.perf_counter() - t0:.2f}s{' (CPU fast mode)' if TTS_FAST_CPU else ''}")
+        return _pipeline
+
+def load_pipeline(fast_cpu:bool = False):
+    """
+    Loads a Kokoro KPipeline.
+    Args:
+        fast_cpu: load it on the CPU and quantize the weights of every Linear layer to int8 (TTS_FAST_CPU)
+    """
+    from kokoro import KPipeline
+    if not fast_cpu:
+        return KPipeline(lang_code='a')
+    import torch
+    pipeline = KPipeline(lang_code='a', device='cpu')
+    if platform.machine().lower() in ("arm64", "aarch64") and "qnnpack" in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = "qnnpack"
+    # the ALBERT text encoder, the projections and the prosody predictor's Linear layers get int8 weights
+    # and quantize their inputs on the fly, the convolutional decoder and the LSTMs stay fp32
+    pipeline.model = torch.ao.quantization.quantize_dynamic(pipeline.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return pipeline
+
+def configure_torch_threads(threads:int = None):
+    """
+    Sets torch's thread counts for this process: threads inside each operation (if given), and in
+    CPU fast mode TTS_INTEROP_THREADS between operations and flushing denormal floats to zero.
+    """
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    if TTS_FAST_CPU:
+        torch.set_flush_denormal(True)
+        try:
+            torch.set_num_interop_threads(TTS_INTEROP_THREADS)
+        except RuntimeError:
+            # only allowed before torch has run anything in parallel, keep what is set
+            pass
+
+def iter_speech(text:str, voiceset:str, pipeline = None, fast_cpu:bool = None):
+    """
+    Voices text with Kokoro, yielding float32 clips at 24 kHz (one per chunk Kokoro splits the text into).
+    Args:
+        text: the text to voice
+        voiceset: the Kokoro voice
+        pipeline: the KPipeline to use (default get_pipeline())
+        fast_cpu: run under torch.inference_mode (default TTS_FAST_CPU)
+    """
+    import numpy as np
+    pipeline = pipeline or get_pipeline()
+    context = contextlib.nullcontext()
+    if TTS_FAST_CPU if fast_cpu is None else fast_cpu:
+        import torch
+        context = torch.inference_mode()
+    with context:
+        for _, _, audio in pipeline(text, voice=voiceset):
+            yield np.asarray(audio, dtype=np.float32)
+
+def warm_pipeline_in_background()->threading.Thread:
+    """Loads the Kokoro model on a daemon thread so it is ready by the time audio is needed."""
+    def warm():
+        try:
+            get_pipeline()
+        except Exception as e:
+            print(f"Could not preload the Kokoro model, it will be loaded when audio starts: {e}")
+    thread = threading.Thread(target=warm, daemon=True)
+    thread.start()
+    return thread
+
+# max number of OpenRouter requests in flight at once (across all papers)
+MAX_CONCURRENT_REQUESTS = 8
+# max number of papers summarized at the same time
+MAX_CONCURRENT_PAPERS = 4
+
+# audio is made by a pool of processes, each with its own Kokoro model using TTS_TORCH_THREADS cores
+TTS_TORCH_THREADS = 4
+TTS_WORKERS = max(1, (os.cpu_count() or 1) // TTS_TORCH_THREADS)
+
+# opt-in fast mode for CPU-only machines: Kokoro's Linear layers run with int8 weights, under torch.inference_mode,
+# with fixed torch thread counts (the audio differs slightly from the default fp32 path, see pazbench.py --tts-compare)
+TTS_FAST_CPU = False
+# threads torch uses to run independent operations side by side, in fast mode
+TTS_INTEROP_THREADS = 1
+# in fast mode, runs of sentences shorter than TTS_SHORT_SEGMENT_CHARS are voiced together,
+# up to TTS_BATCH_MAX_CHARS per forward pass (0 voices every sentence on its own)
+TTS_SHORT_SEGMENT_CHARS = 80
+TTS_BATCH_MAX_CHARS = 300
+
+# persistent cache of OpenRouter answers, kept between runs and shared by every work folder
+SUMMARY_CACHE_DIR = os.path.join(os.getcwd(), "cache", "summaries")
+SUMMARY_CACHE_MAX_BYTES = 500 * 1024 * 1024
+# cache of voiced sentences, so an edited summary only re-voices the sentences that changed
+USE_AUDIO_CACHE = True
+AUDIO_CACHE_DIR = os.path.join(os.getcwd(), "cache", "audio")
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# cache of text extracted from documents, so unchanged PDFs are never parsed twice
+TEXT_CACHE_DIR = os.path.join(os.getcwd(), "cache", "text")
+TEXT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# a full cache is trimmed to this share of its size, so the next trim (a walk over every entry) is a while off
+CACHE_EVICT_TO = 0.8
+# documents are read by a pool of processes, up to EXTRACT_AHEAD documents ahead of the summaries
+EXTRACT_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+EXTRACT_AHEAD = 16
+# documents are read page by page and reading stops after about this many tokens (4 characters each), 0 reads everything
+EXTRACT_MAX_TOKENS = 250000
+
+# OpenRouter client: (connect, read) timeouts in seconds, and retries with jittered exponential backoff
+REQUEST_TIMEOUT = (10, 300)
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 120
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+class RequestLimiter:
+    """
+    Adaptive cap on in-flight OpenRouter requests. Halves the cap and pauses everyone on a 429
+    (for the Retry-After time when given), then adds one slot back after each run of successes,
+    up to max_limit.
+    """
+    def __init__(self, max_limit:int):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    break
+                self.condition.wait(timeout=wait if wait > 0 else None)
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def success(self):
+        """Ramps the cap back up by one after limit successful requests in a row."""
+        with self.condition:
+            self.successes += 1
+            if self.limit < self.max_limit and self.successes >= self.limit:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def throttled(self, delay:float):
+        """Backs off after a 429: halves the cap and holds new requests for delay seconds."""
+        with self.condition:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            print(f"OpenRouter rate limit hit, {self.limit} requests at a time, pausing {delay:.1f}s")
+
+    def set_max(self, max_limit:int):
+        with self.condition:
+            self.max_limit = max_limit
+            self.limit = min(self.limit, max_limit) if self.limit else max_limit
+            self.condition.notify_all()
+
+# one pooled keep-alive session shared by every thread, plus an adaptive cap on in-flight requests
+_session = None
+_session_lock = threading.Lock()
+_request_slots = RequestLimiter(MAX_CONCURRENT_REQUESTS)
+
+def get_session()->requests.Session:
+    """Returns the shared requests Session, creating it on first use so TLS connections get reused."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_CONCURRENT_REQUESTS, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+def set_concurrency_limit(limit:int):
+    """
+    Changes how many OpenRouter requests may be in flight at once.
+    Args:
+        limit: the max number of concurrent requests (at least 1)
+    """
+    global MAX_CONCURRENT_REQUESTS, _session
+    limit = max(1, int(limit))
+    with _session_lock:
+        MAX_CONCURRENT_REQUESTS = limit
+        _request_slots.set_max(limit)
+        # drop the old session so the connection pool is resized on next use
+        if _session is not None:
+            _session.close()
+            _session = None
+
+# ---------------------------------------------------------------
+
+# a JSON run report is always written next to the zip files, WRITE_PROMETHEUS_METRICS adds a Prometheus textfile
+RUN_REPORT_NAME = "run_report.json"
+WRITE_PROMETHEUS_METRICS = False
+PROMETHEUS_FILE_NAME = "pazsage.prom"
+
+def percentile(values:list, q:float)->float:
+    """Nearest-rank percentile (q from 0 to 100) of a list of numbers, 0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class RunMetrics:
+    """
+    Timings and counters for one run: how long each stage took per call (RIS parsing, each reader,
+    each OpenRouter request, each audio file, packaging), tokens and cost from OpenRouter's usage field,
+    and plain counters like cache hits and retries. Worker processes record into their own copy,
+    which is sent back and merged (see call_with_metrics).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Starts a new run."""
+        with self.lock:
+            self.started = time.time()
+            self.durations = {}
+            self.counters = {}
+
+    def record(self, stage:str, seconds:float):
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+
+    def count(self, name:str, value:float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def span(self, stage:str):
+        """Context manager that records how long its block took under stage."""
+        return _MetricsSpan(self, stage)
+
+    def add_usage(self, usage:dict | None):
+        """Adds the token counts and cost from an OpenRouter response's usage field."""
+        if not isinstance(usage, dict):
+            return
+        for name in ("prompt_tokens", "completion_tokens", "total_tokens", "cost"):
+            value = usage.get(name)
+            if isinstance(value, (int, float)):
+                self.count(name, value)
+
+    def drain(self)->dict:
+        """Returns everything recorded so far and clears it, used to send a worker's metrics home."""
+        with self.lock:
+            records = {"durations": self.durations, "counters": self.counters}
+            self.durations, self.counters = {}, {}
+            return records
+
+    def merge(self, records:dict):
+        """Adds the records drained from another process."""
+        with self.lock:
+            for stage, values in records.get("durations", {}).items():
+                self.durations.setdefault(stage, []).extend(values)
+            for name, value in records.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self, **run_info)->dict:
+        """
+        Summarizes the run per stage: calls, total and mean seconds, p50/p90/p99/max latency and
+        calls per minute of wall time.
+        Args:
+            run_info: extra fields describing the run (model, item count, ...)
+
+        Returns: the report as a JSON-ready dictionary.
+        """
+        with self.lock:
+            finished = time.time()
+            wall = max(finished - self.started, 1e-9)
+            stages = {}
+            for stage, values in sorted(self.durations.items()):
+                stages[stage] = {
+                    "count": len(values),
+                    "total_seconds": round(sum(values), 4),
+                    "mean_seconds": round(sum(values) / len(values), 4),
+                    "p50_seconds": round(percentile(values, 50), 4),
+                    "p90_seconds": round(percentile(values, 90), 4),
+                    "p99_seconds": round(percentile(values, 99), 4),
+                    "max_seconds": round(max(values), 4),
+                    "per_minute": round(len(values) / wall * 60, 3),
+                }
+            counters = dict(sorted(self.counters.items()))
+            if counters.get("audio_seconds") and "tts" in stages:
+                # seconds of compute per second of audio, below 1 is faster than real time
+                run_info["tts_real_time_factor"] = round(stages["tts"]["total_seconds"] / counters["audio_seconds"], 4)
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+                "finished": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(finished)),
+                "wall_seconds": round(wall, 3),
+                **run_info,
+                "usage": {name: round(counters.pop(name, 0), 6) for name in ("prompt_tokens", "completion_tokens", "total_tokens", "cost")},
+                "counters": counters,
+                "stages": stages,
+            }
+
+class _MetricsSpan:
+    def __init__(self, metrics:RunMetrics, stage:str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.stage, time.perf_counter() - self.t0)
+
+# metrics for the current run, reset by LibraryProcessor.run
+run_metrics = RunMetrics()
+
+def call_with_metrics(func, *args):
+    """
+    Runs func in a worker process and sends back what it recorded in that process's run_metrics.
+    Returns: (func's result, drained metrics) for RunMetrics.merge.
+    """
+    run_metrics.drain()  # anything recorded outside a job (e.g. while loading the model) is not part of it
+    result = func(*args)
+    return result, run_metrics.drain()
+
+def prometheus_text(report:dict)->str:
+    """Formats a run report in the Prometheus text exposition format (for node_exporter's textfile collector)."""
+    lines = ["# HELP pazsage_stage_seconds Time per call of each processing stage in the last run.",
+             "# TYPE pazsage_stage_seconds summary"]
+    for stage, stats in report["stages"].items():
+        for quantile, field in (("0.5", "p50_seconds"), ("0.9", "p90_seconds"), ("0.99", "p99_seconds")):
+            lines.append(f'pazsage_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {stats[field]}')
+        lines.append(f'pazsage_stage_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]}')
+        lines.append(f'pazsage_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+    lines += ["# HELP pazsage_tokens Tokens used by OpenRouter requests in the last run.",
+              "# TYPE pazsage_tokens gauge"]
+    for kind in ("prompt", "completion", "total"):
+        lines.append(f'pazsage_tokens{{kind="{kind}"}} {report["usage"][kind + "_tokens"]}')
+    lines += ["# HELP pazsage_cost OpenRouter cost of the last run in credits (USD).",
+              "# TYPE pazsage_cost gauge",
+              f'pazsage_cost {report["usage"]["cost"]}',
+              "# HELP pazsage_run_counter Counters from the last run (cache hits, retries, ...).",
+              "# TYPE pazsage_run_counter gauge"]
+    for name, value in report["counters"].items():
+        lines.append(f'pazsage_run_counter{{name="{name}"}} {value}')
+    lines += ["# HELP pazsage_run_wall_seconds Wall time of the last run.",
+              "# TYPE pazsage_run_wall_seconds gauge",
+              f'pazsage_run_wall_seconds {report["wall_seconds"]}',
+              "# HELP pazsage_run_finished_timestamp_seconds When the last run finished.",
+              "# TYPE pazsage_run_finished_timestamp_seconds gauge",
+              f"pazsage_run_finished_timestamp_seconds {time.time():.0f}"]
+    return "\n".join(lines) + "\n"
+
+def write_run_report(out_folder:str, **run_info)->str:
+    """
+    Writes run_metrics as RUN_REPORT_NAME (and PROMETHEUS_FILE_NAME when WRITE_PROMETHEUS_METRICS is on) in out_folder.
+    Files are written under a temporary name and moved into place, so readers never see half a report.
+
+    Returns: the path of the JSON report.
+    """
+    report = run_metrics.report(**run_info)
+    outputs = [(os.path.join(out_folder, RUN_REPORT_NAME), json.dumps(report, indent=2))]
+    if WRITE_PROMETHEUS_METRICS:
+        outputs.append((os.path.join(out_folder, PROMETHEUS_FILE_NAME), prometheus_text(report)))
+    for path, content in outputs:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return outputs[0][0]
+
+# ---------------------------------------------------------------
+
+# the five questions asked of every paper, in the order they appear in the summary
+SUMMARY_QUESTIONS = [
+    "Summarize the main aim of the paper as well as the main specific questions asked in the paper. Keep each question to one sentence. Use the provided paper as context. Focus solely on the aims and questions.",
+    "Summarize the statistical and analytical methods to a few sentences. Exactly name the statistical and analytica methods. Use the provided paper as context. Focus solely on statistical and analytical methods and keep the description of each method to two sentences.",
+    "Summarize three main results from the provided paper. Results are defined as specific quantitative or qualitative results. If a qualitative result is returned, report the exact number from the provided context.",
+    "Summarize three main conclusions from the paper. Conclusions are defined as broad context findings. Do not report specific quantitative or qualitative results. Each conclusion should not exceed three sentences.",
+    "Based on the paper, list only the key recommendations and future directions for research. Do not include any specific results, data, numbers, statistics, or findings. Focus exclusively on qualitative guidance and proposed next steps and keep every recommendation and future direction to one sentence."
+]
+# JSON keys used when all five questions are asked in a single request
+SUMMARY_SECTIONS = ["aims", "methods", "results", "conclusions", "recommendations"]
+
+# only the parts of a paper that matter to each question are sent, up to this many tokens per request
+USE_CONTEXT_SELECTION = True
+DEFAULT_CONTEXT_TOKEN_BUDGET = 16000
+CONTEXT_TOKEN_BUDGETS = {
+    "meta-llama/llama-4-maverick": 32000,
+    "meta-llama/llama-3.1-70b-instruct": 24000,
+}
+
+# ---------------------------------------------------------------
+
+class DiskCache:
+    """
+    Size-bounded on-disk cache, one file per key. File mtimes track recent use so the least recently
+    used entries are evicted once the cache grows past max_bytes, down to CACHE_EVICT_TO of it.
+    Safe to share between threads and processes.
+    """
+    def __init__(self, folder:str, max_bytes:int, extension:str):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.extension = extension
+        # when True lookups miss, so every entry is made again and overwritten
+        self.refresh = False
+        self.lock = threading.Lock()
+        self.size = None
+
+    @staticmethod
+    def hash_parts(*parts)->str:
+        """Builds a cache key from several strings."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(hashlib.sha256(str(part).encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    def _path(self, key:str)->str:
+        return os.path.join(self.folder, key[:2], key + self.extension)
+
+    def _entries(self):
+        """Yields (path, size, mtime) for every cached entry."""
+        if not os.path.isdir(self.folder):
+            return
+        for root, _, files in os.walk(self.folder):
+            for file in files:
+                if file.endswith(self.extension):
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def get_bytes(self, key:str)->bytes | None:
+        """Returns the cached bytes for key, or None on a miss."""
+        if self.refresh:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # mark as recently used
+            os.utime(path, None)
+            return data
+        except OSError:
+            return None
+
+    def put_bytes(self, key:str, data:bytes):
+        """Stores bytes under key, written atomically, then evicts old entries if over size."""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            with self.lock:
+                old_size = os.path.getsize(path) if os.path.exists(path) else 0
+                os.replace(tmp_path, path)
+                if self.size is None:
+                    self.size = sum(size for _, size, _ in self._entries())
+                else:
+                    self.size += len(data) - old_size
+                if self.size > self.max_bytes:
+                    self._evict()
+        except OSError as e:
+            print(f"Could not write cache entry {path}: {e}")
+
+    def _evict(self):
+        """Deletes least recently used entries until the cache is down to CACHE_EVICT_TO of max_bytes, call with lock held."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        if self.size <= self.max_bytes:
+            return  # another process already made room
+        target = self.max_bytes * CACHE_EVICT_TO
+        for path, size, _ in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                continue
+
+    def invalidate(self, key:str):
+        """Removes a single entry."""
+        with self.lock:
+            path = self._path(key)
+            if os.path.exists(path):
+                size = os.path.getsize(path)
+                os.remove(path)
+                if self.size is not None:
+                    self.size -= size
+
+    def clear(self):
+        """Removes every entry."""
+        with self.lock:
+            if os.path.isdir(self.folder):
+                shutil.rmtree(self.folder)
+            self.size = 0
+
+class SummaryCache(DiskCache):
+    """On-disk cache of OpenRouter answers, keyed on a hash of the paper text, the model and the question."""
+    def __init__(self, folder:str, max_bytes:int):
+        super().__init__(folder, max_bytes, ".json")
+
+    @staticmethod
+    def make_key(context:str, model:str, question:str, extra:str = "")->str:
+        """Builds the cache key for one question asked of one paper with one model."""
+        return DiskCache.hash_parts(context, model, question, extra)
+
+    def get(self, key:str)->dict | None:
+        """Returns the cached response for key, or None on a miss."""
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def put(self, key:str, response:dict):
+        """Stores a response under key."""
+        self.put_bytes(key, json.dumps(response).encode("utf-8"))
+
+summary_cache = SummaryCache(SUMMARY_CACHE_DIR, SUMMARY_CACHE_MAX_BYTES)
+
+class AudioCache(DiskCache):
+    """On-disk cache of voiced sentences (float32 samples), keyed on the sentence, the voice and the Kokoro version."""
+    def __init__(self, folder:str, max_bytes:int):
+        super().__init__(folder, max_bytes, ".f32")
+        self.kokoro_version = None
+
+    def make_key(self, segment:str, voiceset:str)->str:
+        """Builds the cache key for one sentence in one voice."""
+        if self.kokoro_version is None:
+            try:
+                from importlib.metadata import version
+                self.kokoro_version = version("kokoro")
+            except Exception:
+                self.kokoro_version = "unknown"
+        # the int8 model of the CPU fast mode sounds slightly different, its sentences are kept apart
+        if TTS_FAST_CPU:
+            return DiskCache.hash_parts(segment, voiceset, self.kokoro_version, "int8")
+        return DiskCache.hash_parts(segment, voiceset, self.kokoro_version)
+
+    def get(self, key:str):
+        """Returns the cached samples as a numpy array, or None on a miss."""
+        import numpy as np
+        data = self.get_bytes(key)
+        return None if data is None else np.frombuffer(data, dtype=np.float32)
+
+    def put(self, key:str, samples):
+        """Stores samples under key."""
+        import numpy as np
+        self.put_bytes(key, np.asarray(samples, dtype=np.float32).tobytes())
+
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES)
+
+class TextCache(DiskCache):
+    """
+    On-disk cache of extracted document text. Text is stored under a hash of the file contents,
+    with a small pointer entry under the path, size and mtime so unchanged files aren't even re-hashed.
+    """
+    def __init__(self, folder:str, max_bytes:int):
+        super().__init__(folder, max_bytes, ".txt")
+
+    def get_text(self, key:str)->str | None:
+        data = self.get_bytes(key)
+        return None if data is None else data.decode("utf-8")
+
+    def put_text(self, key:str, text:str):
+        self.put_bytes(key, text.encode("utf-8"))
+
+text_cache = TextCache(TEXT_CACHE_DIR, TEXT_CACHE_MAX_BYTES)
+
+# ---------------------------------------------------------------
+
+# section headings found in papers and reports, mapped to a section name
+SECTION_HEADINGS = [
+    ("abstract", re.compile(r"^(abstract|summary|executive summary)$")),
+    ("introduction", re.compile(r"^(introduction|background)$")),
+    ("methods", re.compile(r"^(materials? and methods|methods and materials?|methods|methodology|study (area|site|design)|data and methods|statistical analys[ie]s)$")),
+    ("results", re.compile(r"^(results|findings|results and discussion)$")),
+    ("discussion", re.compile(r"^(discussion|general discussion)$")),
+    ("conclusions", re.compile(r"^(conclusions?|concluding remarks|recommendations|future (work|research|directions))$")),
+    ("references", re.compile(r"^(references|bibliography|literature cited|works cited|acknowledg(e)?ments?|funding|conflicts? of interest|declaration of competing interest|appendi(x|ces)|supplementary (material|information)|author contributions)$")),
+]
+# sections each question mostly draws on, in SUMMARY_QUESTIONS order
+QUESTION_SECTIONS = [
+    {"abstract", "introduction"},
+    {"methods"},
+    {"results", "abstract"},
+    {"discussion", "conclusions", "abstract"},
+    {"conclusions", "discussion"},
+]
+CHUNK_CHARS = 1500
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+def estimate_tokens(text:str)->int:
+    """Rough token count, about four characters per token for English text."""
+    return len(text) // 4 + 1
+
+def context_budget(model:str)->int:
+    """The number of context tokens to send per request for a model."""
+    return CONTEXT_TOKEN_BUDGETS.get(model, DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+def split_long_line(line:str)->list[str]:
+    """
+    Splits a line longer than CHUNK_CHARS into pieces of at most CHUNK_CHARS, at a space where there is one.
+    Text extracted without line breaks (some PDFs and HTML pages) would otherwise become one chunk too big to send.
+    """
+    pieces = []
+    while len(line) > CHUNK_CHARS:
+        cut = line.rfind(" ", CHUNK_CHARS // 2, CHUNK_CHARS)
+        if cut <= 0:
+            cut = CHUNK_CHARS
+        pieces.append(line[:cut])
+        line = line[cut:].lstrip(" ")
+    pieces.append(line)
+    return pieces
+
+def heading_section(line:str)->str | None:
+    """Returns the section a line starts, if it looks like a section heading."""
+    # two column PDF text puts both columns on one line with a wide gap, a heading can be in either
+    cells = re.split(r"\s{3,}", line.strip())
+    for cell in (cells[0], cells[-1]):
+        if not cell or len(cell) > 60:
+            continue
+        # drop numbering like "2." or "3.1" or "IV." in front of the heading
+        name = re.sub(r"^([0-9]+(\.[0-9]+)*|[ivx]+)\.?\s+", "", cell.lower()).strip(" :.")
+        for section, pattern in SECTION_HEADINGS:
+            if pattern.match(name):
+                return section
+    return None
+
+class DocumentIndex:
+    """
+    A paper split once into chunks tagged with the section they came from, with a small BM25 index
+    so each question can be sent only the most relevant chunks that fit the model's token budget.
+    References, acknowledgements and appendices are left out.
+    """
+    def __init__(self, text:str):
+        self.text = text
+        self.chunks = []    # (section, text)
+        section, lines, size = "front", [], 0
+        for line in (piece for full_line in text.splitlines() for piece in split_long_line(full_line)):
+            found = heading_section(line)
+            if found is not None and found != section:
+                self._add_chunk(section, lines)
+                section, lines, size = found, [], 0
+            elif lines and size + len(line) > CHUNK_CHARS:
+                self._add_chunk(section, lines)
+                lines, size = [], 0
+            lines.append(line)
+            size += len(line) + 1
+        self._add_chunk(section, lines)
+        # only the body is indexed, the back matter is never sent
+        self.chunks = [chunk for chunk in self.chunks if chunk[0] != "references"]
+        self.body_tokens = sum(estimate_tokens(chunk_text) for _, chunk_text in self.chunks)
+
+        # BM25 statistics
+        self.terms = []
+        doc_freq = {}
+        for _, chunk_text in self.chunks:
+            counts = {}
+            for word in WORD_PATTERN.findall(chunk_text.lower()):
+                counts[word] = counts.get(word, 0) + 1
+            self.terms.append(counts)
+            for word in counts:
+                doc_freq[word] = doc_freq.get(word, 0) + 1
+        n = max(1, len(self.chunks))
+        self.idf = {word: math.log(1 + (n - df + 0.5) / (df + 0.5)) for word, df in doc_freq.items()}
+        self.avg_len = sum(sum(counts.values()) for counts in self.terms) / n or 1
+
+    def _add_chunk(self, section:str, lines:list):
+        chunk_text = "\n".join(lines).strip()
+        if chunk_text:
+            self.chunks.append((section, chunk_text))
+
+    def bm25(self, query:str, k1:float=1.5, b:float=0.75)->list[float]:
+        """Scores every chunk against the query."""
+        words = set(WORD_PATTERN.findall(query.lower()))
+        scores = []
+        for counts in self.terms:
+            length = sum(counts.values())
+            score = 0.0
+            for word in words:
+                tf = counts.get(word, 0)
+                if tf:
+                    score += self.idf[word] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / self.avg_len))
+            scores.append(score)
+        return scores
+
+    def select(self, question:str, budget_tokens:int, sections:set = None)->str:
+        """
+        Picks the chunks to send with a question.
+        Args:
+            question: the question text, used as the search query
+            budget_tokens: the most context tokens to send
+            sections: sections to favour for this question
+
+        Returns: the chosen chunks in document order, or the whole body if it already fits.
+        """
+        if self.body_tokens <= budget_tokens:
+            return "\n\n".join(chunk_text for _, chunk_text in self.chunks)
+
+        scores = self.bm25(question)
+        top = max(scores) if scores else 0.0
+        for i, (section, _) in enumerate(self.chunks):
+            # the opening of the paper (title, abstract) always helps, as does the right section
+            if i == 0 or section == "abstract":
+                scores[i] += top + 1
+            elif sections and section in sections:
+                scores[i] += top / 2 + 0.5
+
+        chosen, used = [], 0
+        for i in sorted(range(len(self.chunks)), key=lambda i: scores[i], reverse=True):
+            cost = estimate_tokens(self.chunks[i][1])
+            if used + cost > budget_tokens:
+                continue
+            chosen.append(i)
+            used += cost
+        return "\n\n[...]\n\n".join(self.chunks[i][1] for i in sorted(chosen))
+
+# ---------------------------------------------------------------
+
+def retry_delay(attempt:int, retry_after:str | None)->float:
+    """
+    How long to wait before retrying a request.
+    Uses the server's Retry-After header (seconds or an HTTP date) when there is one,
+    otherwise exponential backoff with full jitter.
+    """
+    if retry_after:
+        try:
+            return min(RETRY_MAX_DELAY, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                when = email.utils.parsedate_to_datetime(retry_after)
+                return min(RETRY_MAX_DELAY, max(0.0, when.timestamp() - time.time()))
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+def read_event_stream(response, on_text)->dict:
+    """
+    Reads a streamed (server-sent events) chat completion, passing each piece of the answer to on_text as it arrives.
+    Returns: the same dictionary a non-streamed request returns (choices[0].message.content and usage),
+    or {"error": ...} when the provider reports an error part way.
+    """
+    response.encoding = "utf-8"
+    content = []
+    usage = None
+    for line in response.iter_lines(decode_unicode=True):
+        # blank lines separate events, lines starting with ":" are keep-alive comments
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            break
+        chunk = json.loads(payload)
+        if "error" in chunk:
+            return {"error": chunk["error"]}
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                content.append(delta)
+                on_text(delta)
+    result = {"choices": [{"message": {"role": "assistant", "content": "".join(content)}}]}
+    if usage:
+        result["usage"] = usage
+    return result
+
+def openroute(question:str,context:str,model:str,api_key2:str,url2:str,response_format:dict=None,on_text=None)->dict:
     """
     Function to call the model via OpenRouter
     Args:
@@ -27,6 +830,13 @@ def openroute(question:str,context:str,model:str,api_key2:str,url2:str)->dict:
         model: the model to use
         api_key2: the OpenRouter API key
         url2: the URL of the OpenRouter "OpenAI" style Chat Completions API
+        response_format: optional OpenAI style response_format (e.g. {"type": "json_object"})
+        on_text: optional callback, when given the answer is streamed and each piece is passed to it as it arrives
+
+    Answers are served from summary_cache when the same paper, model and question were asked before.
+    Timeouts, connection errors, 429 and 5xx responses are retried with backoff (honouring Retry-After),
+    and 429s also shrink the number of requests in flight (see RequestLimiter). A streamed answer is only
+    retried if nothing has been passed to on_text yet.
 
     Returns: JSON Dictionary with text based summary inside.
     """
@@ -48,73 +858,295 @@ def openroute(question:str,context:str,model:str,api_key2:str,url2:str)->dict:
             'ignore': [
                 'GMICloud'
             ]
-        }
+        },
+        # ask for the cost alongside the token counts, for the run report
+        'usage': {'include': True}
     }
+    if response_format is not None:
+        data["response_format"] = response_format
+    streaming = on_text is not None
+    if streaming:
+        data["stream"] = True
+
+    # unchanged paper + model + question means we already have the answer
+    cache_key = summary_cache.make_key(context, model, question, json.dumps(response_format))
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        run_metrics.count("openroute_cache_hits")
+        if streaming:
+            try:
+                on_text(str(cached['choices'][0]['message']['content']))
+            except (KeyError, IndexError, TypeError):
+                pass
+        return cached
+
+    # how much of a streamed answer has been handed on, once anything has it can't be retried
+    streamed = {"chars": 0, "t0": 0.0}
+    def forward(delta):
+        if not streamed["chars"]:
+            run_metrics.record("openroute_first_token", time.perf_counter() - streamed["t0"])
+        streamed["chars"] += len(delta)
+        on_text(delta)
+
+    for attempt in range(MAX_RETRIES + 1):
+        last_try = attempt == MAX_RETRIES
+        try:
+            # Send the POST request over the pooled session, waiting for a free slot (held while a stream is read)
+            with _request_slots, run_metrics.span("openroute"):
+                streamed["t0"] = time.perf_counter()
+                response = get_session().post(url2, headers=headers, json=data, timeout=REQUEST_TIMEOUT, stream=streaming)
+                if streaming and response.status_code == 200:
+                    result = read_event_stream(response, forward)
+            if attempt:
+                run_metrics.count("openroute_retries")
+            if response.status_code in RETRY_STATUS_CODES and not last_try:
+                response.close()
+                delay = retry_delay(attempt, response.headers.get("Retry-After"))
+                print(f"OpenRouter returned {response.status_code}, retrying in {delay:.1f}s (attempt {attempt + 1} of {MAX_RETRIES})")
+                if response.status_code == 429:
+                    # the limiter holds every request (this retry included) until the pause is over
+                    _request_slots.throttled(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+            if not streaming:
+                result = response.json()
+            # errors from the upstream provider can come back inside a 200 response
+            error = result.get("error") if isinstance(result, dict) else None
+            if isinstance(error, dict) and error.get("code") in RETRY_STATUS_CODES and not last_try and not streamed["chars"]:
+                delay = retry_delay(attempt, None)
+                print(f"OpenRouter provider error {error.get('code')}, retrying in {delay:.1f}s (attempt {attempt + 1} of {MAX_RETRIES})")
+                time.sleep(delay)
+                continue
+            _request_slots.success()
+            if isinstance(result, dict):
+                run_metrics.add_usage(result.get("usage"))
+            # only keep real answers, errors should be retried next run
+            if isinstance(result, dict) and result.get("choices") and "error" not in result:
+                summary_cache.put(cache_key, result)
+            return result
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            run_metrics.count("openroute_network_errors")
+            if last_try or streamed["chars"]:
+                return {"error": f"Network error connecting to OpenRouter: {e}"}
+            delay = retry_delay(attempt, None)
+            print(f"Network error connecting to OpenRouter, retrying in {delay:.1f}s (attempt {attempt + 1} of {MAX_RETRIES}): {e}")
+            time.sleep(delay)
+        except requests.exceptions.RequestException as e:
+            return {"error": f"Network error connecting to OpenRouter: {e}"}
+        except ValueError:  # Includes JSONDecodeError
+            return {"error": "Invalid JSON response from OpenRouter."}
+
+
+def answer_question(index:int,question:str,text:str,model:str,api_key2:str,url2:str,on_text=None)->str:
+    """
+    Function to ask a single summary question of a paper
+    Arguments:
+        index: the position of the question (used for progress messages)
+        question: text question to ask of the paper
+        text: the extracted text of the paper or document
+        model: the model to use
+        api_key2: the OpenRouter API key
+        url2: the URL of the OpenRouter "OpenAI" style Chat Completions API
+        on_text: optional callback to stream the answer to as it arrives
+
+    Returns: the answer text, or an error note to put in the summary in its place.
+    """
     try:
-        # Send the POST request
-        response = requests.post(url2, headers=headers, json=data)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        return {"error": f"Network error connecting to OpenRouter: {e}"}
-    except ValueError:  # Includes JSONDecodeError
-        return {"error": "Invalid JSON response from OpenRouter."}
+        response = openroute(question=question,context=text,model=model,api_key2=api_key2,url2=url2,on_text=on_text)
+
+        if "error" in response:
+            print(f"API Error for question {index+1}: {response['error']}")
+            return f"Error generating part of summary: {response['error']}"
+
+        #print(str(response) +  "\n" +  "-"*50 + "\n")
+        try:
+            content = response['choices'][0]['message']['content']
+        except (KeyError, IndexError) as e:
+            print(f"Error extracting content from API response: {e}. Response: {response}")
+            return "Error: Unexpected API response format."
+
+        print(f"Step {index + 1} Completed.")
+        return str(content)
+    except Exception as e: # Fallback for other unexpected errors
+        print(f"Unexpected error in make_summary_report for question {index+1}: {e}")
+        return "Error: An unexpected error occurred while generating part of the summary."
 
 
-def make_summary_report(text:str,model:str,api_key2:str,url2:str)->str:
+def parse_structured_summary(content:str)->list[str] | None:
     """
-    Function to generate summary texts from a single paper, report, or publication document
+    Pulls the five section answers out of a JSON reply to the single-request summary prompt
+    Args:
+        content: the message content returned by the model
+
+    Returns: the answers in SUMMARY_QUESTIONS order, or None if the reply can't be used.
+    """
+    content = content.strip()
+    # some models wrap JSON in a markdown code fence even when asked not to
+    if content.startswith("```"):
+        content = re.sub(r"^```[a-zA-Z]*\s*", "", content)
+        content = re.sub(r"\s*```$", "", content)
+    try:
+        sections = json.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(sections, dict):
+        return None
+
+    answers = []
+    for key in SUMMARY_SECTIONS:
+        answer = sections.get(key)
+        if isinstance(answer, list):
+            answer = "\n".join(str(a) for a in answer)
+        if not isinstance(answer, str) or not answer.strip():
+            return None
+        answers.append(answer.strip())
+    return answers
+
+
+def make_structured_summary_report(text:str,model:str,api_key2:str,url2:str)->str | None:
+    """
+    Function to generate the summary of a paper with one request instead of one per question
+    The paper is only sent once and the model answers every question in a JSON object.
     Arguments:
         text: the extracted text of the paper or document
         model: the model to use
         api_key2: the OpenRouter API key
         url2: the URL of the OpenRouter "OpenAI" style Chat Completions API
+
+    Returns: the summary text (same layout as make_summary_report), or None if the reply could not be parsed.
     """
+    question = "Answer each of the following questions about the provided paper. " \
+               "Reply only with a JSON object that has exactly these keys: " + ", ".join(SUMMARY_SECTIONS) + ". " \
+               "The value for each key is the plain text answer to that question.\n\n"
+    for key, q in zip(SUMMARY_SECTIONS, SUMMARY_QUESTIONS):
+        question = question + f"{key}: {q}\n"
+
+    response = openroute(question=question, context=text, model=model, api_key2=api_key2, url2=url2,
+                         response_format={"type": "json_object"})
+    if "error" in response:
+        print(f"API Error for single request summary: {response['error']}")
+        return None
+    try:
+        content = response['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError) as e:
+        print(f"Error extracting content from API response: {e}. Response: {response}")
+        return None
+
+    answers = parse_structured_summary(str(content))
+    if answers is None:
+        print("Could not parse the single request summary reply.")
+        return None
+
     summary = ''
-    questions = [
-        "Summarize the main aim of the paper as well as the main specific questions asked in the paper. Keep each question to one sentence. Use the provided paper as context. Focus solely on the aims and questions.",
-        "Summarize the statistical and analytical methods to a few sentences. Exactly name the statistical and analytica methods. Use the provided paper as context. Focus solely on statistical and analytical methods and keep the description of each method to two sentences.",
-        "Summarize three main results from the provided paper. Results are defined as specific quantitative or qualitative results. If a qualitative result is returned, report the exact number from the provided context.",
-        "Summarize three main conclusions from the paper. Conclusions are defined as broad context findings. Do not report specific quantitative or qualitative results. Each conclusion should not exceed three sentences.",
-        "Based on the paper, list only the key recommendations and future directions for research. Do not include any specific results, data, numbers, statistics, or findings. Focus exclusively on qualitative guidance and proposed next steps and keep every recommendation and future direction to one sentence."]
-
-    for i in range(len(questions)):
-        try:
-            response = openroute(question=questions[i],context=text,model=model,api_key2=api_key2,url2=url2)
+    for answer in answers:
+        summary = f"{summary}\n\n{answer}"
+    print("Single request summary Completed.")
+    return summary
 
-            if "error" in response:
-                print(f"API Error for question {i+1}: {response['error']}")
-                summary = summary + "\n\n" + f"Error generating part of summary: {response['error']}"
-                continue
 
-            #print(str(response) +  "\n" +  "-"*50 + "\n")
-            try:
-                content = response['choices'][0]['message']['content']
-                summary = f"{summary}\n\n{str(content)}"
-            except (KeyError, IndexError) as e:
-                print(f"Error extracting content from API response: {e}. Response: {response}")
-                summary = summary + "\n\n" + "Error: Unexpected API response format."
-                continue
+def select_contexts(text:str, model:str)->list:
+    """
+    Builds the context to send with each of the SUMMARY_QUESTIONS, trimmed to the model's token budget.
+    Returns the text unchanged for every question when USE_CONTEXT_SELECTION is off.
+    """
+    if not USE_CONTEXT_SELECTION:
+        return [text] * len(SUMMARY_QUESTIONS)
+    index = DocumentIndex(text)
+    budget = context_budget(model)
+    return [index.select(question, budget, sections) for question, sections in zip(SUMMARY_QUESTIONS, QUESTION_SECTIONS)]
 
-            #print(str(summary) + "\n" + "-" * 50 + "\n")
-            print(f"Step {i + 1} Completed.")
-        except Exception as e: # Fallback for other unexpected errors
-            print(f"Unexpected error in make_summary_report for question {i+1}: {e}")
-            summary = summary + "\n\n" + "Error: An unexpected error occurred while generating part of the summary."
-            continue
+def select_context(text:str, model:str)->str:
+    """Builds one context covering all the SUMMARY_QUESTIONS, for the single request mode."""
+    if not USE_CONTEXT_SELECTION:
+        return text
+    return DocumentIndex(text).select(" ".join(SUMMARY_QUESTIONS), context_budget(model), set().union(*QUESTION_SECTIONS))
+
+
+def make_summary_report(text:str,model:str,api_key2:str,url2:str,max_workers:int=None,structured:bool=False,stream=None)->str:
+    """
+    Function to generate summary texts from a single paper, report, or publication document
+    The questions are sent concurrently, but the answers are kept in question order.
+    Arguments:
+        text: the extracted text of the paper or document
+        model: the model to use
+        api_key2: the OpenRouter API key
+        url2: the URL of the OpenRouter "OpenAI" style Chat Completions API
+        max_workers: max number of questions in flight for this paper (defaults to one per question)
+        structured: ask all the questions in one request first, falling back to one request per question
+        stream: optional SpeechStream, the answers are streamed into it as they arrive
+                (a single request summary is JSON, so it is only passed on once it is complete)
+    """
+    if structured:
+        summary = make_structured_summary_report(text=select_context(text, model), model=model, api_key2=api_key2, url2=url2)
+        if summary is not None:
+            if stream is not None:
+                stream.finish_text(summary)
+            return summary
+        print("Falling back to one request per question.")
+
+    # each question gets its own selection of the paper
+    contexts = select_contexts(text, model)
+
+    def ask(index:int)->str:
+        on_text = None
+        if stream is not None:
+            on_text = lambda delta: stream.feed(index, delta)
+        answer = answer_question(index, SUMMARY_QUESTIONS[index], contexts[index], model, api_key2, url2, on_text)
+        if stream is not None:
+            stream.finish(index, answer)
+        return answer
+
+    summary = ''
+    workers = max_workers or len(SUMMARY_QUESTIONS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map keeps the answers in the original question order
+        answers = executor.map(ask, range(len(SUMMARY_QUESTIONS)))
+        for answer in answers:
+            summary = f"{summary}\n\n{answer}"
 
     return summary
 
+def collect_text(blocks, file_path:str, separator:str = "")->str:
+    """
+    Joins the text blocks (pages, paragraphs) a reader yields, and stops reading once EXTRACT_MAX_TOKENS
+    worth of text has been collected, so memory stays bounded however big the document is.
+    """
+    max_chars = EXTRACT_MAX_TOKENS * 4
+    pieces = []
+    total = 0
+    for block in blocks:
+        if max_chars and total + len(block) >= max_chars:
+            pieces.append(block[:max_chars - total])
+            print(f"Stopped reading {file_path} at about {EXTRACT_MAX_TOKENS} tokens (EXTRACT_MAX_TOKENS).")
+            run_metrics.count("extract_truncated")
+            break
+        pieces.append(block)
+        total += len(block) + len(separator)
+    return separator.join(pieces)
+
+# PyMuPDF keeps decoded fonts and images in a global store, emptied every this many pages
+PDF_STORE_SHRINK_PAGES = 50
+
+def iter_pdf_pages(file_path:str):
+    """Yields the text of a PDF one page at a time, only one page is loaded at once."""
+    import fitz
+    import pymupdf # PyMuPDF
+    with fitz.open(file_path) as doc:
+        for number in range(doc.page_count):
+            page = doc.load_page(number)
+            yield page.get_text("text", flags=pymupdf.TEXT_INHIBIT_SPACES)
+            page = None
+            if number % PDF_STORE_SHRINK_PAGES == PDF_STORE_SHRINK_PAGES - 1:
+                fitz.TOOLS.store_shrink(100)
+
 def read_pdf(file_path:str)->tuple[str | None, str | None]:
     """Reads text from a PDF file."""
     try:
-        with fitz.open(file_path) as doc:
-            text = ''
-            for page in doc:
-                text += page.get_text("text", flags=pymupdf.TEXT_INHIBIT_SPACES)
-            #print(f"Character Length of PDF: {str(len(text))}")
-            text = text.encode("utf-8")
-            return text, None
+        text = collect_text(iter_pdf_pages(file_path), file_path)
+        #print(f"Character Length of PDF: {str(len(text))}")
+        return text, None
     except Exception as e:
         print(f"Failed to read PDF {file_path}: {e}")
         return None, f"Error reading PDF {file_path}: {e}"
@@ -122,30 +1154,82 @@ def read_pdf(file_path:str)->tuple[str | None, str | None]:
 def read_docx(file_path:str)->tuple[str | None, str | None]:
     """Reads text from a DOCX file."""
     try:
+        import docx
         doc = docx.Document(file_path)
-        text = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
+        text = collect_text((paragraph.text for paragraph in doc.paragraphs), file_path, '\n')
         return text, None
     except Exception as e:
         print(f"Failed to read DOCX {file_path}: {e}")
         return None, f"Error reading DOCX {file_path}: {e}"
 
 
+# elements whose text is never shown, and elements that start a new line
+HTML_SKIP_TAGS = {"script", "style", "noscript", "template"}
+HTML_BLOCK_TAGS = {"p", "div", "br", "li", "tr", "td", "th", "h1", "h2", "h3", "h4", "h5", "h6",
+                   "section", "article", "header", "footer", "table", "ul", "ol", "blockquote", "pre", "title"}
+HTML_READ_BYTES = 64 * 1024
+
+class HtmlTextParser(HTMLParser):
+    """Collects the visible text of an HTML page as it is fed, without building a document tree."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skipping = 0
+        self.pending = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_SKIP_TAGS:
+            self.skipping += 1
+        elif tag in HTML_BLOCK_TAGS:
+            self.pending.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in HTML_BLOCK_TAGS:
+            self.pending.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in HTML_SKIP_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in HTML_BLOCK_TAGS:
+            self.pending.append("\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.pending.append(data)
+
+    def take(self)->str:
+        text, self.pending = "".join(self.pending), []
+        return text
+
+def iter_html_text(file_path:str):
+    """Yields the visible text of an HTML file block by block, reading HTML_READ_BYTES at a time."""
+    parser = HtmlTextParser()
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+        for chunk in iter(lambda: file.read(HTML_READ_BYTES), ""):
+            parser.feed(chunk)
+            yield parser.take()
+    parser.close()
+    yield parser.take()
+
+def tidy_html_lines(blocks):
+    """Strips each line, breaks multi-headlines into a line each and drops blank lines, block by block."""
+    partial = ""
+    for block in blocks:
+        lines = (partial + block).split("\n")
+        # the last line may carry on in the next block
+        partial = lines.pop()
+        for line in lines:
+            for phrase in line.strip().split("  "):
+                if phrase.strip():
+                    yield phrase.strip()
+    for phrase in partial.strip().split("  "):
+        if phrase.strip():
+            yield phrase.strip()
+
 def read_html(file_path:str)->tuple[str | None, str | None]:
-    """Reads text from an HTML file."""
+    """Reads the visible text from an HTML file, streaming it so huge pages never sit in memory whole."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            soup = BeautifulSoup(file, 'html.parser')
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.decompose()
-            text = soup.get_text()
-            # Break into lines and remove leading and trailing space on each
-            lines = (line.strip() for line in text.splitlines())
-            # Break multi-headlines into a line each
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            # Drop blank lines
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            return text, None
+        text = collect_text(tidy_html_lines(iter_html_text(file_path)), file_path, '\n')
+        return text, None
     except Exception as e:
         print(f"Failed to read HTML {file_path}: {e}")
         return None, f"Error reading HTML {file_path}: {e}"
@@ -160,33 +1244,1882 @@ def read_file_text(file_path:str)->tuple[str | None, str | None]:
 
     file_ext = os.path.splitext(file_path)[-1].lower()
     if file_ext == '.pdf':
-        return read_pdf(file_path)
+        with run_metrics.span("read_pdf"):
+            return read_pdf(file_path)
     elif file_ext in ['.docx' , '.doc']:
-        return read_docx(file_path)
+        with run_metrics.span("read_docx"):
+            return read_docx(file_path)
     elif file_ext in ['.html', '.htm']:
-        return read_html(file_path)
+        with run_metrics.span("read_html"):
+            return read_html(file_path)
     else:
         print(f"Unsupported file format: {file_ext} for file {file_path}")
         return None, f"Unsupported file format: {file_ext}"
 
+def normalize_text(text:str)->str:
+    """Tidies extracted text: joins ligatures and odd unicode forms, drops trailing spaces and long runs of blank lines."""
+    text = unicodedata.normalize("NFKC", text).replace("\x00", "")
+    text = "\n".join(line.rstrip() for line in text.splitlines())
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+def file_content_hash(file_path:str)->str:
+    """sha256 of a file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def extract_text_cached(file_path:str)->tuple[str | None, str | None]:
+    """
+    Reads a document's text through text_cache, runs in the extraction worker processes.
+    Looks up the path + size + mtime first, then the content hash (for moved or touched files), then parses.
+
+    Returns: (normalized text, None) or (None, error message) like read_file_text.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return read_file_text(file_path)
+    # the reading budget is part of the keys, a different EXTRACT_MAX_TOKENS reads the document again
+    stat_key = DiskCache.hash_parts("stat", os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, EXTRACT_MAX_TOKENS)
+    content_key = text_cache.get_text(stat_key)
+    if content_key:
+        text = text_cache.get_text(content_key)
+        if text is not None:
+            run_metrics.count("text_cache_hits")
+            return text, None
+
+    content_key = DiskCache.hash_parts("content", file_content_hash(file_path), EXTRACT_MAX_TOKENS)
+    text = text_cache.get_text(content_key)
+    if text is None:
+        text, error_msg = read_file_text(file_path)
+        if error_msg or text is None:
+            return text, error_msg
+        text = normalize_text(text)
+        text_cache.put_text(content_key, text)
+    else:
+        run_metrics.count("text_cache_hits")
+    text_cache.put_text(stat_key, content_key)
+    return text, None
+
 # ---------------------------------------------------------------
 
-def zip_folder(folder_path, output_path):
+# files that are already compressed, deflating them again costs CPU for next to no gain
+STORED_EXTENSIONS = {'.flac', '.opus', '.ogg', '.mp3'}
+# deflate level for everything else (1 fastest - 9 smallest)
+ARCHIVE_COMPRESSLEVEL = 6
+# per file type deflate levels: level 1 takes as much off 16-bit speech WAV as level 6 (about 20%, the quiet
+# parts), at twice the speed
+EXTENSION_COMPRESSLEVELS = {'.wav': 1}
+# split archives into volumes of about this many bytes (0 keeps one archive)
+ARCHIVE_VOLUME_BYTES = 0
+
+class ArchiveWriter:
+    """
+    A zip file that files are added to one at a time, as soon as they are finished.
+    Already compressed audio is stored as is, everything else is deflated. The archive is written
+    under a temporary name and only replaces the previous one when closed (not if discarded), optionally split into
+    volumes (name.zip, name-2.zip, ...) of about volume_bytes each.
+    """
+    def __init__(self, output_path:str, volume_bytes:int = 0):
+        self.output_path = output_path
+        self.volume_bytes = volume_bytes
+        self.lock = threading.Lock()
+        self.names = set()
+        self.volumes = []
+        self.zipf = None
+        self._next_volume()
+
+    def _volume_path(self, number:int)->str:
+        if number == 1:
+            return self.output_path
+        base, ext = os.path.splitext(self.output_path)
+        return f"{base}-{number}{ext}"
+
+    def _next_volume(self):
+        if self.zipf is not None:
+            self.zipf.close()
+        path = self._volume_path(len(self.volumes) + 1)
+        self.volumes.append(path)
+        self.zipf = zipfile.ZipFile(path + ".partial", 'w', zipfile.ZIP_DEFLATED, compresslevel=ARCHIVE_COMPRESSLEVEL)
+
+    def add(self, file_path:str, arcname:str = None):
+        """Adds one file, each name is only added once."""
+        self._add(arcname or os.path.basename(file_path), file_path=file_path)
+
+    def add_data(self, arcname:str, data:bytes):
+        """Adds a file from memory (e.g. out of the output store), each name is only added once."""
+        self._add(arcname, data=data)
+
+    def _add(self, arcname:str, file_path:str = None, data:bytes = None):
+        with self.lock, run_metrics.span("package_file"):
+            if arcname in self.names:
+                return
+            if self.volume_bytes and len(self.zipf.namelist()) and self.zipf.fp.tell() >= self.volume_bytes:
+                self._next_volume()
+            extension = os.path.splitext(arcname)[1].lower()
+            compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else None
+            compresslevel = EXTENSION_COMPRESSLEVELS.get(extension, ARCHIVE_COMPRESSLEVEL)
+            if data is not None:
+                self.zipf.writestr(arcname, data, compress_type=compress_type, compresslevel=compresslevel)
+            else:
+                self.zipf.write(file_path, arcname, compress_type=compress_type, compresslevel=compresslevel)
+            self.names.add(arcname)
+
+    def add_folder(self, folder_path:str):
+        """Adds every file in a folder that isn't in the archive yet."""
+        for root, _, files in os.walk(folder_path):
+            for file in files:
+                file_path = os.path.join(root, file)
+                self.add(file_path, os.path.relpath(file_path, folder_path))
+
+    def close(self)->list:
+        """Finishes the archive and moves every volume into place, returns the volume paths."""
+        with self.lock, run_metrics.span("package_close"):
+            self.zipf.close()
+            for path in self.volumes:
+                os.replace(path + ".partial", path)
+            # volumes left over from an earlier, bigger run would be mistaken for part of this one
+            number = len(self.volumes) + 1
+            while os.path.exists(self._volume_path(number)):
+                os.remove(self._volume_path(number))
+                number += 1
+            return list(self.volumes)
+
+    def discard(self):
+        """Abandons the archive: deletes the volumes written so far and leaves the previous archive in place."""
+        with self.lock:
+            self.zipf.close()
+            for path in self.volumes:
+                try:
+                    os.remove(path + ".partial")
+                except FileNotFoundError:
+                    pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # an archive cut short by an error never replaces a complete one
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+def zip_folder(folder_path, output_path, volume_bytes=0):
     """
     Zips the contents of a folder into a zip file.
+    Already compressed audio is stored as is, everything else is deflated.
 
     Args:
         folder_path (str): The path to the folder to be zipped.
         output_path (str): The path to the output zip file.
+        volume_bytes (int): split into volumes of about this size (0 for one file).
     """
-    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                zipf.write(file_path, os.path.relpath(file_path, folder_path))
+    with ArchiveWriter(output_path, volume_bytes) as archive:
+        archive.add_folder(folder_path)
 
 # ---------------------------------------------------------------
 
+# a tagged RIS line, e.g. "TI  - A title", the value may be missing on end tags like "ER  -"
+RIS_LINE_PATTERN = re.compile(r"^([A-Z][A-Z0-9])  -(?: (.*))?$")
+
+class RisRecord:
+    """One RIS item with the fields the pipeline uses already pulled out."""
+    __slots__ = ("lines", "ris_type", "title", "authors", "year", "files", "doi", "ris_id", "keywords")
+
+    def __init__(self, lines:list):
+        self.lines = lines
+        self.ris_type = ''
+        self.title = 'Unknown Title'
+        self.authors = []
+        self.year = '0'
+        self.files = []
+        self.doi = ''
+        self.ris_id = ''
+        self.keywords = []
+        for line in lines:
+            tag, value = line[:2], line[6:]
+            if tag == 'TY':
+                self.ris_type = value
+            elif tag == 'TI':
+                self.title = value
+            elif tag == 'AU':
+                self.authors.append(value)
+            elif tag == 'PY':
+                self.year = value
+            elif tag in ('L1', 'L2'):
+                self.files.append(value)
+            elif tag == 'DO' and not self.doi:
+                self.doi = value
+            elif tag == 'ID' and not self.ris_id:
+                self.ris_id = value
+            elif tag == 'KW' and value.strip():
+                self.keywords.append(value.strip())
+
+def iter_ris_lines(source:str):
+    """
+    Yields the lines of an RIS file or URL one at a time without line endings.
+    Both LF and CRLF line endings are handled.
+    Args:
+        source: a local path, or an http(s) URL which is streamed rather than downloaded first
+    """
+    if source.startswith("http"):
+        with get_session().get(source, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            response.encoding = response.encoding or "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                yield line.rstrip("\r")
+    else:
+        # newline=None turns CRLF into LF as the file is read
+        with open(source, "r", encoding="utf-8-sig", newline=None) as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+def read_ris_records(source:str):
+    """
+    Streams the records of an RIS file or URL in a single pass.
+    Continuation lines (lines without a tag) are glued onto the tag before them, a record without
+    a closing ER tag at the end of the file is still returned.
+    Args:
+        source: a local path or an http(s) URL
+
+    Returns: generator of RisRecord
+    """
+    lines = []
+    fixes = 0
+    for raw in iter_ris_lines(source):
+        match = RIS_LINE_PATTERN.match(raw)
+        if match is None:
+            if not raw.strip():
+                continue
+            if lines:
+                # wrapped value, put it back on the line it belongs to
+                lines[-1] = lines[-1] + raw
+                fixes += 1
+            else:
+                print(f"Ignoring RIS line outside of a record: {raw[:50]}")
+            continue
+        if match.group(1) == 'ER':
+            if lines:
+                yield RisRecord(lines)
+            lines = []
+            continue
+        lines.append(f"{match.group(1)}  - {match.group(2) or ''}")
+    if lines:
+        yield RisRecord(lines)
+    if fixes:
+        print(f"Preprocessing Fixed  {fixes} lines.")
+
+# ---------------------------------------------------------------
+
+# the summaries and audio of every item live in one SQLite file in the work folder, keyed by the item's
+# identity (ris_item_key), downstream tools can open it directly to look up a single paper
+OUTPUT_STORE_NAME = "pazsage_outputs.sqlite"
+
+OUTPUT_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    position INTEGER,
+    name TEXT,
+    title TEXT,
+    year TEXT,
+    doi TEXT,
+    ris TEXT,
+    summary TEXT,
+    model TEXT,
+    audio BLOB,
+    audio_name TEXT,
+    audio_format TEXT,
+    voice TEXT,
+    duplicate_of TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS items_position ON items (position);
+CREATE INDEX IF NOT EXISTS items_year ON items (year);
+CREATE TABLE IF NOT EXISTS authors (key TEXT NOT NULL, author TEXT NOT NULL COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS authors_author ON authors (author);
+CREATE INDEX IF NOT EXISTS authors_key ON authors (key);
+CREATE TABLE IF NOT EXISTS tags (key TEXT NOT NULL, tag TEXT NOT NULL COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+CREATE TABLE IF NOT EXISTS manifest (key TEXT PRIMARY KEY, entry TEXT NOT NULL);
+"""
+
+# characters that can't be in a file name on some system (or would make a folder), swapped for "-"
+UNSAFE_NAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+# longest title kept in a file name, most file systems stop at 255 bytes
+NAME_TITLE_CHARS = 150
+
+def safe_name_part(text:str, limit:int = NAME_TITLE_CHARS)->str:
+    """Makes text safe to use in a file (or zip member) name."""
+    return " ".join(UNSAFE_NAME_CHARS.sub("-", text).split())[:limit].strip(" .")
+
+class OutputStore:
+    """
+    Every item's summary text, audio and RIS metadata in one SQLite file, looked up by item key.
+    Each change is one transaction, so an item is never seen half written, and several processes
+    (sharded workers) can share the file. Authors and tags (RIS KW lines) are indexed for partial exports.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=120, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(OUTPUT_STORE_SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _write(self, *statements):
+        """Runs (sql, params) statements in one transaction."""
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self.db.execute(sql, params)
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def _metadata(self, key:str, position:int, record:RisRecord)->list:
+        """The statements that (re)write an item's metadata and its author and tag index."""
+        return [("INSERT INTO items (key, position, title, year, doi, ris, updated) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                 "ON CONFLICT (key) DO UPDATE SET position = excluded.position, title = excluded.title, year = excluded.year, "
+                 "doi = excluded.doi, ris = excluded.ris, updated = excluded.updated",
+                 (key, position, record.title, record.year, record.doi, "\n".join(record.lines), time.time())),
+                ("DELETE FROM authors WHERE key = ?", (key,)),
+                ("DELETE FROM tags WHERE key = ?", (key,))] + \
+               [("INSERT INTO authors (key, author) VALUES (?, ?)", (key, author)) for author in record.authors] + \
+               [("INSERT INTO tags (key, tag) VALUES (?, ?)", (key, tag)) for tag in record.keywords]
+
+    def put_summary(self, key:str, position:int, record:RisRecord, name:str, summary:str, model:str):
+        """Stores an item's summary (dropping any audio made from an older one)."""
+        self._write(*self._metadata(key, position, record),
+                    ("UPDATE items SET name = ?, summary = ?, model = ?, duplicate_of = NULL, audio = NULL, audio_name = NULL, "
+                     "audio_format = NULL, voice = NULL WHERE key = ?", (name, summary, model, key)))
+
+    def put_duplicate(self, key:str, position:int, record:RisRecord, canonical:str):
+        """Records that an item reuses another item's summary and audio, lookups of it return that item's."""
+        self._write(*self._metadata(key, position, record),
+                    ("UPDATE items SET name = NULL, summary = NULL, model = NULL, duplicate_of = ?, audio = NULL, audio_name = NULL, "
+                     "audio_format = NULL, voice = NULL WHERE key = ?", (canonical, key)))
+
+    def put_audio(self, key:str, audio:bytes, audio_name:str, audio_format:str, voice:str):
+        """Stores the audio file made for an item's summary (its bytes, read once by the caller)."""
+        self._write(("UPDATE items SET audio = ?, audio_name = ?, audio_format = ?, voice = ?, updated = ? WHERE key = ?",
+                     (audio, audio_name, audio_format, voice, time.time(), key)))
+
+    def rename(self, key:str, name:str, position:int = None):
+        """Gives an item's summary (and audio) a new name, used when its place in the library shifts."""
+        with self.lock:
+            row = self.db.execute("SELECT name, position, audio_name FROM items WHERE key = ?", (key,)).fetchone()
+        if row is None or (row["name"] == name and position in (None, row["position"])):
+            return
+        audio_name = row["audio_name"] and name[:-4] + os.path.splitext(row["audio_name"])[1]
+        self._write(("UPDATE items SET name = ?, audio_name = ?, position = COALESCE(?, position) WHERE key = ?",
+                     (name, audio_name, position, key)))
+
+    def delete(self, key:str):
+        """Removes an item and everything stored for it."""
+        self._write(("DELETE FROM items WHERE key = ?", (key,)), ("DELETE FROM authors WHERE key = ?", (key,)),
+                    ("DELETE FROM tags WHERE key = ?", (key,)))
+
+    def has_summary(self, key:str, name:str = None)->bool:
+        with self.lock:
+            row = self.db.execute("SELECT name FROM items WHERE key = ? AND summary IS NOT NULL", (key,)).fetchone()
+        return row is not None and (name is None or row["name"] == name)
+
+    def has_audio(self, key:str, audio_name:str = None)->bool:
+        with self.lock:
+            row = self.db.execute("SELECT audio_name FROM items WHERE key = ? AND audio IS NOT NULL", (key,)).fetchone()
+        return row is not None and (audio_name is None or row["audio_name"] == audio_name)
+
+    def get(self, key:str)->dict | None:
+        """
+        Looks up one item by key, following duplicates to the item whose summary they reuse.
+        Returns: the item's metadata, summary, authors and tags (not the audio, see get_audio), or None.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT * FROM items WHERE key = ?", (key,)).fetchone()
+            if row is not None and row["duplicate_of"]:
+                original = self.db.execute("SELECT * FROM items WHERE key = ?", (row["duplicate_of"],)).fetchone()
+                if original is None:
+                    return None
+                row = {**dict(original), "key": key, "duplicate_of": row["duplicate_of"]}
+            if row is None:
+                return None
+            item = {field: row[field] for field in row.keys() if field != "audio"}
+            item["authors"] = [r["author"] for r in self.db.execute("SELECT author FROM authors WHERE key = ? ORDER BY rowid", (key,))]
+            item["tags"] = [r["tag"] for r in self.db.execute("SELECT tag FROM tags WHERE key = ? ORDER BY rowid", (key,))]
+            return item
+
+    def get_audio(self, key:str)->tuple[str, bytes] | None:
+        """Returns (audio file name, audio bytes) for an item (or the item it duplicates), or None."""
+        with self.lock:
+            row = self.db.execute("SELECT audio_name, audio, duplicate_of FROM items WHERE key = ?", (key,)).fetchone()
+            if row is not None and row["duplicate_of"]:
+                row = self.db.execute("SELECT audio_name, audio FROM items WHERE key = ?", (row["duplicate_of"],)).fetchone()
+        if row is None or row["audio"] is None:
+            return None
+        return row["audio_name"], row["audio"]
+
+    def select(self, year:str = None, author:str = None, tag:str = None)->list[dict]:
+        """
+        Lists the items with their own summary, in library order, optionally only one year, author or tag.
+        Args:
+            year: the RIS PY value, e.g. "2020"
+            author: part of an author's name, any case
+            tag: an RIS keyword, any case
+
+        Returns: list of {"key", "position", "name", "title", "year", "audio_name"}
+        """
+        sql = "SELECT key, position, name, title, year, audio_name FROM items WHERE summary IS NOT NULL"
+        params = []
+        if year:
+            sql += " AND year = ?"
+            params.append(str(year))
+        if author:
+            sql += " AND key IN (SELECT key FROM authors WHERE author LIKE ?)"
+            params.append(f"%{author}%")
+        if tag:
+            sql += " AND key IN (SELECT key FROM tags WHERE tag = ?)"
+            params.append(tag)
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql + " ORDER BY position", params)]
+
+    def prune(self, keys:set):
+        """Removes every item whose key isn't in keys (left the library)."""
+        with self.lock:
+            stale = [row["key"] for row in self.db.execute("SELECT key FROM items") if row["key"] not in keys]
+        for key in stale:
+            self.delete(key)
+
+    def load_manifest(self)->dict:
+        """Returns every item's run state (see RunManifest), key -> entry."""
+        with self.lock:
+            return {row["key"]: json.loads(row["entry"]) for row in self.db.execute("SELECT key, entry FROM manifest")}
+
+    def save_manifest(self, entries:dict, removed:set = ()):
+        """Writes the run state of the changed items and forgets the removed ones, in one transaction."""
+        self._write(*[("INSERT INTO manifest (key, entry) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET entry = excluded.entry",
+                       (key, json.dumps(entry))) for key, entry in entries.items()],
+                    *[("DELETE FROM manifest WHERE key = ?", (key,)) for key in removed])
+
+    def _column(self, key:str, column:str):
+        with self.lock:
+            row = self.db.execute(f"SELECT {column} FROM items WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def export(self, summary_archive, audio_archive, year:str = None, author:str = None, tag:str = None)->int:
+        """
+        Adds the summaries and audio of the selected items (see select) to open ArchiveWriters.
+        Files the archives already hold are not read again.
+
+        Returns: the number of items exported.
+        """
+        items = self.select(year, author, tag)
+        for item in items:
+            if item["name"] not in summary_archive.names:
+                summary_archive.add_data(item["name"], self._column(item["key"], "summary").encode("utf-8"))
+            if item["audio_name"] and item["audio_name"] not in audio_archive.names:
+                audio = self._column(item["key"], "audio")
+                if audio is not None:
+                    audio_archive.add_data(item["audio_name"], audio)
+        return len(items)
+
+def export_output_store(store_path:str, out_folder:str, year:str = None, author:str = None, tag:str = None)->tuple[list, list, int]:
+    """
+    Writes summaries.zip and audio.zip for the selected items of an output store.
+    Returns: (audio zip volumes, summaries zip volumes, number of items)
+    """
+    os.makedirs(out_folder, exist_ok=True)
+    store = OutputStore(store_path)
+    try:
+        with ArchiveWriter(os.path.join(out_folder, 'summaries.zip'), ARCHIVE_VOLUME_BYTES) as summaries, \
+             ArchiveWriter(os.path.join(out_folder, 'audio.zip'), ARCHIVE_VOLUME_BYTES) as audio:
+            count = store.export(summaries, audio, year, author, tag)
+        return audio.volumes, summaries.volumes, count
+    finally:
+        store.close()
+
+# ---------------------------------------------------------------
+
+# the stages every RIS item goes through, in order
+MANIFEST_STAGES = ["extracted", "summarized", "voiced", "packaged"]
+
+def ris_item_key(record:RisRecord, doc_folder:str)->str:
+    """
+    Builds a stable identity for one RIS item so it can be found again on the next run.
+    Uses the ID tag, then the DOI, then the attached file paths, then a hash of the record.
+    Args:
+        record: the RIS item
+        doc_folder: the folder the L1/L2 paths are relative to
+    """
+    if record.ris_id:
+        return "ID:" + record.ris_id.strip()
+    if record.doi:
+        return "DO:" + record.doi.strip().lower()
+    if record.files:
+        return "FILE:" + "|".join(os.path.normpath(os.path.join(doc_folder, f.strip())) for f in record.files)
+    return "RIS:" + hashlib.sha256("\n".join(record.lines).encode("utf-8")).hexdigest()
+
+def ris_item_keys(records:list, doc_folder:str)->list[str]:
+    """Builds the keys for every item, numbering repeats so each key is unique within the library."""
+    keys, seen = [], {}
+    for record in records:
+        key = ris_item_key(record, doc_folder)
+        seen[key] = seen.get(key, 0) + 1
+        keys.append(key if seen[key] == 1 else f"{key}#{seen[key]}")
+    return keys
+
+def ris_item_fingerprint(record:RisRecord, doc_folder:str)->str:
+    """
+    Hashes an item's record plus the size and mtime of its attached files, a change means redo the item.
+    Args:
+        record: the RIS item
+        doc_folder: the folder the L1/L2 paths are relative to
+    """
+    digest = hashlib.sha256("\n".join(record.lines).encode("utf-8"))
+    for file in record.files:
+        try:
+            stat = os.stat(os.path.join(doc_folder, file))
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+        except OSError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+class RunManifest:
+    """
+    Per-item record of which stages (MANIFEST_STAGES) are finished, kept in the output store's manifest table
+    (one row per item) so a run that dies part way can pick up where it stopped. Only the items changed since
+    the last save are written, so a save costs the same in a 10 item library as in a 10,000 item one.
+    """
+    def __init__(self, store:OutputStore, legacy_path:str = None):
+        """
+        Args:
+            store: the output store the manifest lives in
+            legacy_path: a manifest.json from before the manifest moved into the store, imported once and removed
+        """
+        self.store = store
+        self.lock = threading.RLock()
+        self.items = store.load_manifest()
+        self.changed = set()
+        self.removed = set()
+        if not self.items and legacy_path and os.path.isfile(legacy_path):
+            try:
+                with open(legacy_path, "r", encoding="utf-8") as f:
+                    self.items = json.load(f).get("items", {})
+                self.changed.update(self.items)
+                self.save()
+                os.remove(legacy_path)
+            except (OSError, ValueError) as e:
+                print(f"Could not import manifest {legacy_path}, starting fresh: {e}")
+                self.items, self.changed = {}, set()
+
+    def save(self):
+        """Writes the items changed since the last save, in one transaction so a crash never leaves it half written."""
+        with self.lock:
+            if not self.changed and not self.removed:
+                return
+            self.store.save_manifest({key: self.items[key] for key in self.changed if key in self.items}, self.removed)
+            self.changed, self.removed = set(), set()
+
+    def _remove_outputs(self, key:str):
+        """Deletes the summary and audio stored for an item."""
+        self.store.delete(key)
+
+    def start_item(self, key:str, fingerprint:str, title:str, save:bool=True):
+        """Registers an item for this run, clearing its stages if the record or its files changed."""
+        with self.lock:
+            entry = self.items.setdefault(key, {"stages": {}})
+            if entry.get("title") != title or entry.get("fingerprint") != fingerprint:
+                self.changed.add(key)
+            entry["title"] = title
+            if entry.get("fingerprint") != fingerprint:
+                entry["fingerprint"] = fingerprint
+                entry["stages"] = {}
+            if save:
+                self.save()
+
+    def is_done(self, key:str, stage:str, **expected)->bool:
+        """
+        Checks a stage is finished for an item and its output still exists.
+        Args:
+            key: the manifest key of the item
+            stage: one of MANIFEST_STAGES
+            expected: fields that must match what the stage was done with (e.g. model or voice)
+        """
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None or not entry["stages"].get(stage):
+                return False
+            if any(entry.get(field) != value for field, value in expected.items()):
+                return False
+            if entry.get("duplicate_of"):
+                # a duplicate has no files of its own, it is done while the item it reuses is
+                return stage == "summarized" and self.is_done(entry["duplicate_of"], stage, **expected)
+            if stage == "summarized" and not self.store.has_summary(key, entry.get("summary_file")):
+                return False
+            if stage == "voiced" and not self.store.has_audio(key, entry.get("audio_file")):
+                return False
+            return True
+
+    def mark(self, key:str, stage:str, **fields):
+        """Marks a stage finished (and every later stage not finished) and records fields like the output names."""
+        with self.lock:
+            entry = self.items.setdefault(key, {"stages": {}})
+            if fields.get("duplicate_of"):
+                # now reusing another item's summary, its own outputs from an earlier run go
+                self._remove_outputs(key)
+                entry.pop("summary_file", None)
+                entry.pop("audio_file", None)
+            elif fields.get("summary_file"):
+                for field in ("duplicate_of", "duplicate_reason", "similarity"):
+                    entry.pop(field, None)
+            if fields.get("summary_file"):
+                # a new summary replaces the stored one and its audio
+                entry.pop("audio_file", None)
+            entry.update(fields)
+            later = MANIFEST_STAGES[MANIFEST_STAGES.index(stage) + 1:]
+            for later_stage in later:
+                entry["stages"].pop(later_stage, None)
+            entry["stages"][stage] = True
+            self.changed.add(key)
+            self.save()
+
+    def mark_all(self, stage:str, after:str):
+        """Marks stage finished on every item that has finished the after stage."""
+        with self.lock:
+            for key, entry in self.items.items():
+                if entry["stages"].get(after) and not entry["stages"].get(stage):
+                    entry["stages"][stage] = True
+                    self.changed.add(key)
+            self.save()
+
+    def rename_outputs(self, key:str, summary_file:str, position:int = None):
+        """Gives an item's summary (and audio) a new name, used when its place in the library shifts."""
+        with self.lock:
+            entry = self.items[key]
+            old_name = entry.get("summary_file")
+            if not old_name or old_name == summary_file:
+                return
+            self.store.rename(key, summary_file, position)
+            entry["summary_file"] = summary_file
+            if entry.get("audio_file"):
+                entry["audio_file"] = summary_file[:-4] + os.path.splitext(entry["audio_file"])[1]
+            self.changed.add(key)
+            self.save()
+
+    def canonical_of(self, key:str)->str | None:
+        """Returns the key of the item whose summary this item reuses, or None if it has its own."""
+        with self.lock:
+            return self.items.get(key, {}).get("duplicate_of")
+
+    def duplicates(self)->list:
+        """Lists every item that reuses another item's summary, for the merge report."""
+        with self.lock:
+            merged = []
+            for key, entry in self.items.items():
+                canonical = entry.get("duplicate_of")
+                if canonical and entry["stages"].get("summarized"):
+                    original = self.items.get(canonical, {})
+                    merged.append({"key": key, "title": entry.get("title"), "reason": entry.get("duplicate_reason"),
+                                   "similarity": entry.get("similarity"), "duplicate_of": canonical,
+                                   "duplicate_of_title": original.get("title"),
+                                   "summary_file": original.get("summary_file"), "audio_file": original.get("audio_file")})
+            return merged
+
+    def prune(self, keys:list):
+        """Forgets items no longer in the library and deletes their outputs."""
+        with self.lock:
+            keep = set(keys)
+            for key in [k for k in self.items if k not in keep]:
+                print(f"Removing outputs for item no longer in the library: {self.items[key].get('title')}")
+                self._remove_outputs(key)
+                self.items.pop(key)
+                self.removed.add(key)
+            self.store.prune(keep)
+            self.save()
+
+# ---------------------------------------------------------------
+
+# items that are the same work (same DOI, same text, or near-identical text such as a preprint and
+# the published version) are summarized and voiced once, the others reuse that summary and audio
+DEDUPLICATE = True
+# share of matching MinHash values (estimated Jaccard similarity of word shingles) that counts as a duplicate
+NEAR_DUPLICATE_THRESHOLD = 0.7
+SHINGLE_WORDS = 5
+MINHASH_PERMUTATIONS = 64
+# LSH bands of MINHASH_PERMUTATIONS / MINHASH_BANDS values each, items sharing a band are compared
+MINHASH_BANDS = 16
+MINHASH_PRIME = (1 << 61) - 1
+MINHASH_BLOCK = 8192
+DUPLICATES_REPORT_NAME = "duplicates.json"
+
+def normalize_doi(doi:str | None)->str | None:
+    """Lower cases a DOI and drops any resolver prefix, so the forms found in RIS files compare equal."""
+    if not doi:
+        return None
+    doi = re.sub(r"^(?:https?://(?:dx\.)?doi\.org/|doi:)", "", doi.strip().lower())
+    return doi or None
+
+def text_words(text:str)->list[str]:
+    """The words of a document, lower cased with punctuation and layout dropped."""
+    return WORD_PATTERN.findall(text.lower())
+
+def minhash_signature(words:list[str]):
+    """
+    MinHash signature (MINHASH_PERMUTATIONS uint32 values) of a document's SHINGLE_WORDS-word shingles.
+    Shingles are hashed with crc32 so signatures stay comparable between runs.
+    """
+    import numpy as np
+    rng = random.Random(1)
+    a = np.array([rng.randrange(1, 1 << 32) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64).reshape(-1, 1)
+    b = np.array([rng.randrange(0, 1 << 32) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64).reshape(-1, 1)
+    count = max(1, len(words) - SHINGLE_WORDS + 1)
+    hashes = np.unique(np.fromiter((zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8")) for i in range(count)),
+                                   dtype=np.uint64, count=count))
+    signature = np.full(MINHASH_PERMUTATIONS, 0xFFFFFFFF, dtype=np.uint64)
+    # a block at a time so a huge document doesn't need a permutations x shingles table in memory
+    for start in range(0, len(hashes), MINHASH_BLOCK):
+        values = ((a * hashes[start:start + MINHASH_BLOCK] + b) % MINHASH_PRIME) & 0xFFFFFFFF
+        signature = np.minimum(signature, values.min(axis=1))
+    return signature.astype(np.uint32)
+
+class DuplicateFinder:
+    """
+    Spots items that are the same work as one seen earlier in the run (or in an earlier run): the same DOI,
+    the same text, or text whose MinHash similarity is at least NEAR_DUPLICATE_THRESHOLD (found through LSH bands).
+    The first item with a given DOI or text owns it; later items that match wait for the owner to finish
+    and then reuse its summary. An owner that ends without a summary gives up its DOI and text, so the next
+    item to claim them again takes over and the rest wait for that one instead of each writing a summary.
+    Text signatures are kept in a JSON file so later runs can match against them.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.owners = {}      # "doi:..." / "text:..." -> owning key
+        self.bands = {}       # (band, values) -> owning keys
+        self.signatures = {}  # owning key -> MinHash signature
+        self.finished = {}    # owning key -> Event set once its summary is written (or failed)
+        self.summarized = {}  # owning key -> whether it ended up with a summary
+        self.stored = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.stored = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Could not read duplicate signatures {path}, starting fresh: {e}")
+
+    def _own(self, key:str):
+        if key not in self.finished:
+            self.finished[key] = threading.Event()
+
+    def _own_text(self, key:str, text_hash:str, signature):
+        import numpy as np
+        self.owners.setdefault("text:" + text_hash, key)
+        self.signatures[key] = signature
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        for band in range(MINHASH_BANDS):
+            self.bands.setdefault((band, signature[band * rows:(band + 1) * rows].tobytes()), []).append(key)
+        self.stored[key] = {"text_hash": text_hash,
+                            "minhash": base64.b64encode(np.asarray(signature, dtype="<u4").tobytes()).decode("ascii")}
+
+    def add_finished(self, key:str, doi:str | None):
+        """Registers an item summarized in an earlier run, so new items can reuse it."""
+        import numpy as np
+        with self.lock:
+            self._own(key)
+            self.finished[key].set()
+            self.summarized[key] = True
+            doi = normalize_doi(doi)
+            if doi:
+                self.owners.setdefault("doi:" + doi, key)
+            stored = self.stored.get(key)
+            if stored:
+                signature = np.frombuffer(base64.b64decode(stored["minhash"]), dtype="<u4").astype(np.uint32)
+                if len(signature) == MINHASH_PERMUTATIONS:
+                    self._own_text(key, stored["text_hash"], signature)
+
+    def claim_doi(self, key:str, doi:str | None)->tuple[str, str, float] | None:
+        """
+        Returns (owner key, "doi", 1.0) if another item already has this DOI, otherwise makes this item its owner.
+        """
+        doi = normalize_doi(doi)
+        if not doi:
+            return None
+        with self.lock:
+            owner = self.owners.setdefault("doi:" + doi, key)
+            self._own(key)
+            return (owner, "doi", 1.0) if owner != key else None
+
+    def claim_text(self, key:str, text:str)->tuple[str, str, float] | None:
+        """
+        Returns (owner key, "same text" or "near duplicate", similarity) if an earlier item has the same or
+        nearly the same text, otherwise makes this item the owner of its text.
+        """
+        words = text_words(text)
+        text_hash = hashlib.sha256(" ".join(words).encode("utf-8")).hexdigest()
+        signature = minhash_signature(words)
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        with self.lock:
+            self._own(key)
+            owner = self.owners.get("text:" + text_hash)
+            if owner is not None and owner != key:
+                return owner, "same text", 1.0
+            best, best_similarity = None, 0.0
+            for band in range(MINHASH_BANDS):
+                for candidate in self.bands.get((band, signature[band * rows:(band + 1) * rows].tobytes()), []):
+                    if candidate == key:
+                        continue
+                    similarity = float((self.signatures[candidate] == signature).mean())
+                    if similarity > best_similarity:
+                        best, best_similarity = candidate, similarity
+            if best is not None and best_similarity >= NEAR_DUPLICATE_THRESHOLD:
+                return best, "near duplicate", round(best_similarity, 3)
+            self._own_text(key, text_hash, signature)
+            return None
+
+    def done(self, key:str, summarized:bool):
+        """
+        Called when an item stops, wakes the items waiting to reuse its summary.
+        Without a summary it stops owning its DOI and text, so the waiting items can claim them again.
+        """
+        with self.lock:
+            self._own(key)
+            self.summarized[key] = summarized
+            if not summarized:
+                self.owners = {name: owner for name, owner in self.owners.items() if owner != key}
+                for band_key, keys in list(self.bands.items()):
+                    if key in keys:
+                        keys.remove(key)
+                        if not keys:
+                            del self.bands[band_key]
+                self.signatures.pop(key, None)
+                self.stored.pop(key, None)
+            self.finished[key].set()
+
+    def wait(self, key:str)->bool:
+        """
+        Waits for an owning item to finish, returns whether it has a summary to reuse.
+        If not, claim the DOI or text again: the first item to do so becomes the new owner.
+        """
+        with self.lock:
+            event = self.finished[key]
+        event.wait()
+        with self.lock:
+            return self.summarized.get(key, False)
+
+    def save(self, keys:list):
+        """Writes the text signatures of the items still in the library."""
+        with self.lock:
+            keep = set(keys)
+            self.stored = {key: value for key, value in self.stored.items() if key in keep}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.stored, f)
+            os.replace(tmp_path, self.path)
+
+# ---------------------------------------------------------------
+
+OPENROUTER_CHAT_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# GUI voice choices and the Kokoro voices they map to
+VOICES = {"female": "af_heart", "male": "am_echo"}
+
+def pick_voice(voice:str)->str:
+    """Maps a GUI voice choice to a Kokoro voice, Kokoro voice names are passed through."""
+    if voice in VOICES:
+        return VOICES[voice]
+    if voice and "_" in voice:
+        return voice
+    return "af_bella"
+
+def clean_text_for_speech(text:str)->str:
+    """Removes line breaks and markdown emphasis so Kokoro reads the summary smoothly."""
+    text = text.replace('\n', ' ')
+    text = text.replace('\r', ' ')
+    text = text.replace('**', ' ')
+    text = text.replace('*', ' ')
+    return text
+
+# audio output choices: file extension, soundfile format and subtype
+AUDIO_FORMATS = {
+    "wav": (".wav", "WAV", "PCM_16"),
+    "flac": (".flac", "FLAC", "PCM_16"),
+    "opus": (".opus", "OGG", "OPUS"),
+}
+
+def audio_file_name(summary_file:str, audio_format:str="wav")->str:
+    """Names the audio file for a summary file in the chosen format."""
+    return summary_file[:-4] + AUDIO_FORMATS[audio_format][0]
+
+# sentence boundaries for the audio cache: end punctuation followed by a space, and the title/"Authors:" header break
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\s+(?=Authors: )")
+
+def split_speech_segments(text:str)->list[str]:
+    """Splits cleaned summary text into sentences, with whitespace normalized so equal sentences match."""
+    segments = []
+    for segment in SENTENCE_SPLIT.split(text):
+        segment = " ".join(segment.split())
+        if segment:
+            segments.append(segment)
+    return segments
+
+def group_short_segments(segments:list[str], short_chars:int = None, max_chars:int = None)->list[str]:
+    """
+    Joins runs of short sentences so each run is voiced in one forward pass instead of one per sentence.
+    Args:
+        segments: sentences from split_speech_segments
+        short_chars: sentences shorter than this are joined (default TTS_SHORT_SEGMENT_CHARS)
+        max_chars: the longest a joined segment gets (default TTS_BATCH_MAX_CHARS, 0 joins nothing)
+    """
+    short_chars = TTS_SHORT_SEGMENT_CHARS if short_chars is None else short_chars
+    max_chars = TTS_BATCH_MAX_CHARS if max_chars is None else max_chars
+    if max_chars <= 0:
+        return list(segments)
+    grouped = []
+    joining = False
+    for segment in segments:
+        if len(segment) >= short_chars:
+            grouped.append(segment)
+            joining = False
+        elif joining and len(grouped[-1]) + 1 + len(segment) <= max_chars:
+            grouped[-1] += " " + segment
+        else:
+            grouped.append(segment)
+            joining = True
+    return grouped
+
+class SpeechWriter:
+    """
+    An audio file that voiced sentences are written into one at a time, as soon as each is ready,
+    so memory stays flat however long the summary is. With USE_AUDIO_CACHE each sentence is looked up
+    in audio_cache first and only voiced if it hasn't been seen before.
+    The file is written under a temporary name and only moved into place by close(), so a crash never leaves half a file.
+    """
+    def __init__(self, voiceset:str, fileloc:str, audio_format:str="wav"):
+        import soundfile as sf
+        _, file_format, subtype = AUDIO_FORMATS[audio_format]
+        self.voiceset = voiceset
+        self.fileloc = fileloc
+        self.tmp_loc = f"{fileloc}.{os.getpid()}.tmp"
+        self.segments = 0
+        self.reused = 0
+        print(f"Writing {fileloc}")
+        self.out = sf.SoundFile(self.tmp_loc, 'w', samplerate=24000, channels=1, format=file_format, subtype=subtype)
+
+    def speak(self, segment:str):
+        """Voices a sentence (or, without the audio cache, any amount of text) and appends it to the file."""
+        import numpy as np
+        if not USE_AUDIO_CACHE:
+            for audio in iter_speech(segment, self.voiceset):
+                print(f"Working on Clip {self.segments} ...")
+                self.out.write(audio)
+                self.segments += 1
+            return
+        key = audio_cache.make_key(segment, self.voiceset)
+        samples = audio_cache.get(key)
+        if samples is None:
+            print(f"Working on Clip {self.segments} ...")
+            clips = list(iter_speech(segment, self.voiceset))
+            samples = np.concatenate(clips) if clips else np.zeros(0, dtype=np.float32)
+            audio_cache.put(key, samples)
+        else:
+            self.reused += 1
+        self.out.write(samples)
+        self.segments += 1
+
+    def close(self):
+        """Finishes the file and moves it into place."""
+        self.out.close()
+        if USE_AUDIO_CACHE:
+            print(f"Reused {self.reused} of {self.segments} cached sentences.")
+            run_metrics.count("tts_sentences", self.segments)
+            run_metrics.count("tts_sentences_reused", self.reused)
+        # seconds of audio made, for the real-time factor in the run report
+        run_metrics.count("audio_seconds", self.out.frames / 24000)
+        os.replace(self.tmp_loc, self.fileloc)
+
+    def discard(self):
+        """Drops the temporary file if close() was never reached."""
+        if not self.out.closed:
+            self.out.close()
+        if os.path.exists(self.tmp_loc):
+            os.remove(self.tmp_loc)
+
+def synthesize_audio(text:str, voiceset:str, fileloc:str, audio_format:str="wav"):
+    """
+    Voices a summary with Kokoro and writes it as a 24 kHz audio file (see SpeechWriter).
+    With USE_AUDIO_CACHE each sentence is voiced on its own and cached, so sentences seen before
+    (unchanged answers, repeated headers and phrasing) are reused instead of voiced again.
+    In CPU fast mode, runs of short sentences are voiced (and cached) together, see group_short_segments.
+    Args:
+        text: the summary text (cleaned here)
+        voiceset: the Kokoro voice
+        fileloc: the audio file to write
+        audio_format: one of AUDIO_FORMATS
+    """
+    text = clean_text_for_speech(text)
+    writer = SpeechWriter(voiceset, fileloc, audio_format)
+    try:
+        segments = split_speech_segments(text) if USE_AUDIO_CACHE else [text]
+        if USE_AUDIO_CACHE and TTS_FAST_CPU:
+            segments = group_short_segments(segments)
+        with run_metrics.span("tts"):
+            for segment in segments:
+                writer.speak(segment)
+            writer.close()
+    finally:
+        writer.discard()
+
+class SpeechStream:
+    """
+    Turns answers streamed from OpenRouter into sentences for Kokoro, in summary order.
+    The answers arrive at the same time: the one being read out is passed on as it arrives,
+    later ones are held until the answers before them are finished. Sentences come out split just as
+    split_speech_segments splits the finished summary, so they share the audio cache with synthesize_audio.
+    Iterate over it to get the sentences, iteration ends once close() is called.
+    """
+    def __init__(self, parts:int, header:str = ""):
+        """
+        Args:
+            parts: the number of answers in the summary
+            header: the text read before the answers (title and authors)
+        """
+        self.received = [""] * parts
+        self.finished = [None] * parts
+        self.current = 0
+        self.passed = 0  # characters of the current answer already passed on
+        self.tail = ""   # text after the last complete sentence
+        self.answer_start = 0  # where the current answer starts in the tail
+        self.lock = threading.Lock()
+        self.sentences = queue.Queue()
+        # the summary file puts a blank line before every answer
+        self._pass_on(header + ("\n\n" if parts else ""))
+        self.answer_start = len(self.tail)
+
+    def _pass_on(self, text:str):
+        """Adds text to the read-out order and queues every sentence that is now complete, lock held."""
+        self.tail += clean_text_for_speech(text)
+        segments = SENTENCE_SPLIT.split(self.tail)
+        for segment in segments[:-1]:
+            segment = " ".join(segment.split())
+            if segment:
+                self.sentences.put(segment)
+        self.tail = segments[-1]
+        if len(segments) > 1:
+            self.answer_start = 0
+
+    def feed(self, part:int, text:str):
+        """A piece of answer number part has arrived."""
+        with self.lock:
+            self.received[part] += text
+            if part == self.current:
+                self._pass_on(text)
+                self.passed += len(text)
+
+    def finish(self, part:int, answer:str):
+        """Answer number part is complete, answer is its final text as it goes in the summary."""
+        with self.lock:
+            self.finished[part] = answer
+            while self.current < len(self.finished) and self.finished[self.current] is not None:
+                answer = self.finished[self.current]
+                already = self.received[self.current][:self.passed]
+                # normally the answer is what was streamed, an error note replaces an answer that broke off
+                # (its unfinished last sentence is dropped, the sentences before it were already read out)
+                if answer.startswith(already):
+                    self._pass_on(answer[len(already):])
+                else:
+                    self.tail = self.tail[:self.answer_start]
+                    self._pass_on(answer)
+                self.current += 1
+                if self.current < len(self.finished):
+                    self._pass_on("\n\n")
+                    self.answer_start = len(self.tail)
+                    self._pass_on(self.received[self.current])
+                    self.passed = len(self.received[self.current])
+
+    def finish_text(self, summary:str):
+        """The whole summary arrived at once (single request mode)."""
+        with self.lock:
+            if self.current < len(self.finished):
+                self._pass_on(summary)
+                self.current = len(self.finished)
+
+    def close(self):
+        """Passes on whatever is left and ends the iteration."""
+        with self.lock:
+            if self.current < len(self.finished):
+                self._pass_on(self.received[self.current][self.passed:])
+                for part in range(self.current + 1, len(self.finished)):
+                    self._pass_on("\n\n" + self.received[part])
+                self.current = len(self.finished)
+            segment = " ".join(self.tail.split())
+            if segment:
+                self.sentences.put(segment)
+            self.tail = ""
+            self.sentences.put(None)
+
+    def __iter__(self):
+        while True:
+            sentence = self.sentences.get()
+            if sentence is None:
+                return
+            yield sentence
+
+def worker_context():
+    """
+    The way worker processes are started: forkserver where there is one, else spawn. A plain fork of this
+    process could copy a lock (print, run_metrics, the HTTP session) that another thread holds at that moment,
+    and the child would then hang on it for good.
+    """
+    return multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+def worker_settings()->dict:
+    """The settings (and cache folders) of this process, handed to each worker process when it starts."""
+    settings = {name: value for name, value in globals().items()
+                if name.isupper() and isinstance(value, (bool, int, float, str, list, tuple, dict, set, type(None)))}
+    caches = {"text_cache": (text_cache.folder, text_cache.max_bytes), "audio_cache": (audio_cache.folder, audio_cache.max_bytes)}
+    return {"settings": settings, "caches": caches}
+
+def init_worker(settings:dict):
+    """
+    Runs once in each worker process: a started (not forked) process imports this module afresh,
+    so it takes over the settings and caches the main process is using (see worker_settings).
+    """
+    global text_cache, audio_cache
+    globals().update(settings["settings"])
+    text_cache = TextCache(*settings["caches"]["text_cache"])
+    audio_cache = AudioCache(*settings["caches"]["audio_cache"])
+
+def init_tts_worker(settings:dict, torch_threads:int):
+    """Runs once in each audio worker process: takes the settings, limits torch threads and loads that worker's Kokoro model."""
+    init_worker(settings)
+    configure_torch_threads(torch_threads)
+    get_pipeline()
+
+def voice_stored_summary(store_path:str, key:str, voiceset:str, fileloc:str, audio_format:str="wav")->str | None:
+    """
+    Voices one item's summary from the output store, runs in an audio worker process (or inline with one worker).
+    Args:
+        store_path: the output store (opened here, connections don't cross processes)
+        key: the item's key in the store
+        voiceset: the Kokoro voice
+        fileloc: the audio file to write, the caller moves it into the store
+        audio_format: one of AUDIO_FORMATS
+
+    Returns: None on success, or the error message so one bad summary doesn't stop the others.
+    """
+    try:
+        store = OutputStore(store_path)
+        try:
+            text = store.get(key)["summary"]
+        finally:
+            store.close()
+        synthesize_audio(text, voiceset, fileloc, audio_format)
+        return None
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+def summarize_and_voice(text:str, header:str, model:str, api_key2:str, url2:str, voiceset:str, fileloc:str,
+                        audio_format:str="wav", structured:bool=False)->str:
+    """
+    Summarizes one paper and voices the summary while it is still being written: the answers are streamed
+    from OpenRouter and each finished sentence goes straight to Kokoro, so the audio starts after the first
+    sentence rather than after the whole summary. Used for single papers ("voice this paper now").
+    Args:
+        text: the extracted text of the paper
+        header: what is read before the answers, e.g. "Title Authors: A B"
+        model: the model to use
+        api_key2: the OpenRouter API key
+        url2: the URL of the OpenRouter "OpenAI" style Chat Completions API
+        voiceset: the Kokoro voice
+        fileloc: the audio file to write
+        audio_format: one of AUDIO_FORMATS
+        structured: ask all the questions in a single request (the audio then starts once it is complete)
+
+    Returns: the summary, as make_summary_report returns it.
+    """
+    stream = SpeechStream(len(SUMMARY_QUESTIONS), header)
+    outcome = {}
+
+    def summarize():
+        try:
+            outcome["summary"] = make_summary_report(text=text, model=model, api_key2=api_key2, url2=url2,
+                                                     structured=structured, stream=stream)
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            stream.close()
+
+    t0 = time.perf_counter()
+    writer = SpeechWriter(voiceset, fileloc, audio_format)
+    try:
+        thread = threading.Thread(target=summarize, daemon=True)
+        thread.start()
+        for number, sentence in enumerate(stream):
+            writer.speak(sentence)
+            if number == 0:
+                run_metrics.record("time_to_first_audio", time.perf_counter() - t0)
+        thread.join()
+        if "error" in outcome:
+            raise outcome["error"]
+        writer.close()
+    finally:
+        writer.discard()
+    return outcome["summary"]
+
+def summary_file_name(y:int, record:RisRecord, total:int = 0)->str:
+    """
+    Names an item's summary file: the counter (y) that orders the outputs, then first author, year and title.
+    Args:
+        y: the human-readable counter, the item's place in the library
+        record: the RisRecord for the item
+        total: the number of items in the library, the counter is padded to its width (at least 3 digits)
+    """
+    authors = record.authors
+    etal = '' if len(authors) == 1 else ' et al'
+    first_author = safe_name_part(authors[0]) if authors else 'Unknown'
+
+    # use counter to order file outputs, padded so names sort in library order however many items there are
+    z = str(y).zfill(max(3, len(str(total))))
+
+    return z + first_author + etal + "-" + safe_name_part(str(record.year), 20) + "-" + safe_name_part(record.title) + ".txt"
+
+# the stages of a library run overlap: each finished summary goes to the voice stage (TTS_WORKERS workers), and each
+# audio file to the package stage (PACKAGE_WORKERS), through queues of STAGE_QUEUE_SIZE items. A full queue makes the
+# stage before it wait, so a slow stage holds the others back instead of letting work pile up
+STAGE_QUEUE_SIZE = 16
+PACKAGE_WORKERS = 1
+# seconds between per-stage progress updates sent to the GUI / status callback
+PROGRESS_INTERVAL = 0.5
+
+class PipelineStage:
+    """
+    One stage of a library run: worker threads that take jobs from a bounded queue and run handler on them.
+    put() blocks while the queue is full (backpressure), the time spent blocked is recorded as "<name>_queue_full".
+    """
+    def __init__(self, name:str, workers:int, handler, queue_size:int):
+        self.name = name
+        self.handler = handler
+        self.jobs = queue.Queue(maxsize=max(1, queue_size))
+        self.lock = threading.Lock()
+        self.queued = self.done = self.failed = 0
+        self.threads = [threading.Thread(target=self.work, daemon=True, name=f"{name}-{n}") for n in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, job:tuple):
+        """Queues a job (the handler's arguments), waiting while the queue is full."""
+        with self.lock:
+            self.queued += 1
+        if self.jobs.full():
+            with run_metrics.span(f"{self.name}_queue_full"):
+                self.jobs.put(job)
+        else:
+            self.jobs.put(job)
+
+    def work(self):
+        """Worker loop, runs jobs until close() sends None."""
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                self.handler(*job)
+                with self.lock:
+                    self.done += 1
+            except Exception as e:
+                print(f"Detailed {self.name} error: {e}")
+                with self.lock:
+                    self.failed += 1
+
+    def close(self):
+        """Waits for every queued job to finish and stops the workers."""
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def progress(self)->str:
+        with self.lock:
+            text = f"{self.name.capitalize()} {self.done}/{self.queued}"
+            return text + (f" ({self.failed} failed)" if self.failed else "")
+
+class WorkerPools:
+    """
+    The document reader processes and (with more than one audio worker) the audio worker processes of library runs.
+    The processes are started as jobs arrive, so a run with nothing to voice never loads Kokoro. A pool whose
+    process died is replaced. pazserver keeps one WorkerPools for all its jobs, so the workers (and their Kokoro
+    models) stay loaded between jobs.
+    """
+    def __init__(self):
+        self.settings = worker_settings()
+        self.lock = threading.RLock()
+        self.extractor = self.new_extractor()
+        self.tts_pool = None
+        if TTS_WORKERS > 1:
+            print(f"Generating audio with up to {TTS_WORKERS} worker processes, {TTS_TORCH_THREADS} threads each.")
+            self.tts_pool = self.new_tts_pool()
+
+    def new_extractor(self, workers:int = None):
+        """Starts a pool of document reader processes (EXTRACT_WORKERS unless workers is given)."""
+        return ProcessPoolExecutor(max_workers=workers or EXTRACT_WORKERS, mp_context=worker_context(),
+                                   initializer=init_worker, initargs=(self.settings,))
+
+    def new_tts_pool(self, workers:int = None):
+        """Starts a pool of audio worker processes (TTS_WORKERS unless workers is given)."""
+        return ProcessPoolExecutor(max_workers=workers or TTS_WORKERS, mp_context=worker_context(),
+                                   initializer=init_tts_worker, initargs=(self.settings, TTS_TORCH_THREADS))
+
+    def submit_extract(self, loc)->tuple:
+        """Starts reading one document in the reader processes, returns (the pool, the future)."""
+        with self.lock:
+            try:
+                return self.extractor, self.extractor.submit(call_with_metrics, extract_text_cached, loc)
+            except BrokenProcessPool:
+                self.restart_extractor(self.extractor)
+                return self.extractor, self.extractor.submit(call_with_metrics, extract_text_cached, loc)
+
+    def restart_extractor(self, broken):
+        """
+        Replaces the reader processes after one of them died (e.g. killed for running out of memory on a huge PDF).
+        Once a process dies its whole pool is unusable, every document it was reading fails with BrokenProcessPool.
+        """
+        with self.lock:
+            if self.extractor is not broken:
+                return  # another summary already replaced it
+            print("A document reader process died, starting new ones.")
+            run_metrics.count("extract_pool_restarts")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.extractor = self.new_extractor()
+
+    def restart_tts_pool(self, broken):
+        """
+        Replaces the audio worker processes after one of them died (e.g. Kokoro crashed or ran out of memory),
+        every summary that pool was voicing fails with BrokenProcessPool.
+        """
+        with self.lock:
+            if self.tts_pool is not broken:
+                return  # another voice thread already replaced it
+            print("An audio worker process died, starting new ones.")
+            run_metrics.count("voice_pool_restarts")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.tts_pool = self.new_tts_pool()
+
+    def close(self):
+        """Waits for the running jobs and stops every worker process."""
+        with self.lock:
+            for pool in (self.extractor, self.tts_pool):
+                if pool is not None:
+                    pool.shutdown()
+            self.extractor = self.tts_pool = None
+
+class LibraryProcessor:
+    """
+    The headless part of the program: summarizes and voices every item of an RIS library and zips the results.
+    Used by the GUI (DocumentProcessor) and by the background worker in pazserver.py.
+    """
+    def __init__(self, ris_file, doc_folder, out_folder, api_key, model, voice, structured=False,
+                 refresh_cache=False, audio_format="wav", work_folder=None, status=None, done=None, pools=None):
+        """
+        Args:
+            ris_file: path or URL of the RIS file
+            doc_folder: the folder the L1/L2 paths are relative to
+            out_folder: where the zip files are written
+            api_key: the OpenRouter API key
+            model: the model to use
+            voice: "female", "male" or a Kokoro voice name
+            structured: ask all the questions in a single request per paper
+            refresh_cache: ignore cached answers and ask again
+            audio_format: one of AUDIO_FORMATS
+            work_folder: where the summaries/audio/staging folders live (defaults to the current folder)
+            status: called with a progress message
+            done: called with (output_zip1, output_zip2, status message) when the run stops
+            pools: WorkerPools to use and leave open (pazserver keeps one for every job), by default the run starts its own
+        """
+        self.ris_file = ris_file
+        self.doc_folder = doc_folder
+        self.out_folder = out_folder
+        self.api_key = api_key
+        self.model = model
+        self.voice = voice
+        self.structured = structured
+        self.refresh_cache = refresh_cache
+        self.audio_format = audio_format
+        self.work_folder = work_folder or os.getcwd()
+        self.status = status or print
+        self.done = done or (lambda output_zip1, output_zip2, status: print(status))
+        self.shared_pools = pools
+
+    def run(self):
+        """Runs the whole library: reading, summaries, audio and packaging overlap, then the zip files are closed and the run report written."""
+        ris_file2 = self.ris_file
+        doc_folder2 = self.doc_folder
+        out_folder2 = self.out_folder
+        api_key2 = self.api_key
+        model2 = self.model
+        voice2 = self.voice
+        structured2 = self.structured
+        summary_cache.refresh = self.refresh_cache
+
+        # Placeholder for your actual processing function
+        print("\n\n" + "-" * 50)
+        print("Starting process with:")
+        print(f"RIS File: {ris_file2}")
+        print(f"Document Folder: {doc_folder2}")
+        print(f"Output Folder: {out_folder2}")
+        print(f"API Key: {'*' * 8 if api_key2 else '(none)'}")
+        print(f"Model: {model2}")
+        print(f"Voice: {voice2}")
+        print(f"Summary Mode: {'single request' if structured2 else 'per question'}")
+        print(f"Summary Cache: {'refresh' if self.refresh_cache else 'use cached'}")
+        print(f"Audio Format: {self.audio_format}")
+        print("-" * 50 + "\n" + "-" * 50)
+
+        # set Variables
+        chat_url2 = OPENROUTER_CHAT_URL
+        run_metrics.reset()
+        self.report_file = None
+        items = []
+        # set the voice for audio from form
+        self.voiceset = pick_voice(voice2)
+        # per-stage progress for the status line, the voice and package stages count their own
+        self.voicer = self.packager = None
+        self.pools = None
+        # documents whose reader process died even when read on their own
+        self.crashed = []
+        self.progress, self.progress_lock, self.progress_shown = {"read": 0, "summarized": 0, "total": 0}, threading.Lock(), 0.0
+
+        self.audio_archive = self.summary_archive = None
+
+        # the summaries and audio live in the output store, the manifest from the last run says what is finished
+        os.makedirs(self.work_folder, exist_ok=True)
+        self.store = OutputStore(os.path.join(self.work_folder, OUTPUT_STORE_NAME))
+        # the early returns below still close the store
+        try:
+            self.manifest = RunManifest(self.store, legacy_path=os.path.join(self.work_folder, 'staging', 'manifest.json'))
+
+            try:
+                # check the RIS file is there
+                if not ris_file2.startswith("http"):
+                    try:
+                        if not os.path.isfile(ris_file2):
+                            self.done("", "", f"Error: Local RIS file not found. Check path.")
+                            return
+                    except Exception as e: # Should catch if os.path.isfile fails for some reason
+                        print(f"Detailed local file access error: {e}")
+                        self.done("", "", f"Error accessing local RIS file. See console for details.")
+                        return
+
+                # stream the RIS file (or URL) into compact records in one pass
+                try:
+                    with run_metrics.span("ris_parse"):
+                        items = list(read_ris_records(ris_file2))
+                except requests.exceptions.RequestException as e:
+                    print(f"Detailed download error: {e}")
+                    self.done("", "", "Error downloading RIS file. See console for details.")
+                    return
+                if not items:
+                    self.done("", "", "Error: No items found in RIS file.")
+                    return
+                # end RIS file preprocessing
+
+                # make the file folder series, audio/ only holds files while they are voiced, before they go into the store
+                folders = ['media','audio','staging']
+                try:
+                    for folder in folders:
+                        os.makedirs(os.path.join(self.work_folder, folder), exist_ok=True)
+                except OSError as e:
+                    print(f"Detailed folder operation error: {e}")
+                    self.done("", "", f"Error with output folders. Check permissions or close files. See console.")
+                    return
+
+                # check they exist
+                for folder in folders:
+                    if not os.path.exists(os.path.join(self.work_folder, folder)):
+                        self.done("", "", f"Error: Failed to create folder '{folder}'. Check permissions.")
+                        return
+
+                # drop items that left the library since the last run
+                keys = ris_item_keys(items, doc_folder2)
+                self.manifest.prune(keys)
+
+                # finished files go into the zip files as soon as they are written
+                self.open_archives(out_folder2)
+
+                # Notify UI: Starting processing
+                self.progress["total"] = len(items)
+                self.done("", "", f"Starting processing for {len(items)} documents...")
+
+                # work out which items still need a summary (new, changed, or a different model)
+                self.duplicates = DuplicateFinder(os.path.join(self.work_folder, 'staging', 'signatures.json'))
+                prefetch_locs = []
+                for key, record in zip(keys, items):
+                    self.manifest.start_item(key, ris_item_fingerprint(record, doc_folder2), record.title, save=False)
+                    needed = record.files and not self.manifest.is_done(key, "summarized", model=model2)
+                    prefetch_locs.append(os.path.join(doc_folder2, record.files[0]) if needed else None)
+                    if DEDUPLICATE and not needed and self.manifest.canonical_of(key) is None and self.manifest.is_done(key, "summarized", model=model2):
+                        # summarized in an earlier run, new copies of it can reuse that summary
+                        self.duplicates.add_finished(key, record.doi)
+                self.manifest.save()
+
+                # the stages overlap: documents are read in worker processes (CPU bound) a few items ahead of the summaries,
+                # several documents are summarized at once, and each summary is voiced and packaged while later ones are
+                # still being written. The human-readable counter (y) is fixed up front so ordering holds
+                # the worker processes are set up before any stage thread starts (they start on first use)
+                self.pools = self.shared_pools or WorkerPools()
+                self.packager = PipelineStage("package", PACKAGE_WORKERS, self.package_audio, STAGE_QUEUE_SIZE)
+                self.voicer = PipelineStage("voice", TTS_WORKERS, self.voice_item, STAGE_QUEUE_SIZE)
+                try:
+                    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PAPERS) as executor:
+                        self.prefetch_locs, self.prefetched, self.extracting = prefetch_locs, 0, {}
+                        self.extract_lock = threading.RLock()
+                        self.prefetch(0)
+                        futures = [executor.submit(self.summarize_item, y, len(items), key, record, doc_folder2, model2, api_key2, chat_url2, structured2)
+                                   for y, (key, record) in enumerate(zip(keys, items), start=1)]
+                        for future in futures:
+                            try:
+                                future.result()
+                            except Exception as e:
+                                print(f"Detailed summary build error for one document: {e}")
+                    # end building the summaries loop
+                    self.duplicates.save(keys)
+                    print("Summaries Completed!")
+                finally:
+                    # let the audio and packaging of the last summaries finish
+                    self.voicer.close()
+                    self.packager.close()
+                    if self.pools is not self.shared_pools:
+                        self.pools.close()
+                    self.show_progress(force=True)
+
+            except Exception as e:
+                print(f"Detailed summary build section error: {e}")
+                self.done("", "", f"Unexpected error during summary processing. See console.")
+
+            try:
+                # Notify UI before zipping
+                self.status("Zipping output files...")
+                if self.audio_archive is None:
+                    self.open_archives(out_folder2)
+
+                # add what this run didn't write (finished in an earlier run) from the store, then close the zips
+                self.store.export(self.summary_archive, self.audio_archive)
+                output_zip1 = self.audio_archive.close()[0]
+                output_zip2 = self.summary_archive.close()[0]
+                self.manifest.mark_all("packaged", after="voiced")
+
+                print("The Program Successfully Completed. Close the GUI or hit CNTRL+C to stop the program.")
+
+                problems = []
+                if self.crashed:
+                    # reported on their own, these documents didn't fail to parse, they took their reader process down
+                    print(f"{len(self.crashed)} documents could not be read, their reader process died:")
+                    for loc in self.crashed:
+                        print(f"    {loc}")
+                    problems.append(f"{len(self.crashed)} documents crashed the reader")
+                if self.audio_failures():
+                    print(f"{self.audio_failures()} summaries have no audio, see the errors above.")
+                    problems.append(f"{self.audio_failures()} audio files failed")
+                if problems:
+                    self.done(output_zip1, output_zip2, f"Completed - {', '.join(problems)}, see console. You can Close the Program.")
+                else:
+                    self.done(output_zip1, output_zip2, "Completed - You can Close the Program.")
+            except Exception as e:
+                print(f"Detailed zipping error: {e}")
+                for archive in (self.audio_archive, self.summary_archive):
+                    if archive is not None:
+                        archive.discard()
+                self.done("", "", f"Error during file zipping. See console.")
+
+            # timings, tokens and cost for this run, and the merged duplicates, next to the zip files
+            try:
+                self.write_duplicates_report(out_folder2)
+                self.report_file = write_run_report(out_folder2, items=len(items), model=model2, structured=structured2,
+                                                    voice=self.voiceset, audio_format=self.audio_format,
+                                                    max_concurrent_requests=MAX_CONCURRENT_REQUESTS,
+                                                    max_concurrent_papers=MAX_CONCURRENT_PAPERS,
+                                                    extract_workers=EXTRACT_WORKERS, tts_workers=TTS_WORKERS,
+                                                    package_workers=PACKAGE_WORKERS, stage_queue_size=STAGE_QUEUE_SIZE,
+                                                    output_store=self.store.path, reader_crashes=self.crashed,
+                                                    audio_failures=self.audio_failures())
+                print(f"Run report written to {self.report_file}")
+            except Exception as e:
+                print(f"Detailed run report error: {e}")
+        finally:
+            self.store.close()
+
+    def count_progress(self, stage):
+        """Counts one item through the read or summarized stage and shows the progress."""
+        with self.progress_lock:
+            self.progress[stage] += 1
+        self.show_progress()
+
+    def show_progress(self, force=False):
+        """Sends every stage's progress to the status callback, at most every PROGRESS_INTERVAL seconds unless forced."""
+        now = time.monotonic()
+        with self.progress_lock:
+            if not force and now - self.progress_shown < PROGRESS_INTERVAL:
+                return
+            self.progress_shown = now
+            read, summarized, total = self.progress["read"], self.progress["summarized"], self.progress["total"]
+        stages = [f"Read {read}", f"Summarized {summarized}/{total}"]
+        stages += [stage.progress() for stage in (self.voicer, self.packager) if stage is not None]
+        self.status(" | ".join(stages))
+
+    def audio_failures(self)->int:
+        """The number of summaries the voice or package stage failed on this run."""
+        return sum(stage.failed for stage in (self.voicer, self.packager) if stage is not None)
+
+    def queue_voice(self, key, sumname):
+        """Hands a stored summary to the voice stage unless it is already voiced with this voice and format (waits while that stage is full)."""
+        if self.manifest.is_done(key, "voiced", voice=self.voiceset, audio_format=self.audio_format):
+            print(f"Already voiced, skipping: {sumname}")
+            return
+        self.voicer.put((sumname, key, audio_file_name(sumname, self.audio_format)))
+
+    def voice_item(self, j_file_name, key, filename):
+        """
+        Voice stage: makes the audio for one summary, in an audio worker process when TTS_WORKERS is more
+        than one (each voice stage thread waits on one process), then hands it to the package stage.
+        Args:
+            j_file_name: the summary file name
+            key: the manifest key of the item
+            filename: the audio file name
+        """
+        audio_path = os.path.join(self.work_folder, 'audio', filename)
+        job = (call_with_metrics, voice_stored_summary, self.store.path, key, self.voiceset, audio_path, self.audio_format)
+        if TTS_WORKERS <= 1:
+            # a single worker reuses the model already loaded in this process
+            error = voice_stored_summary(self.store.path, key, self.voiceset, audio_path, self.audio_format)
+        else:
+            pool = self.pools.tts_pool
+            try:
+                error, records = pool.submit(*job).result()
+            except BrokenProcessPool:
+                # a worker died, maybe voicing another summary: new workers for the rest, and this one on its own
+                # so that if it is the summary that kills its worker it can't take the others down with it
+                self.pools.restart_tts_pool(pool)
+                alone = self.pools.new_tts_pool(1)
+                try:
+                    error, records = alone.submit(*job).result()
+                except BrokenProcessPool:
+                    print(f"The audio worker process died voicing {j_file_name}")
+                    run_metrics.count("voice_crashes")
+                    error, records = "audio worker process died", {}
+                finally:
+                    alone.shutdown(wait=False)
+            run_metrics.merge(records)
+        if error:
+            raise RuntimeError(f"audio for {j_file_name}: {error}")
+        self.packager.put((j_file_name, key, filename))
+        self.show_progress()
+
+    def package_audio(self, j_file_name, key, filename):
+        """Package stage: moves one finished audio file into the store (and the zip) and records it in the manifest."""
+        audio_path = os.path.join(self.work_folder, 'audio', filename)
+        # read once, the same bytes go into the store and the zip
+        with open(audio_path, "rb") as f:
+            audio = f.read()
+        self.store.put_audio(key, audio, filename, self.audio_format, self.voiceset)
+        if self.audio_archive is not None:
+            self.audio_archive.add_data(filename, audio)
+        os.remove(audio_path)
+        self.manifest.mark(key, "voiced", voice=self.voiceset, audio_format=self.audio_format, audio_file=filename)
+        self.show_progress()
+
+    def open_archives(self, out_folder2):
+        """Starts the audio and summaries zip files in the output folder."""
+        # Ensure output directory exists
+        os.makedirs(out_folder2, exist_ok=True)
+        self.audio_archive = ArchiveWriter(os.path.join(out_folder2,'audio.zip'), ARCHIVE_VOLUME_BYTES)
+        self.summary_archive = ArchiveWriter(os.path.join(out_folder2, 'summaries.zip'), ARCHIVE_VOLUME_BYTES)
+
+    def prefetch(self, index):
+        """Starts reading the documents of the next EXTRACT_AHEAD items after index in the extraction processes."""
+        with self.extract_lock:
+            while self.prefetched < min(len(self.prefetch_locs), index + EXTRACT_AHEAD):
+                loc = self.prefetch_locs[self.prefetched]
+                self.prefetched += 1
+                if loc is not None and loc not in self.extracting:
+                    self.extracting[loc] = self.pools.submit_extract(loc)
+
+    def extract(self, loc):
+        """
+        Returns (text, error) for a document, from the prefetched read if there is one.
+        If its reader process died the readers are restarted and the document is read again in a process
+        of its own, so if it is the one that kills its reader it can't take the other documents down with it.
+        """
+        with self.extract_lock:
+            pool, future = self.extracting.pop(loc, None) or self.pools.submit_extract(loc)
+        # time spent waiting here is time the summaries were held up by the readers
+        with run_metrics.span("extract_wait"):
+            try:
+                result, records = future.result()
+            except BrokenProcessPool:
+                self.pools.restart_extractor(pool)
+                alone = self.pools.new_extractor(1)
+                try:
+                    result, records = alone.submit(call_with_metrics, extract_text_cached, loc).result()
+                except BrokenProcessPool:
+                    print(f"The document reader process died reading {loc} (too large, or out of memory?)")
+                    run_metrics.count("extract_crashes")
+                    self.crashed.append(loc)
+                    result, records = (None, "document reader process died"), {}
+                finally:
+                    alone.shutdown(wait=False)
+        run_metrics.merge(records)
+        self.count_progress("read")
+        return result
+
+    def summarize_item(self, y, total, key, record, doc_folder2, model2, api_key2, chat_url2, structured2=False):
+        """
+        Builds the summary file for one RIS item, runs on a worker thread from run
+        Items the manifest already has a summary for (same record, files and model) are skipped.
+        Args:
+            y: the human-readable counter used to order the output files
+            total: the number of items in the run (for progress messages)
+            key: the manifest key of the item
+            record: the RisRecord for the item
+            doc_folder2: the folder the L1/L2 paths are relative to
+            model2: the model to use
+            api_key2: the OpenRouter API key
+            chat_url2: the URL of the OpenRouter "OpenAI" style Chat Completions API
+            structured2: ask all the questions in a single request per paper
+        """
+        titleofpaper = record.title
+        locs = [os.path.join(doc_folder2, file) for file in record.files]
+
+        print(f"Processing doc {y}/{total}: {titleofpaper[:30]}...")
+
+        # work out the output name...
+        sumname = summary_file_name(y, record, total)
+
+        # keep the document readers busy a few items ahead of this one
+        self.prefetch(y)
+
+        # resume: the summary from an earlier run is still good, just make sure it carries this run's name
+        if self.manifest.is_done(key, "summarized", model=model2):
+            self.manifest.rename_outputs(key, sumname, y)
+            print(f"Already summarized, skipping: {titleofpaper}")
+            self.count_progress("summarized")
+        else:
+            try:
+                self.summarize_document(key, record, locs, sumname, y, model2, api_key2, chat_url2, structured2)
+            finally:
+                # items waiting to reuse this one's summary can go on
+                if DEDUPLICATE:
+                    self.duplicates.done(key, self.manifest.is_done(key, "summarized", model=model2))
+                self.count_progress("summarized")
+
+        # the summary goes straight on to the voice stage (duplicates have no audio of their own)
+        if self.manifest.is_done(key, "summarized", model=model2) and self.manifest.canonical_of(key) is None:
+            self.queue_voice(key, sumname)
+
+    def reuse_summary(self, key, y, record, match, model2)->bool:
+        """
+        Waits for the item this one duplicates and records that its summary is reused.
+        Args:
+            key: the manifest key of this item
+            y: this item's place in the library
+            record: this item's RisRecord
+            match: (key of the earlier item, reason, similarity) from the DuplicateFinder
+            model2: the model to use
+
+        Returns: True if the summary is reused, False if the earlier item ended without one (and gave up its DOI and text).
+        """
+        canonical, reason, similarity = match
+        if not self.duplicates.wait(canonical):
+            return False
+        print(f"Duplicate ({reason}), reusing the summary of an earlier item: {record.title}")
+        run_metrics.count("duplicates_merged")
+        self.manifest.mark(key, "summarized", model=model2, duplicate_of=canonical, duplicate_reason=reason, similarity=similarity)
+        # lookups of this item in the store return the earlier item's summary and audio
+        self.store.put_duplicate(key, y, record, canonical)
+        return True
+
+    def write_duplicates_report(self, out_folder2):
+        """Writes the list of items that reuse another item's summary next to the zip files."""
+        merged = self.manifest.duplicates()
+        path = os.path.join(out_folder2, DUPLICATES_REPORT_NAME)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"merged": merged}, f, indent=2)
+        os.replace(tmp_path, path)
+        if merged:
+            print(f"{len(merged)} duplicate items reuse another item's summary, see {path}")
+
+    def summarize_document(self, key, record, locs, sumname, y, model2, api_key2, chat_url2, structured2):
+        """Reads the first readable attached file of an item and writes its summary, or reuses a duplicate's."""
+        titleofpaper, authors = record.title, record.authors
+        summaries = []
+
+        # the same DOI as an item already seen is the same work, no need to even read it
+        if DEDUPLICATE:
+            match = self.duplicates.claim_doi(key, record.doi)
+            while match and not self.reuse_summary(key, y, record, match, model2):
+                # the owner ended without a summary and gave the DOI up, this item may take it over
+                match = self.duplicates.claim_doi(key, record.doi)
+            if match:
+                return
+
+        for loc in locs:
+            print(f"Attempting to process file for: {titleofpaper} at {loc}")
+            try:
+                text_content, error_msg = self.extract(loc)
+
+                if error_msg:
+                    print(f"Skipping item {titleofpaper} due to file error: {error_msg}")
+                    # Optionally, update GUI here or log to a file for user review
+                    # For now, just printing to console as per instructions
+                    continue
+
+                if text_content is None:
+                    print(f"Skipping item {titleofpaper} as no text content was extracted (file might be empty or unreadable).")
+                    continue
+                self.manifest.mark(key, "extracted")
+
+                if DEDUPLICATE:
+                    with run_metrics.span("dedup"):
+                        match = self.duplicates.claim_text(key, text_content)
+                    while match and not self.reuse_summary(key, y, record, match, model2):
+                        with run_metrics.span("dedup"):
+                            match = self.duplicates.claim_text(key, text_content)
+                    if match:
+                        return
+
+                print(f"Successfully read file for {titleofpaper}, generating summary...")
+                with run_metrics.span("summarize"):
+                    summary = make_summary_report(text = text_content,
+                                              model = model2,
+                                              api_key2 = api_key2,
+                                              url2 = chat_url2,
+                                              structured = structured2)
+                summaries.append(summary)
+                # only the first attached file ends up in the summary, don't pay for the others
+                break
+
+            except Exception as e:
+                print(f"Error during processing or summary generation for {titleofpaper}: {e}")
+                # Consider whether to inform the user via GUI here as well
+                continue
+
+        if len(summaries) > 0:
+            sumfin = titleofpaper + " Authors: " + " ".join(authors) + summaries[0]
+            self.store.put_summary(key, y, record, sumname, sumfin, model2)
+            self.summary_archive.add_data(sumname, sumfin.encode("utf-8"))
+            self.manifest.mark(key, "summarized", model=model2, summary_file=sumname)
+        else:
+            print(f"No summaries generated for Number {str(y)}")
+
 class DocumentProcessor:
     def __init__(self, root):
         self.root = root
@@ -242,21 +3175,45 @@ class DocumentProcessor:
         voice_option = tk.OptionMenu(root, self.voice_var,  "female","male")
         voice_option.grid(row=5, column=1, padx=5, pady=5)
 
+        # Summary Mode
+        mode_label = tk.Label(root, text="Summary Mode:")
+        mode_label.grid(row=6, column=0, padx=5, pady=5)
+        self.mode_var = tk.StringVar()
+        self.mode_var.set("per question")
+        mode_option = tk.OptionMenu(root, self.mode_var,  "per question", "single request")
+        mode_option.grid(row=6, column=1, padx=5, pady=5)
+
+        # Summary Cache
+        cache_label = tk.Label(root, text="Summary Cache:")
+        cache_label.grid(row=7, column=0, padx=5, pady=5)
+        self.cache_var = tk.StringVar()
+        self.cache_var.set("use cached")
+        cache_option = tk.OptionMenu(root, self.cache_var,  "use cached", "refresh")
+        cache_option.grid(row=7, column=1, padx=5, pady=5)
+
+        # Audio Format
+        format_label = tk.Label(root, text="Audio Format:")
+        format_label.grid(row=8, column=0, padx=5, pady=5)
+        self.format_var = tk.StringVar()
+        self.format_var.set("wav")
+        format_option = tk.OptionMenu(root, self.format_var,  *AUDIO_FORMATS)
+        format_option.grid(row=8, column=1, padx=5, pady=5)
+
         # Go Button
         go_button = tk.Button(root, text="Start Processing Files", command=self.start_process)
-        go_button.grid(row=6, column=1, padx=5, pady=5)
+        go_button.grid(row=9, column=1, padx=5, pady=5)
 
         # Output Zip Files
         output_zip_label = tk.Label(root, text="Output Zip Files:")
-        output_zip_label.grid(row=7, column=0, padx=5, pady=5)
+        output_zip_label.grid(row=10, column=0, padx=5, pady=5)
         self.output_zip1_label = tk.Label(root, text="")
-        self.output_zip1_label.grid(row=7, column=1, padx=5, pady=5)
+        self.output_zip1_label.grid(row=10, column=1, padx=5, pady=5)
         self.output_zip2_label = tk.Label(root, text="")
-        self.output_zip2_label.grid(row=8, column=1, padx=5, pady=5)
+        self.output_zip2_label.grid(row=11, column=1, padx=5, pady=5)
 
         # Working Label
         self.working_label = tk.Label(root, textvariable=self.working_label_text)
-        self.working_label.grid(row=9, column=1, padx=5, pady=5)
+        self.working_label.grid(row=12, column=1, padx=5, pady=5)
 
     def animate_working_label(self):
         if self.working:
@@ -281,280 +3238,19 @@ class DocumentProcessor:
 
     def process(self):
 
-        # get tk form variables
-        ris_file2 = self.ris_file_entry.get()
-        doc_folder2 = self.doc_folder_entry.get()
-        out_folder2 = self.out_folder_entry.get()
-        api_key2 = self.api_key_entry.get()
-        model2 = self.model_var.get()
-        voice2 = self.voice_var.get()
-
-        # Placeholder for your actual processing function
-        print("\n\n" + "-" * 50)
-        print("Starting process with:")
-        print(f"RIS File: {ris_file2}")
-        print(f"Document Folder: {doc_folder2}")
-        print(f"Output Folder: {out_folder2}")
-        print(f"API Key: {api_key2}")
-        print(f"Model: {model2}")
-        print(f"Voice: {voice2}")
-        print("-" * 50 + "\n" + "-" * 50)
-
-        # set Variables
-        chat_url2 = "https://openrouter.ai/api/v1/chat/completions"
-
-        try:
-            # open the RIS file
-            if ris_file2.startswith("http"):
-                try:
-                    fdown = wget.download(ris_file2, out=os.getcwd())
-                    if not os.path.isfile(fdown):
-                        self.root.after(0, self.update_ui, "", "", "Error: Failed to download RIS file. Check URL and network.")
-                        return
-                except Exception as e:
-                    print(f"Detailed download error: {e}")
-                    self.root.after(0, self.update_ui, "", "", "Error downloading RIS file. See console for details.")
-                    return
-                with (open(fdown,'r',encoding="utf-8")) as f:
-                    fileris = f.read()
-            else:
-                try:
-                    if not os.path.isfile(ris_file2):
-                        self.root.after(0, self.update_ui, "", "", f"Error: Local RIS file not found. Check path.")
-                        return
-                except Exception as e: # Should catch if os.path.isfile fails for some reason
-                    print(f"Detailed local file access error: {e}")
-                    self.root.after(0, self.update_ui, "", "", f"Error accessing local RIS file. See console for details.")
-                    return
-                with (open(ris_file2, "r",encoding="utf-8")) as f:
-                    fileris = f.read()
-
-            # # Process the RIS file text
-            # test for data
-            if not fileris: # Check if fileris is empty
-                self.root.after(0, self.update_ui, "", "", "Error: RIS file is empty.")
-                return
-
-            # split it into items - we ate the end tag so don't forget to put that back if re-uploading
-            items = fileris.split('\nER  - \n\n')
-            if not items or (len(items) == 1 and items[0].strip() == "ER  -"): # Check if items is empty or only contains the end tag
-                self.root.after(0, self.update_ui, "", "", "Error: No items found in RIS file.")
-                return
-
-            # split each line into a sub-item in those lists...
-            for i in range(len(items)):
-                items[i] = items[i].split('\n')
-
-            # check the last item, if blank, pop it
-            if items[-1] == ['']:
-                items.pop()
-
-            # proper next line pattern
-            pattern = r"[0-9A-Z]{2}\s\s-\s"
-            fixes = []
-
-            # test em and fix em
-            for i in range(len(items)):
-                holder = []
-                for j in range(len(items[i])):
-                    if re.search(pattern, items[i][j]):
-                        holder.append(items[i][j])
-                    else:
-                        cursor = len(holder) - 1
-                        fixes.append(1)
-                        holder[cursor] = str(holder[cursor]) + str(items[i][j])
-                items[i] = holder
-            print(f"Preprocessing Fixed  {len(fixes)} lines.")
-            # end RIS file preprocessing
-
-            # make a fresh file folder series
-            folders = ['media','summaries','audio','staging']
-            try:
-                for folder in folders:
-                    folder_path = os.path.join(os.getcwd(), folder)
-                    if os.path.exists(folder_path):
-                        shutil.rmtree(folder_path)
-                    os.mkdir(folder_path)
-            except OSError as e:
-                print(f"Detailed folder operation error: {e}")
-                self.root.after(0, self.update_ui, "", "", f"Error with output folders. Check permissions or close files. See console.")
-                return
-
-            # check they exist
-            for folder in folders:
-                if not os.path.exists(os.path.join(os.getcwd(), folder)):
-                    self.root.after(0, self.update_ui, "", "", f"Error: Failed to create folder '{folder}'. Check permissions.")
-                    return
-
-            # build human-readable counter
-            y = 1
-
-            # Notify UI: Starting processing
-            self.root.after(0, self.update_ui, "", "", f"Starting processing for {len(items)} documents...")
-
-            # iterate through the documents and build summaries
-            for i_loop_idx, item_content in enumerate(items): # Use enumerate for index and content
-                # set dummy vars
-                pub_year = 0000
-                titleofpaper = 'Unknown Title' # Default title
-                authors, summaries = [], []
-
-                # Attempt to find title early for UI update
-                for line in item_content:
-                    if line.startswith('TI  - '):
-                        titleofpaper = line[6:]
-                        break
-
-                # Update UI with current document
-                self.root.after(0, self.working_label_text.set, f"Processing doc {y}/{len(items)}: {titleofpaper[:30]}...")
-
-                # iterate through the document items
-                for j_loop_idx, line_content in enumerate(item_content): # Use enumerate for line content
-
-                    # find the title (already found for UI, but ensure it's set for logic)
-                    if line_content.startswith('TI  - '):
-                        titleofpaper = line_content[6:]
-
-                    # look for the authors and append them to the list
-                    if line_content.startswith('AU  - '):
-                        authors.append(line_content[6:])
-
-                    # look for the year and add to a variable
-                    if line_content.startswith('PY  - '):
-                        pub_year = line_content[6:]
-
-                    # look for L1 and L2 lines and process the files...
-                    if (line_content.startswith('L1  - ')) or (line_content.startswith('L2  - ')):
-                        loc = os.path.join(doc_folder2, line_content[6:])
-                        print(f"Attempting to process file for: {titleofpaper} at {loc}")
-                        try:
-                            text_content, error_msg = read_file_text(loc)
-
-                            if error_msg:
-                                print(f"Skipping item {titleofpaper} due to file error: {error_msg}")
-                                # Optionally, update GUI here or log to a file for user review
-                                # For now, just printing to console as per instructions
-                                continue
-
-                            if text_content is None:
-                                print(f"Skipping item {titleofpaper} as no text content was extracted (file might be empty or unreadable).")
-                                continue
-
-                            print(f"Successfully read file for {titleofpaper}, generating summary...")
-                            summary = make_summary_report(text = text_content,
-                                                      model = model2,
-                                                      api_key2 = api_key2,
-                                                      url2 = chat_url2)
-                            summaries.append(summary)
-
-                        except Exception as e:
-                            print(f"Error during processing or summary generation for {titleofpaper}: {e}")
-                            # Consider whether to inform the user via GUI here as well
-                            continue
-
-                # after going through all the items, collate and output the results...
-                etal = '' if len(authors) == 1 else ' et al'
-
-                # use counter to order file outputs
-                if y > 99:
-                    z = str(y)
-                elif (y > 9) and (y < 100):
-                    z = '0' + str(y)
-                else:  # y < 10
-                    z = '00' + str(y)
-
-                sumname = str(z) + str(authors[0]) + etal + "-" + pub_year + "-" + titleofpaper + ".txt"
-                if len(summaries) > 0:
-                    sumfin = titleofpaper + " Authors: " + " ".join(authors) + summaries[0]
-                    with open(os.path.join(str(os.getcwd()) , "summaries" , sumname), "w") as f:
-                        f.write(sumfin)
-                else:
-                    print(f"No summaries generated for Number {str(y)}")
-
-                # push the counter
-                y += 1
-                # end building the summaries loop
-
-        except Exception as e:
-            print(f"Detailed summary build section error: {e}")
-            self.root.after(0, self.update_ui, "", "", f"Unexpected error during summary processing. See console.")
-
-        # Notify UI before starting audio generation
-        self.root.after(0, self.working_label_text.set, "Generating audio files...")
-        print("Summaries Completed!\n\nGenerating Audio...")
-        # # build audio files
-
-        # set the voice for audio from form
-        if voice2 =="female":
-            voiceset = 'af_heart'
-
-        elif voice2 =="male":
-            voiceset = 'am_echo'
-
-        else:
-            voiceset = "af_bella"
-
-        # loop through summaries
-        try:
-            summary_files = [f for f in os.listdir(os.path.join(os.getcwd(),'summaries')) if not f.startswith('.')]
-            for idx, j_file_name in enumerate(summary_files): # Use enumerate for progress
-                self.root.after(0, self.working_label_text.set, f"Audio for {j_file_name[:30]}... ({idx+1}/{len(summary_files)})")
-                if not j_file_name.startswith('.'): # This check is redundant due to list comprehension above but kept for safety
-                    print(j_file_name)
-                    with open(os.path.join(os.getcwd(),'summaries',j_file_name), 'r', encoding='utf-8') as f:
-                        text = f.read()
-
-                    # clean the text a bit
-                    text = text.replace('\n', ' ')
-                    text = text.replace('\r', ' ')
-                    text = text.replace('**', ' ')
-                    text = text.replace('*', ' ')
-
-                    # define the generator
-                    generator = pipeline(text, voice=voiceset)
-
-                    # create a variable to populate pieces into
-                    fullaudio = []
-
-                    # create audio clips
-                    for i, (gs, ps, audio) in enumerate(generator):
-                        print(f"Working on Clip {i} ...")
-                        fullaudio.append(audio)
-
-                    # concatenate the clips and dump the tmp var to get memory
-                    audio2 = np.concatenate(fullaudio)
-                    del fullaudio
-
-                    # write the file
-                    filename = str(j_file_name)[:-4]
-                    filename = filename + ".wav"
-                    fileloc = os.path.join(os.getcwd(),"audio",filename)
-                    print(f"Writing {fileloc}")
-                    sf.write(fileloc, audio2,24000)
-
-        except Exception as e:
-            print(f"Detailed audio build error: {e}")
-            self.root.after(0, self.update_ui, "", "", f"Error during audio generation. See console.")
-
-        try:
-            # Notify UI before zipping
-            self.root.after(0, self.working_label_text.set, "Zipping output files...")
-            # # Pop zip locations
-            output_zip1 = os.path.join(out_folder2,'audio.zip')
-            output_zip2 = os.path.join(out_folder2, 'summaries.zip')
-
-            # Ensure output directory exists
-            os.makedirs(out_folder2, exist_ok=True)
-
-            zip_folder(os.path.join(os.getcwd(),'audio'), output_zip1)
-            zip_folder(os.path.join(os.getcwd(), 'summaries'), output_zip2)
-
-            print("The Program Successfully Completed. Close the GUI or hit CNTRL+C to stop the program.")
-
-            self.root.after(0, self.update_ui, output_zip1, output_zip2, "Completed - You can Close the Program.")
-        except Exception as e:
-            print(f"Detailed zipping error: {e}")
-            self.root.after(0, self.update_ui, "", "", f"Error during file zipping. See console.")
+        # get tk form variables, then hand the work to the headless processor
+        runner = LibraryProcessor(ris_file = self.ris_file_entry.get(),
+                                  doc_folder = self.doc_folder_entry.get(),
+                                  out_folder = self.out_folder_entry.get(),
+                                  api_key = self.api_key_entry.get(),
+                                  model = self.model_var.get(),
+                                  voice = self.voice_var.get(),
+                                  structured = self.mode_var.get() == "single request",
+                                  refresh_cache = self.cache_var.get() == "refresh",
+                                  audio_format = self.format_var.get(),
+                                  status = lambda text: self.root.after(0, self.working_label_text.set, text),
+                                  done = lambda zip1, zip2, status: self.root.after(0, self.update_ui, zip1, zip2, status))
+        runner.run()
 
     def update_ui(self, output_zip1, output_zip2, status):
         self.working = False
@@ -570,4 +3266,8 @@ class DocumentProcessor:
 if __name__ == "__main__":
     root = tk.Tk()
     app = DocumentProcessor(root)
+    # report how long it took for the window to be ready, to catch slow imports creeping back in
+    root.after_idle(lambda: print(f"Startup time: GUI ready in {time.perf_counter() - STARTUP_T0:.2f}s"))
+    if WARM_TTS_ON_STARTUP:
+        warm_pipeline_in_background()
     root.mainloop()
@@ -0,0 +1,241 @@
+"""
+PAZSAGE worker service - keeps one Kokoro model and one OpenRouter session warm and takes jobs over local HTTP.
+
+Start it with:   python pazserver.py --port 8765
+The API key is read from the OPENROUTER_API_KEY environment variable (or an "api_key" field on the job).
+
+Jobs are JSON posted to /jobs, one of:
+    {"type": "ris", "ris_file": "...", "doc_folder": "...", "out_folder": "..."}
+    {"type": "document", "path": "paper.pdf", "out_folder": "..."}
+    {"type": "text", "text": "words to voice", "out_folder": "...", "name": "clip"}
+Optional fields: "model", "voice", "audio_format", "structured", "refresh_cache", "api_key".
+
+GET /jobs lists every job, GET /jobs/<id> returns one job's status and results.
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pazsage
+
+DEFAULT_MODEL = "meta-llama/llama-4-maverick"
+JOB_TYPES = ("ris", "document", "text")
+
+# the document reader and audio worker processes, kept open for every library job (set up in main)
+worker_pools = None
+
+
+class JobQueue:
+    """
+    Runs jobs one at a time on a single worker thread, so the one Kokoro pipeline is never shared.
+    Job status is kept in memory for polling.
+    """
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.ids = itertools.count(1)
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def submit(self, job:dict)->dict:
+        """Queues a job and returns its status record."""
+        with self.lock:
+            job_id = str(next(self.ids))
+            record = {"id": job_id, "type": job["type"], "status": "queued", "progress": "",
+                      "result": None, "error": None, "submitted": time.time(), "started": None, "finished": None}
+            self.jobs[job_id] = record
+        self.pending.put((job_id, job))
+        return dict(record)
+
+    def get(self, job_id:str)->dict | None:
+        with self.lock:
+            record = self.jobs.get(job_id)
+            return dict(record) if record else None
+
+    def list(self)->list:
+        with self.lock:
+            return [dict(record) for record in self.jobs.values()]
+
+    def update(self, job_id:str, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def work(self):
+        """Worker loop, takes the next job off the queue and runs it."""
+        while True:
+            job_id, job = self.pending.get()
+            self.update(job_id, status="running", started=time.time())
+            try:
+                result = run_job(job, progress=lambda text: self.update(job_id, progress=text))
+                self.update(job_id, status="done", result=result, finished=time.time())
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                self.update(job_id, status="failed", error=str(e), finished=time.time())
+
+
+def run_job(job:dict, progress)->dict:
+    """
+    Does the work for one job with the warm pipeline and session.
+    Args:
+        job: the job fields posted to /jobs
+        progress: called with a progress message
+
+    Returns: dictionary of output file locations.
+    """
+    # the summary cache's refresh flag is shared by the whole process, it only holds for this job
+    refresh = pazsage.summary_cache.refresh
+    pazsage.summary_cache.refresh = bool(job.get("refresh_cache", False))
+    try:
+        return do_job(job, progress)
+    finally:
+        pazsage.summary_cache.refresh = refresh
+
+
+def do_job(job:dict, progress)->dict:
+    """Runs one job of any type, see run_job."""
+    api_key = job.get("api_key") or os.environ.get("OPENROUTER_API_KEY", "")
+    model = job.get("model", DEFAULT_MODEL)
+    voiceset = pazsage.pick_voice(job.get("voice", "female"))
+    audio_format = job.get("audio_format", "wav")
+    out_folder = job.get("out_folder") or os.path.join(os.getcwd(), "output")
+    os.makedirs(out_folder, exist_ok=True)
+
+    if job["type"] == "ris":
+        outcome = {}
+        def done(output_zip1, output_zip2, status):
+            outcome.update(audio_zip=output_zip1, summaries_zip=output_zip2, message=status)
+            progress(status)
+        runner = pazsage.LibraryProcessor(ris_file = job["ris_file"],
+                                          doc_folder = job.get("doc_folder", os.getcwd()),
+                                          out_folder = out_folder,
+                                          api_key = api_key,
+                                          model = model,
+                                          voice = job.get("voice", "female"),
+                                          structured = bool(job.get("structured", False)),
+                                          refresh_cache = bool(job.get("refresh_cache", False)),
+                                          audio_format = audio_format,
+                                          work_folder = job.get("work_folder"),
+                                          status = progress,
+                                          done = done,
+                                          pools = worker_pools)
+        runner.run()
+        if not outcome.get("summaries_zip"):
+            raise RuntimeError(outcome.get("message", "Run stopped without output"))
+        outcome["report"] = runner.report_file
+        return outcome
+
+    if job["type"] == "document":
+        path = job["path"]
+        progress(f"Reading {path}")
+        # through the text cache, so a document sent again isn't parsed again
+        text, error_msg = pazsage.extract_text_cached(path)
+        if error_msg:
+            raise RuntimeError(error_msg)
+        name = job.get("name") or os.path.splitext(os.path.basename(path))[0]
+        audio_file = os.path.join(out_folder, pazsage.audio_file_name(name + ".txt", audio_format))
+        # the answers are streamed and voiced sentence by sentence as they arrive
+        progress("Generating summary and audio")
+        summary = pazsage.summarize_and_voice(text=text, header=name, model=model, api_key2=api_key,
+                                              url2=pazsage.OPENROUTER_CHAT_URL, voiceset=voiceset,
+                                              fileloc=audio_file, audio_format=audio_format,
+                                              structured=bool(job.get("structured", False)))
+        summary_file = os.path.join(out_folder, name + ".txt")
+        with open(summary_file, "w", encoding="utf-8") as f:
+            f.write(name + summary)
+        return {"summary_file": summary_file, "audio_file": audio_file}
+
+    # plain text to voice
+    progress("Generating audio")
+    audio_file = os.path.join(out_folder, pazsage.audio_file_name(job.get("name", "audio") + ".txt", audio_format))
+    pazsage.synthesize_audio(job["text"], voiceset, audio_file, audio_format)
+    return {"audio_file": audio_file}
+
+
+def check_job(job)->str | None:
+    """Returns a problem with a posted job, or None if it can be queued."""
+    if not isinstance(job, dict):
+        return "Job must be a JSON object."
+    if job.get("type") not in JOB_TYPES:
+        return f"Job type must be one of {', '.join(JOB_TYPES)}."
+    if job.get("audio_format", "wav") not in pazsage.AUDIO_FORMATS:
+        return f"audio_format must be one of {', '.join(pazsage.AUDIO_FORMATS)}."
+    required = {"ris": "ris_file", "document": "path", "text": "text"}[job["type"]]
+    if not job.get(required):
+        return f"A {job['type']} job needs a '{required}' field."
+    return None
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    """Local HTTP endpoint: POST /jobs to queue, GET /jobs or /jobs/<id> to poll."""
+    jobs = None
+
+    def send_json(self, code:int, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            self.send_json(200, self.jobs.list())
+        elif len(parts) == 2 and parts[0] == "jobs":
+            record = self.jobs.get(parts[1])
+            self.send_json(200, record) if record else self.send_json(404, {"error": "No such job."})
+        else:
+            self.send_json(404, {"error": "Not found."})
+
+    def do_POST(self):
+        if self.path.strip("/") != "jobs":
+            self.send_json(404, {"error": "Not found."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "Body must be JSON."})
+            return
+        problem = check_job(job)
+        if problem:
+            self.send_json(400, {"error": problem})
+            return
+        self.send_json(202, self.jobs.submit(job))
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless PAZSAGE worker service.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: local only)")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    # load the model and open the session before the first job arrives
+    global worker_pools
+    pazsage.get_pipeline()
+    pazsage.get_session()
+    # library jobs share one set of worker processes, so with several audio workers their models stay loaded too
+    worker_pools = pazsage.WorkerPools()
+
+    JobHandler.jobs = JobQueue()
+    server = ThreadingHTTPServer((args.host, args.port), JobHandler)
+    print(f"PAZSAGE worker listening on http://{args.host}:{args.port}/jobs")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping.")
+        server.server_close()
+        worker_pools.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+PAZSAGE output store tool - looks up papers in, and exports zip files from, the output store a run leaves
+in its work folder (pazsage_outputs.sqlite, see OUTPUT_STORE_NAME in pazsage.py).
+
+    python pazstore.py list --store pazsage_outputs.sqlite --year 2020
+    python pazstore.py show --store pazsage_outputs.sqlite --key "DO:10.1016/j.apenergy.2020.115853"
+    python pazstore.py audio --store pazsage_outputs.sqlite --key "DO:10.1016/j.apenergy.2020.115853" --out-folder clips
+    python pazstore.py export --store pazsage_outputs.sqlite --out-folder output --author Smith
+
+list, show and export take the keys the run used (the RIS ID tag, else the DOI, else the attached files).
+"""
+import argparse
+import json
+import os
+
+import pazsage
+
+
+def add_filters(command):
+    command.add_argument("--year", help="only items from this year")
+    command.add_argument("--author", help="only items with an author whose name contains this")
+    command.add_argument("--tag", help="only items with this RIS keyword")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up and export PAZSAGE summaries and audio.")
+    parser.add_argument("--store", default=pazsage.OUTPUT_STORE_NAME, help="the output store (default: in this folder)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_cmd = commands.add_parser("list", help="list the stored items in library order")
+    add_filters(list_cmd)
+    show_cmd = commands.add_parser("show", help="print one item's metadata and summary as JSON")
+    show_cmd.add_argument("--key", required=True)
+    audio_cmd = commands.add_parser("audio", help="write one item's audio file")
+    audio_cmd.add_argument("--key", required=True)
+    audio_cmd.add_argument("--out-folder", default=os.getcwd())
+    export_cmd = commands.add_parser("export", help="write summaries.zip and audio.zip")
+    export_cmd.add_argument("--out-folder", required=True)
+    add_filters(export_cmd)
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.store):
+        raise SystemExit(f"No output store at {args.store}")
+    if args.command == "export":
+        audio_zips, summary_zips, count = pazsage.export_output_store(args.store, args.out_folder, args.year, args.author, args.tag)
+        print(f"Exported {count} items to {', '.join(summary_zips + audio_zips)}")
+        return
+
+    store = pazsage.OutputStore(args.store)
+    try:
+        if args.command == "list":
+            for item in store.select(args.year, args.author, args.tag):
+                print(f"{item['key']}\t{item['name']}")
+        elif args.command == "show":
+            item = store.get(args.key)
+            if item is None:
+                raise SystemExit(f"No item with key {args.key}")
+            print(json.dumps(item, indent=2))
+        else:
+            audio = store.get_audio(args.key)
+            if audio is None:
+                raise SystemExit(f"No audio for key {args.key}")
+            os.makedirs(args.out_folder, exist_ok=True)
+            path = os.path.join(args.out_folder, audio[0])
+            with open(path, "wb") as f:
+                f.write(audio[1])
+            print(f"Wrote {path}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+PAZSAGE sharded workers - spreads one library over any number of worker processes (on one or many machines)
+through a job store, a SQLite file on storage every worker can reach.
+
+1. Queue the library once:
+       python pazworker.py enqueue --store /shared/jobs.sqlite --ris /shared/library.ris \
+           --doc-folder /shared/papers --work-folder /shared/run
+2. Start as many workers as you like, on any machine that sees /shared:
+       OPENROUTER_API_KEY=your_key python pazworker.py work --store /shared/jobs.sqlite
+3. Check on them:
+       python pazworker.py status --store /shared/jobs.sqlite
+4. Once every item is done, zip the results:
+       python pazworker.py package --store /shared/jobs.sqlite --out-folder /shared/output
+
+Each worker claims a few items at a time with a lease of LEASE_SECONDS and renews it while it works
+(a heartbeat every HEARTBEAT_SECONDS). If a worker dies, its lease runs out and another worker picks the
+item up again, up to MAX_ATTEMPTS tries. Summaries and audio go into the output store in the work folder
+(pazsage.OUTPUT_STORE_NAME), named as a normal run names them, and package exports them as zip files.
+Running enqueue again with an updated library adds new items, redoes changed ones and drops removed ones
+(items that only moved keep their results).
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pazsage
+
+# a claimed item goes back to the queue if its worker stops renewing the lease for this long
+LEASE_SECONDS = 600
+HEARTBEAT_SECONDS = 60
+# tries per item before it is marked failed
+MAX_ATTEMPTS = 3
+# seconds an idle worker waits before looking for work again
+IDLE_POLL_SECONDS = 15
+DEFAULT_MODEL = "meta-llama/llama-4-maverick"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    key TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    summary_file TEXT,
+    audio_file TEXT,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (status, position);
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+class JobStore:
+    """
+    The shared queue of library items. Every change runs in its own transaction, and claims take the
+    write lock up front (BEGIN IMMEDIATE) so two workers never lease the same item.
+    Each thread should use its own JobStore, sqlite connections are not shared between threads.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=120, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def transaction(self):
+        return _Transaction(self.db)
+
+    def settings(self)->dict:
+        return {row["name"]: json.loads(row["value"]) for row in self.db.execute("SELECT name, value FROM settings")}
+
+    def enqueue(self, items:list, settings:dict)->dict:
+        """
+        Loads a library into the store.
+        Args:
+            items: (key, position, RisRecord, fingerprint) for every item
+            settings: the run settings every worker uses (folders, model, voice, ...)
+
+        Returns: counts of added, changed, moved, unchanged and removed items.
+        """
+        counts = {"added": 0, "changed": 0, "moved": 0, "unchanged": 0, "removed": 0}
+        now = time.time()
+        with self.transaction():
+            for name, value in settings.items():
+                self.db.execute("INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)", (name, json.dumps(value)))
+            existing = {row["key"]: row for row in self.db.execute("SELECT key, position, fingerprint FROM tasks")}
+            for key, position, record, fingerprint in items:
+                old = existing.pop(key, None)
+                if old is None:
+                    self.db.execute("INSERT INTO tasks (key, position, record, fingerprint, updated) VALUES (?, ?, ?, ?, ?)",
+                                    (key, position, json.dumps(record.lines), fingerprint, now))
+                    counts["added"] += 1
+                elif old["fingerprint"] != fingerprint:
+                    # changed, do it again
+                    self.db.execute("UPDATE tasks SET position = ?, record = ?, fingerprint = ?, status = 'pending', worker = NULL, "
+                                    "lease_until = NULL, attempts = 0, error = NULL, updated = ? WHERE key = ?",
+                                    (position, json.dumps(record.lines), fingerprint, now, key))
+                    counts["changed"] += 1
+                elif old["position"] != position:
+                    # only moved to a new place: its outputs are renamed in the output store (see main), no need to redo it
+                    self.db.execute("UPDATE tasks SET position = ?, updated = ? WHERE key = ?", (position, now, key))
+                    counts["moved"] += 1
+                else:
+                    counts["unchanged"] += 1
+            for key in existing:
+                self.db.execute("DELETE FROM tasks WHERE key = ?", (key,))
+                counts["removed"] += 1
+        return counts
+
+    def reset_all(self):
+        """Queues every item again (for a new model or voice)."""
+        with self.transaction():
+            self.db.execute("UPDATE tasks SET status = 'pending', worker = NULL, lease_until = NULL, attempts = 0, error = NULL")
+
+    def claim(self, worker:str, count:int)->list:
+        """
+        Leases up to count items to a worker: pending items first, then items whose lease ran out.
+        Returns: the claimed rows.
+        """
+        now = time.time()
+        with self.transaction():
+            rows = self.db.execute("SELECT key, position, record, status FROM tasks "
+                                   "WHERE (status = 'pending' OR (status = 'leased' AND lease_until < ?)) AND attempts < ? "
+                                   "ORDER BY position LIMIT ?", (now, MAX_ATTEMPTS, count)).fetchall()
+            for row in rows:
+                if row["status"] == "leased":
+                    print(f"Reclaiming an expired lease: {row['key']}")
+                self.db.execute("UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? "
+                                "WHERE key = ?", (worker, now + LEASE_SECONDS, now, row["key"]))
+            # items whose last try ran out of lease are failed rather than retried forever
+            self.db.execute("UPDATE tasks SET status = 'failed', error = 'lease expired on the last attempt', updated = ? "
+                            "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?", (now, now, MAX_ATTEMPTS))
+        return rows
+
+    def heartbeat(self, worker:str, keys:list)->int:
+        """Renews a worker's leases, returns how many it still holds."""
+        if not keys:
+            return 0
+        now = time.time()
+        with self.transaction():
+            marks = ",".join("?" * len(keys))
+            cursor = self.db.execute(f"UPDATE tasks SET lease_until = ?, updated = ? WHERE worker = ? AND status = 'leased' AND key IN ({marks})",
+                                     (now + LEASE_SECONDS, now, worker, *keys))
+        return cursor.rowcount
+
+    def complete(self, key:str, worker:str, summary_file:str | None, audio_file:str | None):
+        """Records a finished item (even if its lease was lost meanwhile, the files are the same either way)."""
+        with self.transaction():
+            self.db.execute("UPDATE tasks SET status = 'done', worker = ?, lease_until = NULL, summary_file = ?, audio_file = ?, "
+                            "error = NULL, updated = ? WHERE key = ?", (worker, summary_file, audio_file, time.time(), key))
+
+    def fail(self, key:str, worker:str, error:str):
+        """Gives an item back to the queue, or marks it failed once it has used up MAX_ATTEMPTS."""
+        with self.transaction():
+            self.db.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                            "worker = NULL, lease_until = NULL, error = ?, updated = ? WHERE key = ? AND worker = ?",
+                            (MAX_ATTEMPTS, error, time.time(), key, worker))
+
+    def counts(self)->dict:
+        return {row["status"]: row["n"] for row in self.db.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status")}
+
+    def rows(self, status:str = None)->list:
+        if status:
+            return self.db.execute("SELECT * FROM tasks WHERE status = ? ORDER BY position", (status,)).fetchall()
+        return self.db.execute("SELECT * FROM tasks ORDER BY position").fetchall()
+
+
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+# ---------------------------------------------------------------
+
+def process_item(row, settings:dict, api_key:str, outputs)->str | None:
+    """
+    Summarizes one claimed item into the output store.
+    Returns: the summary file name, None if no attached file could be read.
+    """
+    record = pazsage.RisRecord(json.loads(row["record"]))
+    sumname = pazsage.summary_file_name(row["position"], record, settings.get("items", 0))
+    text = None
+    for file in record.files:
+        text, error_msg = pazsage.extract_text_cached(os.path.join(settings["doc_folder"], file))
+        if text is not None and not error_msg:
+            break
+        print(f"Skipping file for {record.title}: {error_msg}")
+        text = None
+    if text is None:
+        return None
+
+    with pazsage.run_metrics.span("summarize"):
+        summary = pazsage.make_summary_report(text=text, model=settings["model"], api_key2=api_key,
+                                              url2=pazsage.OPENROUTER_CHAT_URL, structured=settings["structured"])
+    sumfin = record.title + " Authors: " + " ".join(record.authors) + summary
+    outputs.put_summary(row["key"], row["position"], record, sumname, sumfin, settings["model"])
+    return sumname
+
+def voice_item(key:str, sumname:str, settings:dict, outputs)->tuple[str | None, str | None]:
+    """
+    Voices a summary stored by process_item and moves the audio into the output store.
+    Returns: (audio file name, None) on success, (None, error message) otherwise.
+    """
+    audio_name = pazsage.audio_file_name(sumname, settings["audio_format"])
+    voiceset = pazsage.pick_voice(settings["voice"])
+    # named per process, two workers never write the same file
+    audio_path = os.path.join(settings["work_folder"], "audio", f"{os.getpid()}-{audio_name}")
+    with pazsage.run_metrics.span("voice"):
+        error_msg = pazsage.voice_stored_summary(outputs.path, key, voiceset, audio_path, settings["audio_format"])
+    if error_msg:
+        return None, error_msg
+    with open(audio_path, "rb") as f:
+        outputs.put_audio(key, f.read(), audio_name, settings["audio_format"], voiceset)
+    os.remove(audio_path)
+    return audio_name, None
+
+
+class Heartbeat:
+    """Renews the leases of the items a worker holds on a background thread, with its own connection."""
+    def __init__(self, store_path:str, worker:str):
+        self.store_path = store_path
+        self.worker = worker
+        self.keys = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+        self.thread.start()
+
+    def hold(self, keys):
+        with self.lock:
+            self.keys.update(keys)
+
+    def release(self, key:str):
+        with self.lock:
+            self.keys.discard(key)
+
+    def beat(self):
+        store = JobStore(self.store_path)
+        try:
+            while not self.stopped.wait(HEARTBEAT_SECONDS):
+                with self.lock:
+                    keys = list(self.keys)
+                try:
+                    held = store.heartbeat(self.worker, keys)
+                    if held < len(keys):
+                        print(f"{len(keys) - held} leases were lost (taken over by another worker).")
+                except sqlite3.Error as e:
+                    print(f"Heartbeat failed, will retry: {e}")
+        finally:
+            store.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def work(store_path:str, worker:str, batch:int, api_key:str, exit_when_idle:bool):
+    """
+    Worker loop: claims batch items at a time, summarizes them concurrently and voices each as its summary
+    is ready, until the queue is empty (and every other worker's items are finished, if exit_when_idle).
+    """
+    store = JobStore(store_path)
+    settings = store.settings()
+    if not settings:
+        raise SystemExit("The store has no library, run 'enqueue' first.")
+    os.makedirs(os.path.join(settings["work_folder"], "audio"), exist_ok=True)
+    outputs = pazsage.OutputStore(os.path.join(settings["work_folder"], pazsage.OUTPUT_STORE_NAME))
+    # each worker writes its own run report, in reports/<worker id>/
+    report_folder = os.path.join(settings["work_folder"], "reports", worker)
+    os.makedirs(report_folder, exist_ok=True)
+    pazsage.run_metrics.reset()
+    heartbeat = Heartbeat(store_path, worker)
+    print(f"Worker {worker} started on {store_path}")
+    try:
+        with ThreadPoolExecutor(max_workers=batch) as executor:
+            while True:
+                rows = store.claim(worker, batch)
+                if not rows:
+                    counts = store.counts()
+                    if not counts.get("leased") or exit_when_idle:
+                        print(f"Nothing left to claim: {counts}")
+                        break
+                    # other workers still hold items, one may die and its items come back
+                    time.sleep(IDLE_POLL_SECONDS)
+                    continue
+                heartbeat.hold(row["key"] for row in rows)
+                futures = {executor.submit(process_item, row, settings, api_key, outputs): row for row in rows}
+                for future in as_completed(futures):
+                    row = futures[future]
+                    try:
+                        sumname = future.result()
+                        if sumname is None:
+                            store.fail(row["key"], worker, "no attached file could be read")
+                        else:
+                            audio_name, error_msg = voice_item(row["key"], sumname, settings, outputs)
+                            if error_msg:
+                                store.fail(row["key"], worker, f"audio: {error_msg}")
+                            else:
+                                store.complete(row["key"], worker, sumname, audio_name)
+                                print(f"Done: {row['key']}")
+                    except Exception as e:
+                        print(f"Item {row['key']} failed: {e}")
+                        store.fail(row["key"], worker, f"{type(e).__name__}: {e}")
+                    heartbeat.release(row["key"])
+    finally:
+        heartbeat.stop()
+        store.close()
+        outputs.close()
+        pazsage.write_run_report(report_folder, worker=worker, model=settings["model"], structured=settings["structured"],
+                                 voice=settings["voice"], audio_format=settings["audio_format"], batch=batch)
+
+
+def package(store_path:str, out_folder:str, year:str = None, author:str = None, tag:str = None):
+    """Zips the summaries and audio in the output store (optionally one year, author or tag) into out_folder."""
+    store = JobStore(store_path)
+    settings = store.settings()
+    counts = store.counts()
+    if counts.get("pending") or counts.get("leased"):
+        print(f"Warning: not every item is finished yet: {counts}")
+    for row in store.rows("failed"):
+        print(f"Failed: {row['key']} - {row['error']}")
+    store.close()
+    _, _, exported = pazsage.export_output_store(os.path.join(settings["work_folder"], pazsage.OUTPUT_STORE_NAME),
+                                                 out_folder, year, author, tag)
+    print(f"Zip files with {exported} items written to {out_folder}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spread a PAZSAGE library over several worker processes through a shared job store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_cmd = commands.add_parser("enqueue", help="load (or update) a library into the store")
+    enqueue_cmd.add_argument("--store", required=True, help="the SQLite job store, on storage every worker can reach")
+    enqueue_cmd.add_argument("--ris", required=True, help="the RIS file (path or URL)")
+    enqueue_cmd.add_argument("--doc-folder", required=True, help="the folder the L1/L2 paths are relative to")
+    enqueue_cmd.add_argument("--work-folder", required=True, help="shared folder for the output store")
+    enqueue_cmd.add_argument("--model", default=DEFAULT_MODEL)
+    enqueue_cmd.add_argument("--voice", default="female")
+    enqueue_cmd.add_argument("--audio-format", choices=list(pazsage.AUDIO_FORMATS), default="wav")
+    enqueue_cmd.add_argument("--structured", action="store_true", help="single request summary mode")
+
+    work_cmd = commands.add_parser("work", help="claim and process items until the queue is empty")
+    work_cmd.add_argument("--store", required=True)
+    work_cmd.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}")
+    work_cmd.add_argument("--batch", type=int, default=pazsage.MAX_CONCURRENT_PAPERS, help="items claimed and summarized at once")
+    work_cmd.add_argument("--exit-when-idle", action="store_true", help="stop as soon as nothing is claimable, even if other workers are busy")
+
+    status_cmd = commands.add_parser("status", help="show how many items are pending, leased, done and failed")
+    status_cmd.add_argument("--store", required=True)
+
+    package_cmd = commands.add_parser("package", help="zip the finished summaries and audio")
+    package_cmd.add_argument("--store", required=True)
+    package_cmd.add_argument("--out-folder", required=True)
+    package_cmd.add_argument("--year", help="only items from this year")
+    package_cmd.add_argument("--author", help="only items with an author whose name contains this")
+    package_cmd.add_argument("--tag", help="only items with this RIS keyword")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        items = list(pazsage.read_ris_records(args.ris))
+        if not items:
+            raise SystemExit("No items found in RIS file.")
+        doc_folder = os.path.abspath(args.doc_folder)
+        keys = pazsage.ris_item_keys(items, doc_folder)
+        settings = {"doc_folder": doc_folder, "work_folder": os.path.abspath(args.work_folder), "model": args.model,
+                    "voice": args.voice, "audio_format": args.audio_format, "structured": args.structured, "items": len(items)}
+        store = JobStore(args.store)
+        old = store.settings()
+        counts = store.enqueue([(key, y, record, pazsage.ris_item_fingerprint(record, doc_folder))
+                                for y, (key, record) in enumerate(zip(keys, items), start=1)], settings)
+        if old and any(old.get(name) != settings[name] for name in ("model", "voice", "audio_format", "structured")):
+            print("Model, voice or format changed, every item will be done again.")
+            store.reset_all()
+        print(f"Queued {len(items)} items: {counts}")
+        store.close()
+        # outputs of items that left the library go too, the rest are renamed if the counter got wider
+        os.makedirs(settings["work_folder"], exist_ok=True)
+        outputs = pazsage.OutputStore(os.path.join(settings["work_folder"], pazsage.OUTPUT_STORE_NAME))
+        outputs.prune(set(keys))
+        for y, (key, record) in enumerate(zip(keys, items), start=1):
+            outputs.rename(key, pazsage.summary_file_name(y, record, len(items)), y)
+        outputs.close()
+    elif args.command == "work":
+        work(args.store, args.worker_id, max(1, args.batch), os.environ.get("OPENROUTER_API_KEY", ""), args.exit_when_idle)
+    elif args.command == "status":
+        store = JobStore(args.store)
+        print(json.dumps(store.counts()))
+        for row in store.rows("leased"):
+            print(f"  {row['key']} held by {row['worker']}, lease ends in {row['lease_until'] - time.time():.0f}s (try {row['attempts']})")
+        store.close()
+    else:
+        package(args.store, args.out_folder, args.year, args.author, args.tag)
+
+
+if __name__ == "__main__":
+    main()
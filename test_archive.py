@@ -0,0 +1,60 @@
+"""
+Checks for the zip files: what is stored and what is deflated, volumes, and that an archive cut short
+by an error never replaces the previous one.
+
+Run with:   python -m pytest -q
+"""
+import os
+import zipfile
+
+import pytest
+
+import pazsage
+
+
+def test_entries_are_added_once_and_compressed_by_type(tmp_path):
+    path = str(tmp_path / "audio.zip")
+    with pazsage.ArchiveWriter(path) as archive:
+        archive.add_data("a.txt", b"summary " * 100)
+        archive.add_data("a.txt", b"a second copy is ignored")
+        archive.add_data("a.flac", b"\x00" * 1000)
+        archive.add_data("a.wav", b"\x00" * 1000)
+    assert not os.path.exists(path + ".partial")
+    with zipfile.ZipFile(path) as zipf:
+        infos = {info.filename: info for info in zipf.infolist()}
+        assert zipf.read("a.txt") == b"summary " * 100
+    assert sorted(infos) == ["a.flac", "a.txt", "a.wav"]
+    assert infos["a.flac"].compress_type == zipfile.ZIP_STORED
+    assert infos["a.wav"].compress_type == zipfile.ZIP_DEFLATED
+    assert infos["a.txt"].compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_volumes_and_leftover_volumes(tmp_path):
+    path = str(tmp_path / "audio.zip")
+    # a bigger earlier run left four volumes
+    for number in range(2, 5):
+        open(str(tmp_path / f"audio-{number}.zip"), "wb").close()
+    with pazsage.ArchiveWriter(path, volume_bytes=1000) as archive:
+        for n in range(3):
+            archive.add_data(f"{n}.opus", os.urandom(1500))
+    assert archive.volumes == [path, str(tmp_path / "audio-2.zip"), str(tmp_path / "audio-3.zip")]
+    assert not os.path.exists(str(tmp_path / "audio-4.zip"))
+    names = []
+    for volume in archive.volumes:
+        with zipfile.ZipFile(volume) as zipf:
+            names += zipf.namelist()
+    assert names == ["0.opus", "1.opus", "2.opus"]
+
+
+def test_an_error_keeps_the_previous_archive(tmp_path):
+    path = str(tmp_path / "summaries.zip")
+    with pazsage.ArchiveWriter(path) as archive:
+        archive.add_data("old.txt", b"the previous run")
+    with pytest.raises(RuntimeError):
+        with pazsage.ArchiveWriter(path, volume_bytes=100) as archive:
+            archive.add_data("new-1.txt", os.urandom(200))
+            archive.add_data("new-2.txt", os.urandom(200))
+            raise RuntimeError("the output store went away")
+    assert sorted(os.listdir(tmp_path)) == ["summaries.zip"]
+    with zipfile.ZipFile(path) as zipf:
+        assert zipf.namelist() == ["old.txt"]
@@ -0,0 +1,48 @@
+"""
+Checks for the on-disk caches: least recently used entries go first, and a full cache is trimmed
+well below its limit so it isn't walked again on every write.
+
+Run with:   python -m pytest -q
+"""
+import os
+
+import pazsage
+
+
+def test_evicts_least_recently_used_down_to_the_low_water_mark(tmp_path, monkeypatch):
+    monkeypatch.setattr(pazsage, "CACHE_EVICT_TO", 0.5)
+    cache = pazsage.DiskCache(str(tmp_path / "cache"), 1000, ".bin")
+    for n in range(10):
+        cache.put_bytes(f"{n:02d}", b"x" * 100)
+        # mtimes mark recent use, keep them apart
+        os.utime(cache._path(f"{n:02d}"), (n, n))
+    assert cache.get_bytes("00") == b"x" * 100
+    cache.put_bytes("10", b"x" * 100)
+    kept = sorted(os.path.basename(path)[:2] for path, _, _ in cache._entries())
+    # "00" was just read, "01".."06" are the oldest and go until the cache is at half its size
+    assert kept == ["00", "07", "08", "09", "10"]
+    assert cache.size == 500
+
+
+def test_full_cache_is_not_walked_on_every_write(tmp_path, monkeypatch):
+    cache = pazsage.DiskCache(str(tmp_path / "cache"), 10_000, ".bin")
+    walks = []
+    real_walk = os.walk
+    monkeypatch.setattr(pazsage.os, "walk", lambda *args, **kwargs: walks.append(1) or real_walk(*args, **kwargs))
+    for n in range(200):
+        cache.put_bytes(f"{n:03d}", b"x" * 100)
+    assert cache.size <= 10_000
+    # one walk to learn the size, then one per trim: each trim makes room for about 20 more entries
+    assert len(walks) <= 12
+
+
+def test_refresh_misses_and_invalidate_removes(tmp_path):
+    cache = pazsage.DiskCache(str(tmp_path / "cache"), 10_000, ".bin")
+    cache.put_bytes("ab", b"data")
+    cache.refresh = True
+    assert cache.get_bytes("ab") is None
+    cache.refresh = False
+    assert cache.get_bytes("ab") == b"data"
+    cache.invalidate("ab")
+    assert cache.get_bytes("ab") is None
+    assert cache.size == 0
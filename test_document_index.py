@@ -0,0 +1,56 @@
+"""
+Checks for context selection: chunks are tagged with their section, back matter is left out, and each
+question gets the most relevant chunks that fit its token budget.
+
+Run with:   python -m pytest -q
+"""
+import pazsage
+
+
+def paper(methods_words:int = 50)->str:
+    return "\n".join([
+        "Pollinators at solar parks",
+        "Abstract",
+        "We surveyed bees at solar parks.",
+        "Methods",
+        "We counted bumblebees along transects with generalised linear models. " * methods_words,
+        "Results",
+        "Bee numbers were higher under the panels. " * 50,
+        "References",
+        "Smith A (2020) An unrelated paper. " * 50,
+    ])
+
+
+def test_sections_are_tagged_and_references_dropped():
+    index = pazsage.DocumentIndex(paper())
+    sections = [section for section, _ in index.chunks]
+    assert sections[0] == "front"
+    assert {"abstract", "methods", "results"} <= set(sections)
+    assert "references" not in sections
+    assert "unrelated paper" not in index.select("What are the aims?", 100_000)
+
+
+def test_select_fits_the_budget_and_favours_the_question():
+    index = pazsage.DocumentIndex(paper(methods_words=400))
+    context = index.select("Which statistical methods and transects were used?", 2000, {"methods"})
+    assert pazsage.estimate_tokens(context) <= 2000 + 50
+    assert "We surveyed bees" in context
+    # the methods get most of the budget, the results only what is left
+    assert context.count("generalised linear models") > context.count("under the panels")
+
+
+def test_one_huge_line_is_still_sent():
+    # text extracted without any line breaks
+    text = "Solar parks and pollinators. " * 40_000
+    index = pazsage.DocumentIndex(text)
+    assert max(len(chunk_text) for _, chunk_text in index.chunks) <= pazsage.CHUNK_CHARS
+    context = index.select("What are the aims?", 16_000)
+    assert 0 < pazsage.estimate_tokens(context) <= 16_000 + 50
+
+
+def test_split_long_line_cuts_at_spaces():
+    line = " ".join(["word"] * 1000)
+    pieces = pazsage.split_long_line(line)
+    assert all(len(piece) <= pazsage.CHUNK_CHARS for piece in pieces)
+    assert " ".join(pieces) == line
+    assert pazsage.split_long_line("x" * 3001) == ["x" * 1500, "x" * 1500, "x"]
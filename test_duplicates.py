@@ -0,0 +1,31 @@
+"""
+Checks for finding duplicates: when the paper that owns a DOI or a text ends with no summary,
+the next paper that claims it takes over instead of waiting for a summary that never comes.
+
+Run with:   python -m pytest -q
+"""
+import pazsage
+
+
+def test_doi_passes_to_the_next_claimant_when_the_owner_has_no_summary(tmp_path):
+    finder = pazsage.DuplicateFinder(str(tmp_path / "signatures.json"))
+    assert finder.claim_doi("a", "10.1/X") is None
+    assert finder.claim_doi("b", "https://doi.org/10.1/x") == ("a", "doi", 1.0)
+    assert finder.claim_doi("c", "10.1/x") == ("a", "doi", 1.0)
+    finder.done("a", False)
+    assert finder.wait("a") is False
+    # b claims again first and takes the DOI over, c now waits for b
+    assert finder.claim_doi("b", "10.1/x") is None
+    assert finder.claim_doi("c", "10.1/x") == ("b", "doi", 1.0)
+    finder.done("b", True)
+    assert finder.wait("b") is True
+
+
+def test_text_passes_to_the_next_claimant_when_the_owner_has_no_summary(tmp_path):
+    finder = pazsage.DuplicateFinder(str(tmp_path / "signatures.json"))
+    text = " ".join(f"word{n}" for n in range(200))
+    assert finder.claim_text("a", text) is None
+    assert finder.claim_text("b", text) == ("a", "same text", 1.0)
+    finder.done("a", False)
+    assert finder.claim_text("b", text) is None
+    assert finder.claim_text("c", text.upper()) == ("b", "same text", 1.0)
@@ -0,0 +1,113 @@
+"""
+Checks for the run manifest: finished stages survive a restart, changed items are done again,
+removed items are forgotten with their outputs, and only changed items are written.
+
+Run with:   python -m pytest -q
+"""
+import json
+import os
+
+import pytest
+
+import pazsage
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = pazsage.OutputStore(str(tmp_path / "outputs.sqlite"))
+    yield store
+    store.close()
+
+
+def summarize(manifest, store, key:str, name:str = "001 Paper.txt", model:str = "model-a"):
+    store.put_summary(key, 1, pazsage.RisRecord([f"TI  - Paper {key}"]), name, "A summary.", model)
+    manifest.mark(key, "summarized", model=model, summary_file=name)
+
+
+def test_finished_stages_survive_a_restart(tmp_path, store):
+    manifest = pazsage.RunManifest(store)
+    manifest.start_item("ID:1", "fingerprint", "Paper")
+    summarize(manifest, store, "ID:1")
+    store.put_audio("ID:1", b"RIFF", "001 Paper.wav", "wav", "af_heart")
+    manifest.mark("ID:1", "voiced", voice="af_heart", audio_format="wav", audio_file="001 Paper.wav")
+
+    reopened = pazsage.RunManifest(pazsage.OutputStore(store.path))
+    try:
+        assert reopened.is_done("ID:1", "summarized", model="model-a")
+        assert reopened.is_done("ID:1", "voiced", voice="af_heart", audio_format="wav")
+        # a different model or voice is not done yet
+        assert not reopened.is_done("ID:1", "summarized", model="model-b")
+        assert not reopened.is_done("ID:1", "voiced", voice="am_michael", audio_format="wav")
+    finally:
+        reopened.store.close()
+
+
+def test_changed_items_and_missing_outputs_are_done_again(store):
+    manifest = pazsage.RunManifest(store)
+    manifest.start_item("ID:1", "fingerprint", "Paper")
+    summarize(manifest, store, "ID:1")
+    manifest.start_item("ID:1", "fingerprint", "Paper, retitled")
+    assert manifest.is_done("ID:1", "summarized", model="model-a")
+    manifest.start_item("ID:1", "new files", "Paper, retitled")
+    assert not manifest.is_done("ID:1", "summarized", model="model-a")
+
+    summarize(manifest, store, "ID:1")
+    store.delete("ID:1")
+    assert not manifest.is_done("ID:1", "summarized", model="model-a")
+
+
+def test_a_new_summary_clears_the_later_stages(store):
+    manifest = pazsage.RunManifest(store)
+    summarize(manifest, store, "ID:1")
+    manifest.mark("ID:1", "voiced", voice="af_heart", audio_format="wav", audio_file="001 Paper.wav")
+    manifest.mark_all("packaged", after="voiced")
+    summarize(manifest, store, "ID:1")
+    assert manifest.items["ID:1"]["stages"] == {"summarized": True}
+    assert "audio_file" not in manifest.items["ID:1"]
+
+
+def test_prune_forgets_removed_items_and_their_outputs(store):
+    manifest = pazsage.RunManifest(store)
+    summarize(manifest, store, "ID:1", "001 One.txt")
+    summarize(manifest, store, "ID:2", "002 Two.txt")
+    manifest.prune(["ID:2"])
+    assert list(manifest.items) == ["ID:2"]
+    assert list(store.load_manifest()) == ["ID:2"]
+    assert not store.has_summary("ID:1")
+    assert store.has_summary("ID:2")
+
+
+def test_rename_outputs_follows_the_new_position(store):
+    manifest = pazsage.RunManifest(store)
+    summarize(manifest, store, "ID:1", "1 Paper.txt")
+    store.put_audio("ID:1", b"RIFF", "1 Paper.wav", "wav", "af_heart")
+    manifest.mark("ID:1", "voiced", voice="af_heart", audio_format="wav", audio_file="1 Paper.wav")
+    manifest.rename_outputs("ID:1", "02 Paper.txt", 2)
+    assert manifest.is_done("ID:1", "voiced", voice="af_heart", audio_format="wav")
+    assert store.get_audio("ID:1")[0] == "02 Paper.wav"
+    assert store.select()[0]["position"] == 2
+
+
+def test_save_writes_only_changed_items(store, monkeypatch):
+    manifest = pazsage.RunManifest(store)
+    for n in range(100):
+        manifest.start_item(f"ID:{n}", f"fingerprint {n}", f"Paper {n}", save=False)
+    manifest.save()
+    written = []
+    real_save = store.save_manifest
+    monkeypatch.setattr(store, "save_manifest", lambda entries, removed=(): written.append(set(entries)) or real_save(entries, removed))
+    for n in range(100):
+        manifest.start_item(f"ID:{n}", f"fingerprint {n}", f"Paper {n}", save=False)
+    manifest.save()
+    summarize(manifest, store, "ID:7")
+    manifest.mark_all("packaged", after="voiced")
+    assert written == [{"ID:7"}]
+
+
+def test_imports_a_legacy_manifest_file(tmp_path, store):
+    legacy = tmp_path / "manifest.json"
+    legacy.write_text(json.dumps({"items": {"ID:1": {"stages": {"extracted": True}, "title": "Paper", "fingerprint": "f"}}}))
+    manifest = pazsage.RunManifest(store, legacy_path=str(legacy))
+    assert manifest.is_done("ID:1", "extracted")
+    assert not os.path.exists(str(legacy))
+    assert store.load_manifest()["ID:1"]["title"] == "Paper"
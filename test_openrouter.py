@@ -0,0 +1,181 @@
+"""
+Checks for the OpenRouter client: retries, rate limiting and streaming (against pazbench's mock server).
+
+Run with:   python -m pytest -q
+"""
+import threading
+import time
+
+import pytest
+
+import pazbench
+import pazsage
+
+
+@pytest.fixture(autouse=True)
+def fresh_run(tmp_path, monkeypatch):
+    """Every test gets its own summary cache and metrics, and no long retry waits."""
+    monkeypatch.setattr(pazsage, "summary_cache", pazsage.SummaryCache(str(tmp_path / "summaries"), 10 ** 8))
+    monkeypatch.setattr(pazsage, "RETRY_MAX_DELAY", 0.05)
+    pazsage.run_metrics.reset()
+    yield
+    pazsage._request_slots.set_max(pazsage.MAX_CONCURRENT_REQUESTS)
+    with pazsage._request_slots.condition:
+        pazsage._request_slots.limit = pazsage.MAX_CONCURRENT_REQUESTS
+        pazsage._request_slots.paused_until = 0.0
+
+
+class FlakyServer(pazbench.MockChatServer):
+    """Answers the first request with a 429 or a 500, then normally."""
+    def count(self, name:str, value:int = 1):
+        super().count(name, value)
+        if name == "errors":
+            self.error_rate = 0.0
+
+
+def start_server(server_class=pazbench.MockChatServer, error_rate:float = 0.0):
+    server = server_class(latency=0.0, jitter=0.0, error_rate=error_rate, completion_tokens=40,
+                          cost_per_mtok=1.0, vocabulary=["solar", "panel", "grazing", "beetle"])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def ask(server, on_text=None)->dict:
+    return pazsage.openroute("What are the aims?", "A paper about solar parks.", "test-model", "key", server.url, on_text=on_text)
+
+
+# ---------------------------------------------------------------
+# OpenRouter client
+
+def test_openroute_answers_and_caches():
+    server = start_server()
+    try:
+        result = ask(server)
+        assert result["choices"][0]["message"]["content"]
+        assert result["usage"]["completion_tokens"] == 40
+        assert ask(server) == result
+        assert server.drain_stats()["requests"] == 1
+        assert pazsage.run_metrics.counters["openroute_cache_hits"] == 1
+    finally:
+        server.shutdown()
+
+
+def test_openroute_retries_429_and_5xx():
+    server = start_server(FlakyServer, error_rate=1.0)
+    try:
+        result = ask(server)
+        stats = server.drain_stats()
+        assert "error" not in result
+        assert stats["errors"] == 1 and stats["requests"] == 1
+        assert pazsage.run_metrics.counters["openroute_retries"] == 1
+    finally:
+        server.shutdown()
+
+
+def test_openroute_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(pazsage, "MAX_RETRIES", 2)
+    server = start_server(error_rate=1.0)
+    try:
+        result = ask(server)
+        assert "error" in result
+        assert server.drain_stats()["errors"] == 3
+        # a failed answer is never cached
+        assert list(pazsage.summary_cache._entries()) == []
+    finally:
+        server.shutdown()
+
+
+def test_openroute_streams_event_stream():
+    server = start_server()
+    try:
+        pieces = []
+        result = ask(server, on_text=pieces.append)
+        assert len(pieces) > 1
+        assert "".join(pieces) == result["choices"][0]["message"]["content"]
+        assert result["usage"]["completion_tokens"] == 40
+    finally:
+        server.shutdown()
+
+
+class FakeStream:
+    def __init__(self, lines:list):
+        self.lines = lines
+        self.encoding = None
+
+    def iter_lines(self, decode_unicode:bool = False):
+        return iter(self.lines)
+
+
+def test_read_event_stream_skips_comments_and_stops_at_done():
+    pieces = []
+    result = pazsage.read_event_stream(FakeStream([
+        ": OPENROUTER PROCESSING", "",
+        'data: {"choices": [{"delta": {"content": "Solar "}}]}', "",
+        'data: {"choices": [{"delta": {"role": "assistant"}}]}', "",
+        'data: {"choices": [{"delta": {"content": "parks."}}]}', "",
+        'data: {"choices": [], "usage": {"total_tokens": 7}}', "",
+        "data: [DONE]",
+        'data: {"choices": [{"delta": {"content": "after done"}}]}',
+    ]), pieces.append)
+    assert pieces == ["Solar ", "parks."]
+    assert result == {"choices": [{"message": {"role": "assistant", "content": "Solar parks."}}], "usage": {"total_tokens": 7}}
+
+
+def test_read_event_stream_returns_provider_error():
+    result = pazsage.read_event_stream(FakeStream([
+        'data: {"choices": [{"delta": {"content": "Solar "}}]}',
+        'data: {"error": {"code": 502, "message": "provider went away"}}',
+    ]), lambda text: None)
+    assert result == {"error": {"code": 502, "message": "provider went away"}}
+
+
+def test_retry_delay_uses_retry_after(monkeypatch):
+    monkeypatch.setattr(pazsage, "RETRY_MAX_DELAY", 120)
+    assert pazsage.retry_delay(0, "3") == 3.0
+    assert pazsage.retry_delay(0, "1000") == 120
+    assert pazsage.retry_delay(0, "-5") == 0.0
+    soon = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    assert 25 <= pazsage.retry_delay(0, soon) <= 30
+    for attempt in range(4):
+        assert 0 <= pazsage.retry_delay(attempt, None) <= pazsage.RETRY_BASE_DELAY * 2 ** attempt
+    assert 0 <= pazsage.retry_delay(2, "not a date") <= pazsage.RETRY_BASE_DELAY * 4
+
+
+def test_request_limiter_caps_requests_in_flight():
+    limiter = pazsage.RequestLimiter(2)
+    lock = threading.Lock()
+    state = {"now": 0, "most": 0}
+
+    def request():
+        with limiter:
+            with lock:
+                state["now"] += 1
+                state["most"] = max(state["most"], state["now"])
+            time.sleep(0.02)
+            with lock:
+                state["now"] -= 1
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert state["most"] == 2
+
+
+def test_request_limiter_backs_off_and_ramps_up():
+    limiter = pazsage.RequestLimiter(8)
+    limiter.throttled(0.2)
+    assert limiter.limit == 4
+    t0 = time.monotonic()
+    with limiter:
+        pass
+    assert time.monotonic() - t0 >= 0.15
+    # one slot comes back after as many successes in a row as the current cap
+    for _ in range(4):
+        limiter.success()
+    assert limiter.limit == 5
+    limiter.throttled(0)
+    limiter.throttled(0)
+    limiter.throttled(0)
+    assert limiter.limit == 1
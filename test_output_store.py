@@ -0,0 +1,68 @@
+"""
+Checks for the output store: lookups by key (following duplicates), partial selections by year,
+author and tag, and exporting a selection as zip files.
+
+Run with:   python -m pytest -q
+"""
+import zipfile
+
+import pytest
+
+import pazsage
+
+
+def record(title:str, year:str, authors:list, keywords:list)->pazsage.RisRecord:
+    return pazsage.RisRecord([f"TI  - {title}", f"PY  - {year}"] + [f"AU  - {author}" for author in authors]
+                             + [f"KW  - {keyword}" for keyword in keywords])
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = pazsage.OutputStore(str(tmp_path / "outputs.sqlite"))
+    store.put_summary("ID:1", 1, record("Bees", "2020", ["Smith, A", "Jones, B"], ["pollinators", "solar"]), "1 Bees.txt", "About bees.", "m")
+    store.put_audio("ID:1", b"bee audio", "1 Bees.wav", "wav", "af_heart")
+    store.put_summary("ID:2", 2, record("Sheep", "2021", ["Brown, C"], ["grazing", "Solar"]), "2 Sheep.txt", "About sheep.", "m")
+    store.put_duplicate("ID:3", 3, record("Bees (preprint)", "2019", ["Smith, A"], []), "ID:1")
+    yield store
+    store.close()
+
+
+def test_get_follows_duplicates(store):
+    item = store.get("ID:3")
+    assert item["summary"] == "About bees."
+    assert item["duplicate_of"] == "ID:1"
+    assert item["authors"] == ["Smith, A"]
+    assert store.get_audio("ID:3") == ("1 Bees.wav", b"bee audio")
+    assert store.get("ID:9") is None
+
+
+def test_select_by_year_author_and_tag(store):
+    assert [item["key"] for item in store.select()] == ["ID:1", "ID:2"]
+    assert [item["key"] for item in store.select(year="2021")] == ["ID:2"]
+    assert [item["key"] for item in store.select(author="smith")] == ["ID:1"]
+    assert [item["key"] for item in store.select(tag="SOLAR")] == ["ID:1", "ID:2"]
+    assert store.select(year="2020", tag="grazing") == []
+
+
+def test_a_new_summary_drops_the_old_audio(store):
+    store.put_summary("ID:1", 1, record("Bees", "2020", ["Smith, A"], []), "1 Bees.txt", "About bees, again.", "m")
+    assert store.get_audio("ID:1") is None
+    assert store.get("ID:1")["tags"] == []
+
+
+def test_prune_and_rename(store):
+    store.rename("ID:1", "01 Bees.txt", 5)
+    assert store.get_audio("ID:1")[0] == "01 Bees.wav"
+    store.prune({"ID:1", "ID:3"})
+    assert [item["key"] for item in store.select()] == ["ID:1"]
+    assert [item["key"] for item in store.select(author="brown")] == []
+
+
+def test_export_writes_the_selected_items(tmp_path, store):
+    audio, summaries, count = pazsage.export_output_store(store.path, str(tmp_path / "out"), tag="pollinators")
+    assert count == 1
+    with zipfile.ZipFile(summaries[0]) as zipf:
+        assert zipf.namelist() == ["1 Bees.txt"]
+        assert zipf.read("1 Bees.txt") == b"About bees."
+    with zipfile.ZipFile(audio[0]) as zipf:
+        assert zipf.namelist() == ["1 Bees.wav"]
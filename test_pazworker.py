@@ -0,0 +1,91 @@
+"""
+Checks for the sharded workers' job store: leases, retries and loading an updated library.
+
+Run with:   python -m pytest -q
+"""
+import time
+
+import pazsage
+import pazworker
+
+
+# ---------------------------------------------------------------
+# leases
+
+def queue_items(path:str, count:int)->pazworker.JobStore:
+    store = pazworker.JobStore(path)
+    items = [(f"ID:{n}", n, pazsage.RisRecord([f"TI  - Paper {n}"]), f"fingerprint {n}") for n in range(1, count + 1)]
+    store.enqueue(items, {"model": "test-model"})
+    return store
+
+
+def test_claim_leases_each_item_to_one_worker(tmp_path):
+    store = queue_items(str(tmp_path / "jobs.sqlite"), 3)
+    try:
+        first = [row["key"] for row in store.claim("w1", 2)]
+        second = [row["key"] for row in store.claim("w2", 2)]
+        assert first == ["ID:1", "ID:2"]
+        assert second == ["ID:3"]
+        assert store.claim("w3", 2) == []
+        assert store.counts() == {"leased": 3}
+    finally:
+        store.close()
+
+
+def test_claim_reclaims_expired_leases_until_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(pazworker, "LEASE_SECONDS", 0.05)
+    monkeypatch.setattr(pazworker, "MAX_ATTEMPTS", 2)
+    store = queue_items(str(tmp_path / "jobs.sqlite"), 2)
+    try:
+        assert len(store.claim("w1", 2)) == 2
+        time.sleep(0.1)
+        # w1 still renews one lease, the other runs out and goes to w2
+        monkeypatch.setattr(pazworker, "LEASE_SECONDS", 60)
+        assert store.heartbeat("w1", ["ID:1"]) == 1
+        assert [row["key"] for row in store.claim("w2", 2)] == ["ID:2"]
+        assert {row["key"]: (row["worker"], row["attempts"]) for row in store.rows()} == {"ID:1": ("w1", 1), "ID:2": ("w2", 2)}
+        # a lease that runs out on the last attempt fails the item instead of handing it out again
+        monkeypatch.setattr(pazworker, "LEASE_SECONDS", 0.05)
+        assert store.heartbeat("w2", ["ID:2"]) == 1
+        time.sleep(0.1)
+        assert store.claim("w3", 2) == []
+        failed = store.rows("failed")
+        assert [row["key"] for row in failed] == ["ID:2"]
+        assert failed[0]["error"] == "lease expired on the last attempt"
+    finally:
+        store.close()
+
+
+def test_fail_requeues_until_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(pazworker, "MAX_ATTEMPTS", 2)
+    store = queue_items(str(tmp_path / "jobs.sqlite"), 1)
+    try:
+        store.claim("w1", 1)
+        store.fail("ID:1", "w1", "no summary")
+        assert store.counts() == {"pending": 1}
+        store.claim("w1", 1)
+        store.fail("ID:1", "w1", "no summary")
+        assert store.counts() == {"failed": 1}
+        assert store.claim("w1", 1) == []
+    finally:
+        store.close()
+
+
+# ---------------------------------------------------------------
+# enqueue
+
+def test_enqueue_keeps_finished_items_that_only_moved(tmp_path):
+    store = queue_items(str(tmp_path / "jobs.sqlite"), 3)
+    try:
+        for row in store.claim("w1", 3):
+            store.complete(row["key"], "w1", f"summary {row['key']}", None)
+        # a new item at the top of the library moves every other item down one place
+        items = [("ID:0", 1, pazsage.RisRecord(["TI  - Paper 0"]), "fingerprint 0")]
+        items += [(f"ID:{n}", n + 1, pazsage.RisRecord([f"TI  - Paper {n}"]), f"fingerprint {n}") for n in range(1, 4)]
+        items[2] = ("ID:2", 3, pazsage.RisRecord(["TI  - Paper 2, revised"]), "fingerprint 2b")
+        counts = store.enqueue(items, {"model": "test-model"})
+        assert counts == {"added": 1, "changed": 1, "moved": 2, "unchanged": 0, "removed": 0}
+        assert store.counts() == {"done": 2, "pending": 2}
+        assert {row["key"]: row["position"] for row in store.rows("done")} == {"ID:1": 2, "ID:3": 4}
+    finally:
+        store.close()
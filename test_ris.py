@@ -0,0 +1,42 @@
+"""
+Checks for the RIS reader: Windows line endings, continuation lines, a byte order mark and a missing ER.
+
+Run with:   python -m pytest -q
+"""
+import pazsage
+
+
+# ---------------------------------------------------------------
+# RIS parsing
+
+def test_read_ris_records_crlf_continuations_and_missing_er(tmp_path):
+    ris = tmp_path / "library.ris"
+    ris.write_bytes(("﻿TY  - JOUR\r\n"
+                     "TI  - Agrivoltaics and\r\n"
+                     " pollinators\r\n"
+                     "AU  - Smith, A\r\n"
+                     "AU  - Jones, B\r\n"
+                     "PY  - 2020\r\n"
+                     "DO  - 10.1000/ABC\r\n"
+                     "KW  - solar\r\n"
+                     "L1  - files/1/paper.pdf\r\n"
+                     "ER  - \r\n"
+                     "\r\n"
+                     "TY  - RPRT\r\n"
+                     "TI  - No closing tag\r\n").encode("utf-8"))
+    records = list(pazsage.read_ris_records(str(ris)))
+    assert len(records) == 2
+    first, second = records
+    assert first.ris_type == "JOUR"
+    assert first.title == "Agrivoltaics and pollinators"
+    assert first.authors == ["Smith, A", "Jones, B"]
+    assert (first.year, first.doi, first.files, first.keywords) == ("2020", "10.1000/ABC", ["files/1/paper.pdf"], ["solar"])
+    assert not any("\r" in line for line in first.lines)
+    assert (second.ris_type, second.title, second.authors) == ("RPRT", "No closing tag", [])
+
+
+def test_read_ris_records_ignores_lines_outside_records(tmp_path):
+    ris = tmp_path / "library.ris"
+    ris.write_text("stray text\nTY  - JOUR\nTI  - Only\nER  -\n", encoding="utf-8")
+    records = list(pazsage.read_ris_records(str(ris)))
+    assert [record.title for record in records] == ["Only"]
@@ -0,0 +1,79 @@
+"""
+Checks for streaming answers into speech: sentences come out in summary order however the answers
+arrive, split the same way as the finished summary so they share the audio cache.
+
+Run with:   python -m pytest -q
+"""
+import queue
+
+import pazsage
+
+HEADER = "Bees at solar parks Authors: Smith, A"
+ANSWERS = ["The aim was to count bees. Two sites were used.",
+           "Transects were walked. Counts were modelled!",
+           "Bees were more common under panels? Yes, by 20 percent."]
+
+
+def expected_sentences(answers:list)->list:
+    return pazsage.split_speech_segments(pazsage.clean_text_for_speech(HEADER + "\n\n" + "\n\n".join(answers)))
+
+
+def pieces(text:str, size:int = 7)->list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_sentences_come_out_in_summary_order():
+    stream = pazsage.SpeechStream(3, HEADER)
+    # the later answers arrive (and finish) first
+    for part in (2, 1):
+        for piece in pieces(ANSWERS[part]):
+            stream.feed(part, piece)
+        stream.finish(part, ANSWERS[part])
+    for piece in pieces(ANSWERS[0]):
+        stream.feed(0, piece)
+    stream.finish(0, ANSWERS[0])
+    stream.close()
+    assert list(stream) == expected_sentences(ANSWERS)
+
+
+def test_the_answer_being_read_is_passed_on_as_it_arrives():
+    stream = pazsage.SpeechStream(3, HEADER)
+    stream.feed(1, ANSWERS[1])
+    stream.feed(0, "The aim was to count bees. Two si")
+    ready = []
+    while True:
+        try:
+            ready.append(stream.sentences.get_nowait())
+        except queue.Empty:
+            break
+    # the complete sentences of the first answer (the header has no full stop, so it joins the first one),
+    # nothing of the second answer yet
+    assert ready == expected_sentences([ANSWERS[0]])[:-1]
+
+
+def test_an_answer_that_broke_off_is_replaced_by_its_final_text():
+    stream = pazsage.SpeechStream(2, HEADER)
+    stream.feed(0, "The aim was to count bees. Two si")
+    stream.feed(1, ANSWERS[1])
+    note = "Error generating part of summary."
+    stream.finish(0, note)
+    stream.finish(1, ANSWERS[1])
+    stream.close()
+    # the sentence already read out stays, the unfinished one is dropped
+    assert list(stream) == expected_sentences(["The aim was to count bees.", ANSWERS[1]])[:-2] + \
+        [note] + pazsage.split_speech_segments(ANSWERS[1])
+
+
+def test_close_passes_on_unfinished_answers():
+    stream = pazsage.SpeechStream(3, HEADER)
+    stream.feed(0, ANSWERS[0])
+    stream.feed(2, ANSWERS[2])
+    stream.close()
+    assert list(stream) == expected_sentences([ANSWERS[0], "", ANSWERS[2]])
+
+
+def test_single_request_summary():
+    stream = pazsage.SpeechStream(3, HEADER)
+    stream.finish_text("\n\n".join(ANSWERS))
+    stream.close()
+    assert list(stream) == expected_sentences(ANSWERS)